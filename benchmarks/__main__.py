@@ -0,0 +1,178 @@
+"""Times real branch switches in a generated django project.
+
+    python -m benchmarks --apps 20 --migrations 50 --divergence 5 --rows 10000
+
+For each strategy a copy of the generated project has its post-checkout hook
+changed to pass the strategy's options, then the branches are switched back
+and forth through git and each checkout is timed. Results can be saved and
+compared against a previous run to spot regressions.
+"""
+
+import argparse
+import json
+import shutil
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+from dataclasses import asdict
+from pathlib import Path
+
+from benchmarks.project import BRANCHES, Options, Project, applied_branch_migrations
+
+# The options passed to 'migrant migrate' by the hook, for each strategy.
+STRATEGIES = {
+    "checkout": [],
+    "no-checkout": ["--no-checkout"],
+    "graph-cache": ["--no-checkout", "--graph-cache"],
+    "snapshots": ["--snapshots"],
+}
+
+HOOK_INVOCATION = './manage.py migrant migrate "$1" "$2"'
+
+
+def configure_hook(path: Path, flags):
+    hook = path / ".git" / "hooks" / "post-checkout"
+    content = hook.read_text()
+    if HOOK_INVOCATION not in content:
+        raise RuntimeError(f"Couldn't find '{HOOK_INVOCATION}' in {hook}.")
+    invocation = " ".join(["./manage.py migrant migrate", *flags, '"$1" "$2"'])
+    hook.write_text(content.replace(HOOK_INVOCATION, invocation))
+
+
+def switch(path: Path, branch: str, expected: int) -> float:
+    """Checks out a branch, returning how long the checkout (and hook) took."""
+    began = time.perf_counter()
+    result = subprocess.run(
+        ["git", "checkout", "--quiet", branch],
+        cwd=path,
+        capture_output=True,
+        text=True,
+    )
+    elapsed = time.perf_counter() - began
+
+    applied = applied_branch_migrations(path, branch)
+    if result.returncode or applied != expected:
+        sys.stderr.write(result.stdout + result.stderr)
+        raise RuntimeError(
+            f"Checking out {branch} left {applied} of its {expected} migrations "
+            "applied."
+        )
+    return elapsed
+
+
+def bench(template: Path, workdir: Path, strategy: str, options, repeat: int):
+    path = workdir / strategy
+    shutil.copytree(template, path, symlinks=True)
+    configure_hook(path, STRATEGIES[strategy])
+
+    expected = options.apps * options.divergence
+    timings = {f"{BRANCHES[0]}->{BRANCHES[1]}": [], f"{BRANCHES[1]}->{BRANCHES[0]}": []}
+    for _ in range(repeat):
+        for source, target in (BRANCHES, BRANCHES[::-1]):
+            timings[f"{source}->{target}"].append(switch(path, target, expected))
+    return timings
+
+
+def report(results, baseline=None):
+    for strategy, timings in results.items():
+        for direction, samples in timings.items():
+            line = (
+                f"{strategy:<12} {direction:<5} "
+                f"min {min(samples):7.3f}s  median {statistics.median(samples):7.3f}s"
+                f"  max {max(samples):7.3f}s"
+            )
+            try:
+                before = statistics.median(baseline[strategy][direction])
+            except (KeyError, TypeError):
+                pass
+            else:
+                change = statistics.median(samples) / before - 1
+                line += f"  ({change:+.0%} on baseline)"
+            print(line)
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(prog="python -m benchmarks")
+    parser.add_argument("--apps", type=int, default=Options.apps)
+    parser.add_argument(
+        "--migrations",
+        type=int,
+        default=Options.migrations,
+        help="Migrations per app shared by both branches.",
+    )
+    parser.add_argument(
+        "--cross-dependencies",
+        type=float,
+        default=Options.cross_dependencies,
+        help="Chance of each model having a foreign key to another app.",
+    )
+    parser.add_argument(
+        "--divergence",
+        type=int,
+        default=Options.divergence,
+        help="Migrations per app on each branch but not the other.",
+    )
+    parser.add_argument(
+        "--rows", type=int, default=Options.rows, help="Rows in each table."
+    )
+    parser.add_argument("--seed", type=int, default=Options.seed)
+    parser.add_argument(
+        "--strategy",
+        action="append",
+        dest="strategies",
+        choices=STRATEGIES,
+        help="May be given more than once. Default: checkout and no-checkout.",
+    )
+    parser.add_argument(
+        "--repeat", type=int, default=3, help="Round trips per strategy."
+    )
+    parser.add_argument(
+        "--workdir",
+        type=Path,
+        help="Where to generate the projects. Default: a temporary directory, "
+        "removed afterwards.",
+    )
+    parser.add_argument("--output", type=Path, help="Save the results as JSON.")
+    parser.add_argument(
+        "--baseline", type=Path, help="Compare with results saved by --output."
+    )
+    args = parser.parse_args(argv)
+
+    options = Options(
+        apps=args.apps,
+        migrations=args.migrations,
+        cross_dependencies=args.cross_dependencies,
+        divergence=args.divergence,
+        rows=args.rows,
+        seed=args.seed,
+    )
+    strategies = args.strategies or ["checkout", "no-checkout"]
+
+    with tempfile.TemporaryDirectory() as temp_dir:
+        workdir = args.workdir or Path(temp_dir)
+        template = workdir / "template"
+        print(f"Generating project in {template}...")
+        began = time.perf_counter()
+        Project(template, options).generate()
+        print(f"Generated in {time.perf_counter() - began:.1f}s.")
+
+        results = {}
+        for strategy in strategies:
+            print(f"Running {strategy}...")
+            results[strategy] = bench(template, workdir, strategy, options, args.repeat)
+
+    baseline = None
+    if args.baseline:
+        with open(args.baseline) as fh:
+            baseline = json.load(fh)["results"]
+    report(results, baseline)
+
+    if args.output:
+        with open(args.output, "w") as fh:
+            json.dump({"options": asdict(options), "results": results}, fh, indent=2)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,262 @@
+"""Generates a throwaway git repo containing a django project to benchmark.
+
+The project has a number of apps, each with a chain of migrations that create
+models, some of which have foreign keys to models in other apps. Two branches,
+"a" and "b", diverge from "main" by adding fields to those models, so switching
+between them means rolling one branch's migrations back and applying the
+other's. The tables are filled with rows so that the sqlite table rebuilds
+caused by adding a field cost something.
+"""
+
+import copy
+import os
+import random
+import sqlite3
+import subprocess
+import sys
+from dataclasses import dataclass
+from pathlib import Path
+
+BRANCHES = ("a", "b")
+
+MANAGE = """\
+#!{interpreter}
+import os
+import sys
+
+if __name__ == "__main__":
+    os.environ.setdefault("DJANGO_SETTINGS_MODULE", "project.settings")
+    from django.core.management import execute_from_command_line
+
+    execute_from_command_line(sys.argv)
+"""
+
+SETTINGS = """\
+from pathlib import Path
+
+BASE_DIR = Path(__file__).resolve().parent.parent
+SECRET_KEY = "benchmark"
+DEBUG = False
+INSTALLED_APPS = [
+    "django.contrib.contenttypes",
+    "django_migrant",
+{apps}]
+DATABASES = {{
+    "default": {{
+        "ENGINE": "django.db.backends.sqlite3",
+        "NAME": BASE_DIR / "db.sqlite3",
+    }}
+}}
+DEFAULT_AUTO_FIELD = "django.db.models.AutoField"
+USE_TZ = True
+"""
+
+MIGRATION = """\
+import django.db.models.deletion
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+{dependencies}    ]
+
+    operations = [
+{operations}    ]
+"""
+
+ID_FIELD = (
+    "models.AutoField(auto_created=True, primary_key=True, serialize=False, "
+    'verbose_name="ID")'
+)
+
+
+@dataclass
+class Options:
+    apps: int = 5
+    migrations: int = 10
+    cross_dependencies: float = 0.2
+    divergence: int = 3
+    rows: int = 1000
+    seed: int = 0
+
+
+class Model:
+    def __init__(self, app, name, foreign_key=None):
+        self.app = app
+        self.name = name
+        self.foreign_key = foreign_key
+        self.extra_fields = []
+
+    @property
+    def table(self):
+        return f"{self.app}_{self.name.lower()}"
+
+    def source(self):
+        lines = [
+            f"class {self.name}(models.Model):",
+            "    name = models.CharField(max_length=100)",
+            "    value = models.IntegerField(default=0)",
+        ]
+        if self.foreign_key:
+            lines.append(
+                f'    fk = models.ForeignKey("{self.foreign_key}", null=True, '
+                'on_delete=models.CASCADE, related_name="+")'
+            )
+        for field in self.extra_fields:
+            lines.append(f"    {field} = models.IntegerField(default=0)")
+        return "\n".join(lines) + "\n"
+
+
+class Project:
+    def __init__(self, path: Path, options: Options):
+        self.path = path
+        self.options = options
+        self.random = random.Random(options.seed)
+        self.apps = [f"app{i}" for i in range(options.apps)]
+        # The models, and the last migration, of each app on the current branch.
+        self.models = {app: [] for app in self.apps}
+        self.leaf = {app: None for app in self.apps}
+
+    def run(self, *args, **kwargs):
+        return subprocess.run(
+            args, cwd=self.path, check=True, capture_output=True, text=True, **kwargs
+        )
+
+    def manage(self, *args):
+        # The hooks aren't installed yet, so nothing else happens on checkout.
+        return self.run(sys.executable, "manage.py", *args)
+
+    def write(self, relative_path, content):
+        path = self.path / relative_path
+        path.parent.mkdir(parents=True, exist_ok=True)
+        path.write_text(content)
+
+    def commit(self, message):
+        self.run("git", "add", "-A")
+        self.run("git", "commit", "--quiet", "-m", message)
+
+    def write_models(self, app):
+        body = "\n\n".join(model.source() for model in self.models[app])
+        self.write(f"{app}/models.py", "from django.db import models\n\n\n" + body)
+
+    def write_migration(self, app, name, dependencies, operations):
+        if self.leaf[app]:
+            dependencies = [(app, self.leaf[app]), *dependencies]
+        self.write(
+            f"{app}/migrations/{name}.py",
+            MIGRATION.format(
+                dependencies="".join(f"        {d!r},\n" for d in dependencies),
+                operations="".join(f"        {o},\n" for o in operations),
+            ),
+        )
+        self.leaf[app] = name
+        self.write_models(app)
+
+    def create_model(self, app, number):
+        model = Model(app, f"Model{number}")
+        dependencies = []
+        fields = [
+            f'("id", {ID_FIELD})',
+            '("name", models.CharField(max_length=100))',
+            '("value", models.IntegerField(default=0))',
+        ]
+        # Only depend on apps created earlier, to keep the graph acyclic.
+        index = self.apps.index(app)
+        if index and self.random.random() < self.options.cross_dependencies:
+            other = self.random.choice(self.apps[:index])
+            target = self.random.choice(self.models[other])
+            model.foreign_key = f"{other}.{target.name}"
+            dependencies.append((other, self.leaf[other]))
+            fields.append(
+                '("fk", models.ForeignKey(null=True, '
+                "on_delete=django.db.models.deletion.CASCADE, "
+                f'related_name="+", to="{other}.{target.name.lower()}"))'
+            )
+        self.models[app].append(model)
+        operation = (
+            f'migrations.CreateModel(name="{model.name}", '
+            f"fields=[{', '.join(fields)}])"
+        )
+        name = "0001_initial" if number == 1 else f"{number:04d}_model{number}"
+        self.write_migration(app, name, dependencies, [operation])
+
+    def add_field(self, app, branch, step):
+        # Spread the new fields over the models, so each rebuild copies rows.
+        models = self.models[app]
+        model = models[(step - 1) % len(models)]
+        field = f"{branch}_{step}"
+        model.extra_fields.append(field)
+        operation = (
+            f'migrations.AddField(model_name="{model.name.lower()}", '
+            f'name="{field}", field=models.IntegerField(default=0))'
+        )
+        number = self.options.migrations + step
+        self.write_migration(app, f"{number:04d}_{field}", [], [operation])
+
+    def fill_tables(self):
+        db = sqlite3.connect(self.path / "db.sqlite3")
+        rows = [(f"row {i}", i) for i in range(self.options.rows)]
+        with db:
+            for app in self.apps:
+                for model in self.models[app]:
+                    db.executemany(
+                        f"INSERT INTO {model.table} (name, value) VALUES (?, ?)", rows
+                    )
+        db.close()
+
+    def generate(self):
+        self.path.mkdir(parents=True)
+        self.run("git", "init", "--quiet", "--initial-branch", "main")
+        self.run("git", "config", "user.name", "benchmark")
+        self.run("git", "config", "user.email", "benchmark@example.com")
+
+        self.write(".gitignore", "db.sqlite3\n__pycache__/\n")
+        self.write("manage.py", MANAGE.format(interpreter=sys.executable))
+        os.chmod(self.path / "manage.py", 0o755)
+        self.write("project/__init__.py", "")
+        self.write(
+            "project/settings.py",
+            SETTINGS.format(apps="".join(f'    "{app}",\n' for app in self.apps)),
+        )
+        for app in self.apps:
+            self.write(f"{app}/__init__.py", "")
+            self.write(f"{app}/migrations/__init__.py", "")
+
+        # Create the models breadth first, so later apps have something to
+        # depend on whatever their position in the chain.
+        for number in range(1, self.options.migrations + 1):
+            for app in self.apps:
+                self.create_model(app, number)
+        self.commit("Create models")
+        self.manage("migrate")
+        self.fill_tables()
+
+        base_models, base_leaf = self.models, self.leaf
+        for branch in BRANCHES:
+            self.run("git", "checkout", "--quiet", "-b", branch, "main")
+            self.models, self.leaf = copy.deepcopy(base_models), dict(base_leaf)
+            for step in range(1, self.options.divergence + 1):
+                for app in self.apps:
+                    self.add_field(app, branch, step)
+                self.commit(f"Branch {branch}, step {step}")
+
+        # Start out on the first branch, fully migrated.
+        self.run("git", "checkout", "--quiet", BRANCHES[0])
+        self.manage("migrate")
+        self.manage("migrant", "install", ".", "--interpreter", sys.executable)
+        for hook in ("post-checkout", "pre-rebase", "post-rewrite"):
+            os.chmod(self.path / ".git" / "hooks" / hook, 0o755)
+
+
+def applied_branch_migrations(path: Path, branch: str) -> int:
+    """Counts the migrations from the given branch applied to the database."""
+    db = sqlite3.connect(path / "db.sqlite3")
+    try:
+        (count,) = db.execute(
+            "SELECT COUNT(*) FROM django_migrations WHERE name LIKE ? ESCAPE '\\'",
+            (f"%\\_{branch}\\_%",),
+        ).fetchone()
+    finally:
+        db.close()
+    return count
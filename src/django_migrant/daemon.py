@@ -0,0 +1,115 @@
+"""A thin client for a warm migrant process.
+
+`./manage.py migrant serve` keeps django set up and listens on a unix socket in
+the git directory. The post-checkout hook then runs
+
+    python -m django_migrant.daemon "$1" "$2"
+
+which hands the checkout to that process and streams back its output, without
+starting django itself. When no daemon is listening it exits with status 75 and
+the hook falls back to running `./manage.py migrant migrate` as usual.
+
+This module deliberately doesn't import django.
+"""
+
+import contextlib
+import io
+import json
+import os
+import socket
+import socketserver
+import sys
+
+from django_migrant import git
+
+NO_DAEMON = 75  # EX_TEMPFAIL
+SOCKET_FILENAME = "daemon.sock"
+# Marks the line carrying the exit status, at the end of the output.
+EXIT_MARKER = "\0"
+# How long to wait for the daemon to take the request, in seconds.
+CONNECT_TIMEOUT = 5
+
+
+def socket_path():
+    return git.migrant_dir() / SOCKET_FILENAME
+
+
+def request(previous, current, stdout=None):
+    """Asks the daemon to migrate, returning its exit status or None if absent."""
+    stdout = stdout or sys.stdout
+    with socket.socket(socket.AF_UNIX, socket.SOCK_STREAM) as sock:
+        sock.settimeout(CONNECT_TIMEOUT)
+        try:
+            sock.connect(str(socket_path()))
+        except OSError:
+            # Eg, nothing is listening, the path is too long for a unix socket or
+            # it didn't answer in time (socket.timeout). Migrate without it.
+            return None
+        # Migrating takes as long as it takes.
+        sock.settimeout(None)
+        message = {"previous": previous, "current": current}
+        sock.sendall(json.dumps(message).encode() + b"\n")
+        with sock.makefile("r") as fh:
+            for line in fh:
+                if line.startswith(EXIT_MARKER):
+                    return int(line[1:])
+                stdout.write(line)
+                stdout.flush()
+    # The daemon went away part way through.
+    return 1
+
+
+class SocketWriter(io.TextIOBase):
+    """A text stream that writes to a socket."""
+
+    def __init__(self, sock):
+        self.sock = sock
+
+    def writable(self):
+        return True
+
+    def write(self, s):
+        self.sock.sendall(s.replace(EXIT_MARKER, "").encode())
+        return len(s)
+
+
+def serve(handle):
+    """Serves requests, one at a time, until interrupted.
+
+    `handle` is called with the previous and current HEAD, and should return an
+    exit status. Anything it writes to stdout or stderr goes to the client.
+    """
+
+    class Handler(socketserver.StreamRequestHandler):
+        def handle(self):
+            message = json.loads(self.rfile.readline())
+            writer = SocketWriter(self.connection)
+            with contextlib.redirect_stdout(writer), contextlib.redirect_stderr(writer):
+                try:
+                    status = handle(message["previous"], message["current"])
+                except Exception as e:
+                    sys.stderr.write(f"{e.__class__.__name__}: {e}\n")
+                    status = 1
+            self.connection.sendall(f"{EXIT_MARKER}{status}\n".encode())
+
+    path = socket_path()
+    with contextlib.suppress(FileNotFoundError):
+        os.unlink(path)
+    with socketserver.UnixStreamServer(str(path), Handler) as server:
+        try:
+            server.serve_forever()
+        finally:
+            os.unlink(path)
+
+
+def main(argv=None):
+    argv = sys.argv[1:] if argv is None else argv
+    # Checkouts made by migrant itself are handled where they started.
+    if os.environ.get("DJANGO_MIGRANT_STAGE"):
+        return NO_DAEMON
+    status = request(*argv[:2])
+    return NO_DAEMON if status is None else status
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,169 @@
+import sys
+import traceback
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from contextlib import contextmanager
+from io import StringIO
+from pathlib import Path
+
+from django.apps import apps
+from django.core.management.base import CommandError
+from django.db import DEFAULT_DB_ALIAS, DatabaseError, connections, router
+
+
+def migrated_aliases():
+    """Returns the aliases of the databases that migrations should be run on.
+
+    The default database is always migrated, as `migrate` would be. Other
+    databases are migrated if the routers allow any model to be migrated there.
+    """
+    models = apps.get_models(include_auto_created=True)
+    aliases = [DEFAULT_DB_ALIAS]
+    for alias in connections:
+        if alias == DEFAULT_DB_ALIAS:
+            continue
+        if any(router.allow_migrate_model(alias, model) for model in models):
+            aliases.append(alias)
+    return aliases
+
+
+@contextmanager
+def relaxed_durability(connection, stdout=None):
+    """Trades durability for speed on a connection, for the length of the block.
+
+    Dev databases can be migrated again if the machine crashes part way, so
+    there's no need to wait for every commit to reach the disk. Yields what was
+    relaxed, or None if nothing could be, and puts it back afterwards. If that
+    isn't possible a warning is written to stdout.
+    """
+    stdout = stdout or sys.stdout
+    if connection.vendor == "sqlite" and not connection.is_in_memory_db():
+        with connection.cursor() as cursor:
+            cursor.execute("PRAGMA journal_mode")
+            (journal_mode,) = cursor.fetchone()
+            cursor.execute("PRAGMA synchronous")
+            (synchronous,) = cursor.fetchone()
+            cursor.execute("PRAGMA journal_mode = WAL")
+            cursor.execute("PRAGMA synchronous = OFF")
+        try:
+            yield "journal_mode=WAL, synchronous=OFF"
+        finally:
+            with connection.cursor() as cursor:
+                cursor.execute(f"PRAGMA synchronous = {int(synchronous)}")
+                # Leaving WAL needs the only connection, eg not runserver's too.
+                try:
+                    cursor.execute(f"PRAGMA journal_mode = {journal_mode}")
+                    (restored,) = cursor.fetchone()
+                except DatabaseError:
+                    restored = "wal"
+            if restored.lower() != journal_mode.lower():
+                stdout.write(
+                    f"  Couldn't restore journal_mode={journal_mode} on database "
+                    f"'{connection.alias}', it's left as journal_mode={restored}. "
+                    "Run 'PRAGMA journal_mode' once nothing else is connected to "
+                    "it.\n"
+                )
+    elif connection.vendor == "postgresql":
+        with connection.cursor() as cursor:
+            cursor.execute("SHOW synchronous_commit")
+            (synchronous_commit,) = cursor.fetchone()
+            cursor.execute("SET synchronous_commit TO off")
+        try:
+            yield "synchronous_commit=off"
+        finally:
+            with connection.cursor() as cursor:
+                cursor.execute(
+                    "SELECT set_config('synchronous_commit', %s, false)",
+                    [synchronous_commit],
+                )
+    else:
+        yield None
+
+
+def test_database_exists(connection, name):
+    if connection.vendor == "sqlite":
+        # Connecting would create it.
+        return not connection.creation.is_in_memory_db(name) and Path(name).exists()
+    try:
+        connection.ensure_connection()
+    except DatabaseError:
+        return False
+    finally:
+        connection.close()
+    return True
+
+
+@contextmanager
+def test_databases(aliases):
+    """Points each alias at its test database, as the test runner would.
+
+    Only test databases that exist, eg because they were kept with 'test
+    --keepdb', are switched to. Yields the aliases that were, and switches them
+    back afterwards.
+    """
+    switched = {}
+    try:
+        for alias in aliases:
+            connection = connections[alias]
+            if connection.settings_dict["TEST"]["MIRROR"]:
+                continue
+            name = connection.creation._get_test_db_name()
+            switched[alias] = connection.settings_dict["NAME"]
+            connection.close()
+            # Threads' connections share the settings, so they switch too.
+            connection.settings_dict["NAME"] = name
+            if not test_database_exists(connection, name):
+                connection.settings_dict["NAME"] = switched.pop(alias)
+        yield list(switched)
+    finally:
+        for alias, name in switched.items():
+            connections[alias].close()
+            connections[alias].settings_dict["NAME"] = name
+
+
+def for_each_alias(func, aliases, stdout=None):
+    """Calls `func(alias, stdout)` for each database alias, concurrently.
+
+    Each database gets a thread, and so a connection, of its own. Output is
+    buffered per database and written out, under a heading, as each finishes so
+    that it doesn't interleave. Every database is run to completion, even if
+    another fails, then a CommandError reports all the failures together.
+
+    With only one database `func` is just called, writing straight to stdout.
+    Returns a dict of alias to whatever `func` returned.
+    """
+    stdout = stdout or sys.stdout
+    if len(aliases) == 1:
+        return {aliases[0]: func(aliases[0], stdout)}
+
+    def call(alias):
+        buffer = StringIO()
+        try:
+            return func(alias, buffer), buffer, None
+        except Exception:
+            return None, buffer, traceback.format_exc()
+        finally:
+            # The connection belongs to this thread, which is about to go away.
+            connections[alias].close()
+
+    results, errors = {}, {}
+    with ThreadPoolExecutor(max_workers=len(aliases)) as pool:
+        futures = {pool.submit(call, alias): alias for alias in aliases}
+        for future in as_completed(futures):
+            alias = futures[future]
+            result, buffer, error = future.result()
+            if buffer.getvalue() or error:
+                stdout.write(f"Database '{alias}':\n")
+                stdout.write(buffer.getvalue())
+            if error:
+                stdout.write(error)
+                errors[alias] = error.strip().splitlines()[-1]
+            else:
+                results[alias] = result
+            stdout.flush()
+
+    if errors:
+        raise CommandError(
+            "Migrating failed for "
+            + ", ".join(f"'{alias}' ({error})" for alias, error in errors.items())
+        )
+    return results
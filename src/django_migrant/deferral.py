@@ -0,0 +1,199 @@
+"""Leaves index rebuilds and foreign key checks until the end of a plan.
+
+A long plan can change the same table again and again, and each change can
+rebuild its indexes or check its foreign keys. With deferral those are done
+once, when the plan is finished, against the models as they are by then:
+
+- On PostgreSQL the indexes of tables changed more than once are dropped
+  before the plan and created afterwards, and the foreign keys it adds are
+  added NOT VALID and validated at the end.
+- On SQLite, which rebuilds a table, indexes and all, for most changes, the
+  foreign key check each migration ends with is made just once.
+"""
+
+from django.db.migrations.operations import (
+    AddIndex,
+    AlterIndexTogether,
+    AlterModelTable,
+    RemoveIndex,
+    RenameIndex,
+    RenameModel,
+    RunSQL,
+    SeparateDatabaseAndState,
+)
+from django.db.migrations.operations.models import ModelOperation
+
+from django_migrant.effects import STATE_ONLY
+
+# Operations that find a table's indexes by name, so need them to be there.
+INDEX_DEPENDENT = (AddIndex, AlterIndexTogether, RemoveIndex, RenameIndex)
+# Operations that move a model to another table.
+TABLE_CHANGING = (AlterModelTable, RenameModel)
+
+
+def database_operations(migration):
+    """Yields the operations of a migration that can change the database."""
+    operations = list(migration.operations)
+    while operations:
+        operation = operations.pop(0)
+        if isinstance(operation, SeparateDatabaseAndState):
+            operations[:0] = operation.database_operations
+        elif not isinstance(operation, STATE_ONLY):
+            yield operation
+
+
+def deferrable_models(plan):
+    """Returns the models whose indexes can be left until the plan is done.
+
+    Those changed by more than one operation, as there's nothing to gain for a
+    table changed once, other than by operations that need its indexes as they
+    are or that move it. Raw SQL and operations from outside Django could touch
+    any table, so if there are any nothing is deferred.
+    """
+    counts, excluded = {}, set()
+    for migration, _ in plan:
+        for operation in database_operations(migration):
+            if isinstance(operation, RunSQL) or not type(
+                operation
+            ).__module__.startswith("django."):
+                return set()
+            model_name = getattr(operation, "model_name_lower", None)
+            if model_name is None and isinstance(operation, ModelOperation):
+                model_name = operation.name_lower
+            if model_name is None:
+                continue
+            key = (migration.app_label, model_name)
+            counts[key] = counts.get(key, 0) + 1
+            if isinstance(operation, INDEX_DEPENDENT + TABLE_CHANGING):
+                excluded.add(key)
+    return {key for key, count in counts.items() if count > 1 and key not in excluded}
+
+
+def not_valid_schema_editor(editor_class, added):
+    """Returns a schema editor class that adds foreign keys NOT VALID.
+
+    The names of the foreign keys are appended to `added`, to be validated
+    later. PostgreSQL only.
+    """
+
+    class NotValidSchemaEditor(editor_class):
+        sql_create_fk = editor_class.sql_create_fk + " NOT VALID"
+
+        def _create_fk_sql(self, *args, **kwargs):
+            statement = super()._create_fk_sql(*args, **kwargs)
+            added.append(str(statement.parts["name"]).strip('"'))
+            return statement
+
+    return NotValidSchemaEditor
+
+
+class Deferral:
+    """Index rebuilds and foreign key checks put off until a plan is finished."""
+
+    def __init__(self, connection, plan):
+        self.connection = connection
+        self.models = (
+            deferrable_models(plan) if connection.vendor == "postgresql" else set()
+        )
+        # The models whose indexes were dropped, and the foreign keys added.
+        self.dropped = set()
+        self.foreign_keys = []
+        self.started = self.finished = False
+
+    def start(self, state):
+        """Drops the indexes of the deferrable models, and holds back foreign
+        key checks. `state` is the project state before the plan.
+
+        Returns a description of what was deferred, or None if nothing was.
+        """
+        connection = self.connection
+        deferred = []
+        if self.models:
+            count = 0
+            with connection.schema_editor() as editor:
+                for key in sorted(self.models):
+                    if key not in state.models:
+                        continue
+                    model = state.apps.get_model(*key)
+                    names = self.indexes(editor, model).keys() & self.existing(model)
+                    for name in sorted(names):
+                        editor.execute(editor._delete_index_sql(model, name))
+                    if names:
+                        self.dropped.add(key)
+                        count += len(names)
+            if count:
+                deferred.append(f"{count} index(es) on {len(self.dropped)} table(s)")
+        if connection.vendor == "sqlite":
+            # The schema editor checks every foreign key as it finishes.
+            connection.check_constraints = lambda table_names=None: None
+            deferred.append("foreign key checks")
+        elif connection.vendor == "postgresql":
+            connection.SchemaEditorClass = not_valid_schema_editor(
+                connection.SchemaEditorClass, self.foreign_keys
+            )
+            deferred.append("foreign key validation")
+        self.started = True
+        return ", ".join(deferred) or None
+
+    def finish(self, state):
+        """Creates the indexes and checks the foreign keys that were put off.
+
+        `state` is the project state once the plan is done, or as far as it got
+        if it failed. Only the indexes its models have are created.
+        """
+        if not self.started or self.finished:
+            return
+        self.finished = True
+        connection = self.connection
+        connection.__dict__.pop("check_constraints", None)
+        connection.__dict__.pop("SchemaEditorClass", None)
+        if self.dropped:
+            with connection.schema_editor() as editor:
+                for key in sorted(self.dropped):
+                    if key not in state.models:
+                        continue
+                    model = state.apps.get_model(*key)
+                    existing = self.existing(model)
+                    for name, statement in self.indexes(editor, model).items():
+                        if name not in existing:
+                            editor.execute(statement)
+        if connection.vendor == "sqlite":
+            connection.check_constraints()
+        elif self.foreign_keys:
+            self.validate_foreign_keys()
+
+    def indexes(self, editor, model):
+        """Returns the CREATE INDEX statements for a model, by index name."""
+        return {
+            str(statement.parts["name"]).strip('"'): statement
+            for statement in editor._model_indexes_sql(model)
+        }
+
+    def existing(self, model):
+        """Returns the names of the indexes on a model's table that could be
+        dropped: those that aren't for a primary key or unique constraint."""
+        with self.connection.cursor() as cursor:
+            constraints = self.connection.introspection.get_constraints(
+                cursor, model._meta.db_table
+            )
+        return {
+            name
+            for name, constraint in constraints.items()
+            if constraint["index"]
+            and not constraint["unique"]
+            and not constraint["primary_key"]
+        }
+
+    def validate_foreign_keys(self):
+        quote_name = self.connection.ops.quote_name
+        with self.connection.cursor() as cursor:
+            # Those that are still there, and not yet valid.
+            cursor.execute(
+                "SELECT conrelid::regclass::text, conname FROM pg_constraint "
+                "WHERE contype = 'f' AND NOT convalidated AND conname = ANY(%s)",
+                [self.foreign_keys],
+            )
+            for table, name in cursor.fetchall():
+                cursor.execute(
+                    f"ALTER TABLE {table} VALIDATE CONSTRAINT {quote_name(name)}"
+                )
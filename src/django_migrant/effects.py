@@ -0,0 +1,78 @@
+"""Works out whether a migration changes the database, or only the state.
+
+Plenty of migrations only change what Django knows about a model, eg its
+options, managers or the help text of a field. Those can be faked: recorded as
+applied or unapplied without a schema editor, a transaction or the rendered
+models they'd otherwise need.
+"""
+
+from django.db.migrations.operations import (
+    AlterField,
+    AlterModelManagers,
+    AlterModelOptions,
+    RunPython,
+    RunSQL,
+    SeparateDatabaseAndState,
+)
+
+# Operations that only change the migration state, never the database.
+STATE_ONLY = (AlterModelManagers, AlterModelOptions)
+
+
+def field_altered(connection, app_label, operation, state):
+    """Returns True if an AlterField would change the database.
+
+    Uses the same test the schema editor does before altering a column, which
+    ignores attributes such as help_text, verbose_name and choices.
+    """
+    try:
+        model_state = state.models[app_label, operation.model_name_lower]
+        old_field = model_state.fields[operation.name]
+    except KeyError:
+        return True
+    old_field, new_field = old_field.clone(), operation.field.clone()
+    old_field.set_attributes_from_name(operation.name)
+    new_field.set_attributes_from_name(operation.name)
+    schema_editor = connection.SchemaEditorClass(connection)
+    return schema_editor._field_should_be_altered(old_field, new_field)
+
+
+def operation_effect(connection, app_label, operation, state, backwards=False):
+    """Returns True unless the operation is known to leave the database be."""
+    if isinstance(operation, STATE_ONLY):
+        return False
+    if isinstance(operation, SeparateDatabaseAndState):
+        return any(
+            operation_effect(connection, app_label, op, state, backwards)
+            for op in operation.database_operations
+        )
+    if isinstance(operation, RunPython):
+        code = operation.reverse_code if backwards else operation.code
+        return code is not RunPython.noop
+    if isinstance(operation, RunSQL):
+        sql = operation.reverse_sql if backwards else operation.sql
+        return sql != RunSQL.noop
+    if isinstance(operation, AlterField):
+        return field_altered(connection, app_label, operation, state)
+    return True
+
+
+def schema_effect(connection, migration, state, backwards=False):
+    """Returns True if applying, or unapplying, a migration changes the database.
+
+    `state` is the project state before the migration. Each operation is judged
+    against it, so a migration that alters the same field twice is assumed to
+    change the database.
+    """
+    altered = set()
+    for operation in migration.operations:
+        if isinstance(operation, AlterField):
+            key = (operation.model_name_lower, operation.name_lower)
+            if key in altered:
+                return True
+            altered.add(key)
+        if operation_effect(
+            connection, migration.app_label, operation, state, backwards
+        ):
+            return True
+    return False
@@ -0,0 +1,644 @@
+import sys
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from contextlib import contextmanager, nullcontext
+from importlib import import_module
+
+from django.apps import apps
+from django.core.management.base import BaseCommand, CommandError, OutputWrapper
+from django.core.management.sql import emit_pre_migrate_signal
+from django.db import connections, models, transaction
+from django.db.models import Q
+from django.db.migrations.executor import MigrationExecutor
+from django.db.migrations.recorder import MigrationRecorder
+from django.db.migrations.state import ProjectState
+from django.utils.module_loading import module_has_submodule
+
+from django_migrant.databases import relaxed_durability
+from django_migrant.deferral import Deferral
+from django_migrant.effects import schema_effect
+from django_migrant.squashing import Segment, segments, squashable
+from django_migrant.tracing import Tracer
+
+
+class MigrantExecutor(MigrationExecutor):
+    """A MigrationExecutor that runs against an already built loader.
+
+    Django's executor always builds its own loader from disk, which is both slow
+    and wrong when the migrations come from somewhere else (eg, a git revision).
+    """
+
+    def __init__(
+        self,
+        connection,
+        loader,
+        stdout=None,
+        tracer=None,
+        reverse_sql=None,
+        workers=1,
+        journal=None,
+        fast=False,
+        defer=False,
+        squash=False,
+        state_cache=None,
+    ):
+        self.connection = connection
+        self.loader = loader
+        self.recorder = MigrationRecorder(connection)
+        self.stdout = OutputWrapper(stdout or sys.stdout)
+        self.tracer = tracer or Tracer()
+        self.reverse_sql = reverse_sql
+        self.workers = workers
+        self.journal = journal
+        self.fast = fast
+        self.defer = defer
+        self.squash = squash
+        # The Segment each migration being squashed is run as part of.
+        self.segments = {}
+        self.state_cache = state_cache
+        # The state _migrate_all_backwards starts from, rather than an empty one.
+        self.initial_state = None
+        # Journal progress held back until the transaction it's in commits.
+        self.uncommitted = None
+        self.progress_callback = self.report_progress
+        # Migrations faked but not yet recorded, with whether they were unapplied.
+        self.faked = []
+
+    def apply_migration(self, state, migration, fake=False, fake_initial=False):
+        segment = self.segments.get(migration)
+        if segment is not None:
+            # Run as a whole when its first migration is reached.
+            if migration is not segment.migrations[0]:
+                return state
+            migration = segment
+        record_sql = (
+            segment is None
+            and self.reverse_sql is not None
+            and self.reverse_sql.needs(self.connection, migration)
+        )
+        # Applying updates the state in place, so keep a copy of how it was.
+        before = state.clone() if record_sql else None
+        if not fake and not schema_effect(self.connection, migration, state):
+            self.faked.append((migration, False))
+            migration.mutate_state(state, preserve=False)
+        else:
+            self.record_faked()
+            state = super().apply_migration(state, migration, fake, fake_initial)
+        if record_sql:
+            self.reverse_sql.record(self.connection, before, migration)
+        return state
+
+    def unapply_migration(self, state, migration, fake=False):
+        segment = self.segments.get(migration)
+        if segment is not None:
+            # Run as a whole when its first migration, the last to be unapplied,
+            # is reached. Given the state before it, as a segment needs.
+            if migration is not segment.migrations[0]:
+                return state
+            migration = segment
+        if not fake and not schema_effect(
+            self.connection, migration, state, backwards=True
+        ):
+            self.faked.append((migration, True))
+            return state
+        self.record_faked()
+        return super().unapply_migration(state, migration, fake)
+
+    def _migrate_all_forwards(self, *args, **kwargs):
+        try:
+            return super()._migrate_all_forwards(*args, **kwargs)
+        finally:
+            self.record_faked()
+
+    def _migrate_all_backwards(self, plan, full_plan, fake):
+        """As MigrationExecutor's, without going through every migration first.
+
+        Django's works out the state before each migration to be unapplied by
+        going through the full plan from the start. Here it starts from the
+        state before the first of them, which may have been kept in the state
+        cache.
+        """
+        planned = {migration for migration, _ in plan}
+        start = next(i for i, (m, _) in enumerate(full_plan) if m in planned)
+        applied = {
+            self.loader.graph.nodes[key]
+            for key in self.loader.applied_migrations
+            if key in self.loader.graph.nodes
+        }
+        self.initial_state = self.state_from(
+            [m for m, _ in full_plan[:start] if m in applied]
+        )
+        try:
+            return super()._migrate_all_backwards(plan, full_plan[start:], fake)
+        finally:
+            self.initial_state = None
+            self.record_faked()
+
+    def _create_project_state(self, with_applied_migrations=False):
+        if with_applied_migrations:
+            return self.state_of(set(self.loader.applied_migrations))
+        if self.initial_state is not None:
+            state, self.initial_state = self.initial_state, None
+            return state
+        return super()._create_project_state()
+
+    def record_faked(self):
+        """Records the migrations faked since the last one that was run.
+
+        Migrations that don't change the database are only recorded, together in
+        a single query, before the next migration is run or once the plan is done.
+        """
+        if not self.faked:
+            return
+        faked, self.faked = self.faked, []
+        backwards = faked[0][1]
+        keys = []
+        for migration, _ in faked:
+            # As MigrationExecutor does, squashed migrations record the
+            # migrations they replace, and are only unrecorded themselves.
+            keys.extend(migration.replaces)
+            if backwards or not migration.replaces:
+                keys.append((migration.app_label, migration.name))
+
+        self.recorder.ensure_schema()
+        migrations = self.recorder.migration_qs
+        if backwards:
+            names = {}
+            for app_label, name in keys:
+                names.setdefault(app_label, []).append(name)
+            query = Q()
+            for app_label, app_names in names.items():
+                query |= Q(app=app_label, name__in=app_names)
+            migrations.filter(query).delete()
+        else:
+            migrations.bulk_create(
+                [self.recorder.Migration(app=app, name=name) for app, name in keys]
+            )
+
+        action = "unapply" if backwards else "apply"
+        for migration, _ in faked:
+            self.progress_callback(f"{action}_start", migration, True)
+            self.progress_callback(f"{action}_success", migration, True)
+
+    def report_progress(self, action, migration=None, fake=False):
+        # Mimic the output of Django's migrate command.
+        if action in ("apply_start", "unapply_start"):
+            verb = "Applying" if action == "apply_start" else "Unapplying"
+            self.stdout.write(f"  {verb} {migration}...", ending="")
+            self.stdout.flush()
+        elif action in ("apply_success", "unapply_success"):
+            self.stdout.write(" FAKED" if fake else " OK")
+        self.record_progress(action, migration, fake)
+
+    def record_progress(self, action, migration=None, fake=False):
+        alias = self.connection.alias
+        self.tracer.migration_progress(alias, action, migration=migration, fake=fake)
+        if self.journal is None:
+            return
+        # The journal is told about each of the migrations in a segment.
+        if isinstance(migration, Segment):
+            migrations = migration.migrations
+        else:
+            migrations = [migration]
+        for migration in migrations:
+            if self.uncommitted is not None:
+                self.uncommitted.append((action, migration))
+            else:
+                self.journal.migration_progress(alias, action, migration=migration)
+
+    def run(self, targets, plan):
+        """Runs a whole plan, sending pre_migrate and post_migrate just once.
+
+        This is the bulk of what Django's migrate command does, without
+        rebuilding the loader or running the system checks each time. Only the
+        apps with migrations in the plan are sent post_migrate, as the handlers
+        (eg, creating content types and permissions) work app by app.
+        """
+        # Import the 'management' module within each installed app, to register
+        # dispatcher events.
+        for app_config in apps.get_app_configs():
+            if module_has_submodule(app_config.module, "management"):
+                import_module(".management", app_config.name)
+
+        alias = self.connection.alias
+        began = time.perf_counter()
+        if self.journal is not None:
+            self.journal.plan(
+                alias,
+                "unapply" if plan[0][1] else "apply",
+                [(migration.app_label, migration.name) for migration, _ in plan],
+            )
+        pre_migrate_state = self._create_project_state(with_applied_migrations=True)
+        emit_pre_migrate_signal(
+            1, False, alias, stdout=self.stdout, apps=pre_migrate_state.apps, plan=plan
+        )
+        parallel = self.workers > 1 and self.connection.vendor == "postgresql"
+        durability = (
+            relaxed_durability(self.connection, self.stdout)
+            if self.fast
+            else nullcontext()
+        )
+        with durability as relaxed, self.deferring(plan, pre_migrate_state) as deferral:
+            atomically = relaxed and not parallel and self.single_transaction(plan)
+            if self.squash and not parallel:
+                self.segments = self.squash_plan(plan)
+            if relaxed:
+                self.stdout.write(
+                    f"  Relaxed durability: {relaxed}"
+                    + (", one transaction." if atomically else ".")
+                )
+            if parallel:
+                post_migrate_state = self.migrate_parallel(plan)
+            elif atomically:
+                post_migrate_state = self.migrate_atomically(
+                    targets, plan, pre_migrate_state.clone()
+                )
+            else:
+                post_migrate_state = self.migrate(
+                    targets, plan=plan, state=pre_migrate_state.clone()
+                )
+            if deferral is not None:
+                with self.tracer.span("rebuild", alias=alias):
+                    deferral.finish(post_migrate_state)
+        post_migrate_state.clear_delayed_apps_cache()
+        app_labels = {migration.app_label for migration, _ in plan}
+        with self.tracer.span("post_migrate", alias=alias, apps=len(app_labels)):
+            self.emit_post_migrate(app_labels, post_migrate_state.apps, plan)
+
+        verb = "Unapplied" if plan[0][1] else "Applied"
+        self.stdout.write(
+            f"  {verb} {len(plan)} migration(s) in {', '.join(sorted(app_labels))} "
+            f"in {time.perf_counter() - began:.2f}s."
+        )
+        return post_migrate_state
+
+    def squash_plan(self, plan):
+        """Returns the Segment each migration in the plan is squashed into.
+
+        Segments are of the migrations next to each other in the order they're
+        run: for a forwards plan, the order of the full plan, as Django follows
+        it rather than the plan's. Migrations whose reverse SQL is still to be
+        recorded are left alone, as it's recorded for each migration.
+        """
+        if plan[0][1]:
+            migrations = [migration for migration, _ in reversed(plan)]
+        else:
+            planned = {migration for migration, _ in plan}
+            full_plan = self.migration_plan(
+                self.loader.graph.leaf_nodes(), clean_start=True
+            )
+            migrations = [m for m, _ in full_plan if m in planned]
+
+        def can_squash(migration):
+            return squashable(migration) and not (
+                self.reverse_sql is not None
+                and self.reverse_sql.needs(self.connection, migration)
+            )
+
+        return segments(migrations, can_squash)
+
+    @contextmanager
+    def deferring(self, plan, state):
+        """Leaves index rebuilds and foreign key checks until the plan is done.
+
+        Yields the Deferral, to be finished with the state after the plan, or
+        None if not deferring. If the plan fails, what was deferred is done for
+        the migrations that had been run.
+        """
+        if not self.defer:
+            yield None
+            return
+        deferral = Deferral(self.connection, plan)
+        with self.tracer.span("defer", alias=self.connection.alias):
+            deferred = deferral.start(state)
+        if deferred:
+            self.stdout.write(f"  Deferred {deferred}.")
+        try:
+            yield deferral
+        except BaseException:
+            deferral.finish(self.applied_state())
+            raise
+
+    def single_transaction(self, plan):
+        """Returns True if the whole plan can be run in one transaction.
+
+        Only on PostgreSQL, as SQLite's schema editor can't be used inside a
+        transaction, and only if every migration asks to be run in one.
+        """
+        return (
+            self.connection.vendor == "postgresql"
+            and self.connection.features.can_rollback_ddl
+            and all(migration.atomic for migration, _ in plan)
+        )
+
+    def migrate_atomically(self, targets, plan, state):
+        """Runs the plan in one transaction, so it's all or nothing.
+
+        The journal is only told what's done once the transaction commits.
+        """
+        self.uncommitted = []
+        try:
+            with transaction.atomic(using=self.connection.alias):
+                state = self.migrate(targets, plan=plan, state=state)
+            uncommitted, self.uncommitted = self.uncommitted, None
+            for action, migration in uncommitted:
+                self.journal.migration_progress(
+                    self.connection.alias, action, migration=migration
+                )
+        finally:
+            self.uncommitted = None
+        return state
+
+    def emit_post_migrate(self, app_labels, state_apps, plan):
+        """As emit_post_migrate_signal, but only for the given apps."""
+        for app_config in apps.get_app_configs():
+            if app_config.models_module is None or app_config.label not in app_labels:
+                continue
+            models.signals.post_migrate.send(
+                sender=app_config,
+                app_config=app_config,
+                verbosity=1,
+                interactive=False,
+                using=self.connection.alias,
+                stdout=self.stdout,
+                apps=state_apps,
+                plan=plan,
+            )
+
+    def migrate_parallel(self, plan):
+        """Runs the independent chains of a plan at once, on separate connections.
+
+        Each chain is run in order by a worker of its own, with each migration in
+        a transaction or not as it asks. If one fails, the other workers stop
+        before their next migration and what had been done is reported.
+        """
+        chains = independent_chains(self.loader, plan)
+        if len(chains) < 2:
+            return self.migrate(None, plan=plan)
+
+        self.recorder.ensure_schema()
+        stop, lock, done = threading.Event(), threading.Lock(), []
+        alias = self.connection.alias
+
+        def run_chain(chain):
+            # Connections are per thread, so this is one of the worker's own.
+            connection = connections[alias]
+            executor = ChainExecutor(self, connection, stop, lock, done)
+            relaxed = (
+                relaxed_durability(connection, self.stdout)
+                if self.fast
+                else nullcontext()
+            )
+            try:
+                with self.tracer.counting(connection), relaxed:
+                    executor.migrate(None, plan=chain)
+            except StopChain:
+                pass
+            except Exception:
+                stop.set()
+                raise
+            finally:
+                connection.close()
+
+        workers = min(self.workers, len(chains))
+        self.stdout.write(f"  Running {len(chains)} chains on {workers} connections.")
+        with ThreadPoolExecutor(max_workers=workers) as pool:
+            futures = [pool.submit(run_chain, chain) for chain in chains]
+        errors = [f.exception() for f in futures if f.exception()]
+        if errors:
+            verb = "Unapplied" if plan[0][1] else "Applied"
+            self.stdout.write(
+                f"  {verb} {len(done)} of {len(plan)} migrations before failing: "
+                + (", ".join(str(migration) for migration in done) or "none")
+            )
+            raise errors[0]
+
+        self.check_replacements()
+        return self.state_after(plan)
+
+    def state_after(self, plan):
+        """Returns the project state as it is once the plan has been run."""
+        keys = {(migration.app_label, migration.name) for migration, _ in plan}
+        applied = set(self.loader.applied_migrations)
+        applied = applied - keys if plan[0][1] else applied | keys
+        return self.state_of(applied)
+
+    def applied_state(self):
+        """Returns the project state of the migrations recorded as applied."""
+        return self.state_of(set(self.recorder.applied_migrations()))
+
+    def state_of(self, applied):
+        """Returns the project state with the given migrations applied.
+
+        Squashed migrations count as applied if what they replace is.
+        """
+        full_plan = self.migration_plan(
+            self.loader.graph.leaf_nodes(), clean_start=True
+        )
+        return self.state_from(
+            [
+                migration
+                for migration, _ in full_plan
+                if (migration.app_label, migration.name) in applied
+                or (migration.replaces and applied.issuperset(migration.replaces))
+            ]
+        )
+
+    def state_from(self, migrations):
+        """Returns the project state made by the given migrations, in order.
+
+        States are kept in the state cache, if there is one, so that the
+        migrations needn't be loaded and gone through next time.
+        """
+        key = None
+        with self.tracer.span(
+            "state", alias=self.connection.alias, migrations=len(migrations)
+        ) as span:
+            if self.state_cache is not None:
+                key = self.state_cache.key(
+                    self.loader, self.loader.unmigrated_apps, migrations
+                )
+                state = None if key is None else self.state_cache.get(key)
+                span["hit"] = state is not None
+                if state is not None:
+                    return state
+            state = ProjectState(real_apps=self.loader.unmigrated_apps)
+            for migration in migrations:
+                migration.mutate_state(state, preserve=False)
+            if key is not None:
+                self.state_cache.put(key, state)
+        return state
+
+
+class StopChain(Exception):
+    """Raised in a worker to stop it, as another has failed."""
+
+
+class ChainExecutor(MigrantExecutor):
+    """Runs one chain of a plan for a MigrantExecutor, in a worker thread."""
+
+    def __init__(self, parent, connection, stop, lock, done):
+        super().__init__(
+            connection,
+            parent.loader,
+            stdout=parent.stdout,
+            tracer=parent.tracer,
+            reverse_sql=parent.reverse_sql,
+            journal=parent.journal,
+            state_cache=parent.state_cache,
+        )
+        self.stop = stop
+        self.lock = lock
+        self.done = done
+
+    def report_progress(self, action, migration=None, fake=False):
+        if action in ("apply_start", "unapply_start") and self.stop.is_set():
+            raise StopChain()
+        if action in ("apply_success", "unapply_success"):
+            # Each line is written whole, as the workers' output interleaves.
+            verb = "Applying" if action == "apply_success" else "Unapplying"
+            result = "FAKED" if fake else "OK"
+            with self.lock:
+                self.stdout.write(f"  {verb} {migration}... {result}")
+                self.stdout.flush()
+            self.done.append(migration)
+        self.record_progress(action, migration, fake)
+
+    def check_replacements(self):
+        # Left to the parent once every chain is done, to avoid racing.
+        pass
+
+
+def independent_chains(loader, plan):
+    """Splits a plan into parts that don't depend on each other.
+
+    Migrations are in the same part if one depends on the other, directly or
+    through others in the plan. Each part keeps the order of the plan.
+    """
+    keys = [(migration.app_label, migration.name) for migration, _ in plan]
+    # Union-find, each key pointing towards the first key of its part.
+    part = {key: key for key in keys}
+
+    def find(key):
+        while part[key] != key:
+            part[key] = part[part[key]]
+            key = part[key]
+        return key
+
+    for key in keys:
+        for parent in loader.graph.node_map[key].parents:
+            if parent.key in part:
+                part[find(key)] = find(parent.key)
+
+    chains = {}
+    for key, step in zip(keys, plan):
+        chains.setdefault(find(key), []).append(step)
+    return list(chains.values())
+
+
+def migrate_forwards(
+    connection,
+    loader,
+    stdout=None,
+    tracer=None,
+    reverse_sql=None,
+    workers=1,
+    journal=None,
+    fast=False,
+    defer=False,
+    squash=False,
+    state_cache=None,
+):
+    """Applies every unapplied migration, as Django's migrate command would.
+
+    Only the leaf nodes of apps with something to apply are planned for, and
+    the system checks are only run if there's a plan to run.
+    """
+    loader.check_consistent_history(connection)
+    conflicts = loader.detect_conflicts()
+    if conflicts:
+        name_str = "; ".join(
+            "%s in %s" % (", ".join(names), app) for app, names in conflicts.items()
+        )
+        raise CommandError(
+            "Conflicting migrations detected; multiple leaf nodes in the "
+            "migration graph: (%s).\nTo fix them run "
+            "'python manage.py makemigrations --merge'" % name_str
+        )
+
+    executor = MigrantExecutor(
+        connection,
+        loader,
+        stdout=stdout,
+        tracer=tracer,
+        reverse_sql=reverse_sql,
+        workers=workers,
+        journal=journal,
+        fast=fast,
+        defer=defer,
+        squash=squash,
+        state_cache=state_cache,
+    )
+    pending = {
+        app_label
+        for app_label, name in loader.graph.nodes
+        if (app_label, name) not in loader.applied_migrations
+    }
+    targets = [key for key in loader.graph.leaf_nodes() if key[0] in pending]
+    plan = executor.migration_plan(targets)
+    if plan:
+        BaseCommand(stdout=executor.stdout).check(databases=[connection.alias])
+        executor.run(targets, plan)
+    else:
+        executor.stdout.write("  No migrations to apply.")
+    return plan
+
+
+def rollback_plan(loader, node_names):
+    """Returns the plan that unapplies the given nodes, and nothing else.
+
+    Only they and the applied migrations that depend on them are unapplied.
+    Migrating back to their parents instead would also unapply the parents'
+    other children, eg those of another app that a node depends on.
+    """
+    applied = set(loader.applied_migrations)
+    plan = []
+    for node_name in sorted(node_names):
+        for key in loader.graph.backwards_plan(node_name):
+            if key in applied:
+                applied.discard(key)
+                plan.append((loader.graph.nodes[key], True))
+    return plan
+
+
+def rollback(
+    connection,
+    loader,
+    node_names,
+    stdout=None,
+    tracer=None,
+    workers=1,
+    journal=None,
+    fast=False,
+    defer=False,
+    squash=False,
+    state_cache=None,
+):
+    """Unapplies the given nodes as a single plan, in dependency order."""
+    executor = MigrantExecutor(
+        connection,
+        loader,
+        stdout=stdout,
+        tracer=tracer,
+        workers=workers,
+        journal=journal,
+        fast=fast,
+        defer=defer,
+        squash=squash,
+        state_cache=state_cache,
+    )
+    plan = rollback_plan(loader, node_names)
+    if plan:
+        executor.run(sorted(node_names), plan)
+    return plan
@@ -0,0 +1,167 @@
+import os
+import subprocess
+import weakref
+from pathlib import Path
+
+# Names the project being migrated, in a repository with several.
+PROJECT_ENV = "DJANGO_MIGRANT_PROJECT"
+
+
+def run(*args, **kwargs):
+    """Runs a git command and returns its standard output as text."""
+    # NB: We use raw subprocess because dulwich (used to interface with git repos)
+    # doesn't support the relative branch "-".
+    result = subprocess.run(
+        ["git", *args], check=True, capture_output=True, text=True, **kwargs
+    )
+    return result.stdout
+
+
+def rev_parse(rev: str) -> str:
+    return run("rev-parse", "--verify", "--quiet", f"{rev}^{{commit}}").strip()
+
+
+def resolve(rev: str) -> str:
+    """Returns the sha of a revision, or the revision if it can't be found."""
+    try:
+        return rev_parse(rev)
+    except subprocess.CalledProcessError:
+        return rev
+
+
+def recent_refs(count: int) -> list:
+    """Returns the branches, local and remote, with the most recent commits."""
+    output = run(
+        "for-each-ref",
+        "--sort=-committerdate",
+        f"--count={count}",
+        "--format=%(refname)",
+        "refs/heads",
+        "refs/remotes",
+    )
+    return output.split()
+
+
+def is_clean(paths) -> bool:
+    """Returns True if no file matching the pathspecs differs from HEAD."""
+    if not paths:
+        return True
+    output = run("status", "--porcelain", "--untracked-files=all", "--", *paths)
+    return not output.strip()
+
+
+def toplevel() -> Path:
+    return Path(run("rev-parse", "--show-toplevel").strip())
+
+
+def git_dir() -> Path:
+    return Path(run("rev-parse", "--absolute-git-dir").strip())
+
+
+def common_dir() -> Path:
+    return Path(run("rev-parse", "--git-common-dir").strip()).resolve()
+
+
+def project_dir(path: Path) -> Path:
+    """Returns the directory for migrant's state in path, creating it.
+
+    Each project in a repository with several keeps its state apart, in a
+    directory named by DJANGO_MIGRANT_PROJECT.
+    """
+    project = os.environ.get(PROJECT_ENV)
+    if project:
+        path = path / "projects" / project
+    path.mkdir(parents=True, exist_ok=True)
+    return path
+
+
+def migrant_dir() -> Path:
+    """Returns the directory, inside .git, where migrant keeps its state."""
+    return project_dir(git_dir() / "migrant")
+
+
+def common_migrant_dir() -> Path:
+    """Returns the directory where migrant keeps state shared by all worktrees."""
+    return project_dir(common_dir() / "migrant")
+
+
+def worktrees() -> list:
+    """Returns a dict, with the path and HEAD, of each worktree, the main first."""
+    entries = []
+    for block in run("worktree", "list", "--porcelain").split("\n\n"):
+        entry = {}
+        for line in block.splitlines():
+            key, _, value = line.partition(" ")
+            entry[key] = value
+        if "worktree" in entry:
+            entries.append({"path": Path(entry["worktree"]), "head": entry.get("HEAD")})
+    return entries
+
+
+def ls_tree(rev: str, path: Path) -> dict:
+    """Returns a mapping of file name to blob sha for the files in a directory.
+
+    path is relative to the top of the repository, wherever we're run from.
+    """
+    # A trailing slash lists the directory contents rather than the directory.
+    output = run("ls-tree", "--full-tree", "-z", rev, "--", f"{path.as_posix()}/")
+    entries = {}
+    for line in output.split("\0"):
+        if not line:
+            continue
+        info, name = line.split("\t", 1)
+        _, object_type, sha = info.split()
+        if object_type == "blob":
+            entries[name.rsplit("/", 1)[-1]] = sha
+    return entries
+
+
+class ObjectStore:
+    """Reads objects straight out of the git object database.
+
+    A single `git cat-file --batch` process is kept open for the lifetime of the
+    store so that reading many small files doesn't cost a process each. Reading
+    from a closed store starts a new process.
+    """
+
+    def __init__(self, cwd=None):
+        self.cwd = cwd
+        self.process = None
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+    def read(self, object_name: str) -> bytes:
+        if self.process is None:
+            self.process = subprocess.Popen(
+                ["git", "cat-file", "--batch"],
+                stdin=subprocess.PIPE,
+                stdout=subprocess.PIPE,
+                cwd=self.cwd,
+            )
+            weakref.finalize(self, self.terminate, self.process)
+        self.process.stdin.write(object_name.encode() + b"\n")
+        self.process.stdin.flush()
+        header = self.process.stdout.readline().decode().split()
+        if len(header) != 3:
+            raise KeyError(object_name)
+        size = int(header[2])
+        content = self.process.stdout.read(size)
+        # Each object is followed by a newline.
+        self.process.stdout.read(1)
+        return content
+
+    def close(self):
+        if self.process is not None:
+            self.terminate(self.process)
+            self.process = None
+
+    @staticmethod
+    def terminate(process):
+        if process.returncode is None:
+            process.stdin.close()
+            process.stdout.close()
+            process.wait()
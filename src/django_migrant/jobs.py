@@ -0,0 +1,178 @@
+"""A queue of checkouts waiting to be migrated in the background.
+
+In the background mode the post-checkout hook runs
+
+    python -m django_migrant.jobs "$1" "$2"
+
+which queues the checkout and returns straight away, exiting with status 0 if
+no worker is running and one should be started (`./manage.py migrant work`).
+The worker collapses everything queued into a single migration, from the
+earliest previous HEAD to the latest, so hopping quickly through several
+branches only migrates once.
+
+This module deliberately doesn't import django.
+"""
+
+import fcntl
+import json
+import os
+import sys
+import time
+from contextlib import contextmanager
+from pathlib import Path
+
+from django_migrant import git
+
+QUEUE_FILENAME = "queue.json"
+QUEUE_LOCK_FILENAME = "queue.lock"
+WORKER_LOCK_FILENAME = "worker.lock"
+WORKER_PID_FILENAME = "worker.pid"
+
+
+class JobQueue:
+    def __init__(self, path: Path):
+        self.path = path
+
+    @contextmanager
+    def locked(self):
+        with open(self.path / QUEUE_LOCK_FILENAME, "w") as fh:
+            fcntl.flock(fh, fcntl.LOCK_EX)
+            yield
+
+    def read(self):
+        try:
+            with open(self.path / QUEUE_FILENAME) as fh:
+                return json.load(fh)
+        except (FileNotFoundError, ValueError):
+            return {"pending": [], "running": None, "last": None}
+
+    def write(self, data):
+        with open(self.path / QUEUE_FILENAME, "w") as fh:
+            json.dump(data, fh, indent=2)
+
+    def worker_running(self) -> bool:
+        # Probing the worker's lock could stop a worker that's starting from
+        # taking it, so look for the process instead.
+        try:
+            pid = int((self.path / WORKER_PID_FILENAME).read_text())
+        except (FileNotFoundError, ValueError):
+            return False
+        try:
+            os.kill(pid, 0)
+        except ProcessLookupError:
+            return False
+        except PermissionError:
+            pass
+        return True
+
+    def enqueue(self, previous, current) -> bool:
+        """Queues a checkout, returning True if a worker needs starting."""
+        with self.locked():
+            data = self.read()
+            data["pending"].append(
+                {"previous": previous, "current": current, "queued": time.time()}
+            )
+            self.write(data)
+            return not self.worker_running()
+
+    def status(self):
+        with self.locked():
+            data = self.read()
+        data["worker"] = self.worker_running()
+        return data
+
+    def work(self, run) -> bool:
+        """Runs queued checkouts until there are none left.
+
+        `run` is called with the previous and current HEAD and should return an
+        exit status. If it fails the checkout is put back on the queue and the
+        worker stops, so the next attempt starts from the right state. Returns
+        False if another worker is already running.
+        """
+        worker_lock = open(self.path / WORKER_LOCK_FILENAME, "w")
+        try:
+            fcntl.flock(worker_lock, fcntl.LOCK_EX | fcntl.LOCK_NB)
+        except BlockingIOError:
+            worker_lock.close()
+            return False
+        pid_path = self.path / WORKER_PID_FILENAME
+        with self.locked():
+            pid_path.write_text(str(os.getpid()))
+
+        def stop():
+            # No other worker writes the pid file while we hold the lock.
+            pid_path.unlink(missing_ok=True)
+            worker_lock.close()
+
+        try:
+            while True:
+                with self.locked():
+                    data = self.read()
+                    if not data["pending"]:
+                        # Release while holding the queue lock, so that a checkout
+                        # can't be queued after we've looked but before we've
+                        # stopped, and so be left waiting for no one.
+                        stop()
+                        return True
+                    job = {
+                        "previous": data["pending"][0]["previous"],
+                        "current": data["pending"][-1]["current"],
+                        "coalesced": len(data["pending"]),
+                        "started": time.time(),
+                    }
+                    data["pending"] = []
+                    data["running"] = job
+                    self.write(data)
+
+                status = run(job["previous"], job["current"])
+
+                with self.locked():
+                    data = self.read()
+                    data["running"] = None
+                    data["last"] = dict(job, status=status, finished=time.time())
+                    if status:
+                        data["pending"].insert(
+                            0,
+                            {
+                                "previous": job["previous"],
+                                "current": job["current"],
+                                "queued": job["started"],
+                            },
+                        )
+                    self.write(data)
+                if status:
+                    return True
+        finally:
+            if not worker_lock.closed:
+                stop()
+
+    def wait(self, interval=0.2):
+        """Blocks until every queued checkout is migrated, then returns the last
+        result.
+
+        Returns early if the worker stopped on a failure that nothing has been
+        queued since, or died part way through a checkout.
+        """
+        while True:
+            status = self.status()
+            last = status["last"]
+            if status["running"]:
+                if not status["worker"]:
+                    return last
+            elif not status["pending"]:
+                return last
+            elif last and last["status"]:
+                # A failed checkout stays queued until the next one retries it.
+                if all(job["queued"] <= last["finished"] for job in status["pending"]):
+                    return last
+            time.sleep(interval)
+
+
+def main(argv=None):
+    argv = sys.argv[1:] if argv is None else argv
+    queue = JobQueue(git.migrant_dir())
+    return 0 if queue.enqueue(*argv[:2]) else 1
+
+
+if __name__ == "__main__":
+    sys.exit(main())
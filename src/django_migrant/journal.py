@@ -0,0 +1,148 @@
+"""A record of each transition between commits, and how far it got.
+
+Stage one plans the migrations to roll back, the executor marks each migration
+done as it's applied or unapplied, and the stage that finishes the transition
+marks it done. If a migration fails, or the process is killed, the journal says
+exactly what's left, which is what 'migrant resume' picks up from.
+
+It's kept in sqlite in the git directory, so that every change is a transaction
+and nothing is left in the working tree. Transitions are identified by the id
+the tracer hands down through the environment to each stage.
+"""
+
+import fcntl
+import sqlite3
+import sys
+import time
+from contextlib import closing, contextmanager
+from pathlib import Path
+
+JOURNAL_FILENAME = "journal.sqlite3"
+JOURNAL_LOCK_FILENAME = "journal.lock"
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS transitions (
+    id TEXT PRIMARY KEY,
+    previous TEXT NOT NULL,
+    current TEXT NOT NULL,
+    status TEXT NOT NULL,
+    started REAL NOT NULL,
+    finished REAL
+);
+CREATE TABLE IF NOT EXISTS steps (
+    transition TEXT NOT NULL REFERENCES transitions (id),
+    alias TEXT NOT NULL,
+    direction TEXT NOT NULL,
+    app_label TEXT NOT NULL,
+    name TEXT NOT NULL,
+    position INTEGER NOT NULL,
+    done REAL,
+    UNIQUE (transition, alias, direction, app_label, name)
+);
+"""
+
+RUNNING, FAILED, DONE = "running", "failed", "done"
+
+
+class Journal:
+    def __init__(self, path: Path, transition=None):
+        self.path = path
+        self.transition = transition
+
+    @contextmanager
+    def connect(self):
+        # A connection per call, as the executor may call from several threads.
+        with closing(sqlite3.connect(self.path / JOURNAL_FILENAME, timeout=30)) as db:
+            with db:
+                db.executescript(SCHEMA)
+                yield db
+
+    @contextmanager
+    def locked(self, stdout=None):
+        """Holds a lock for the length of a transition, so only one runs at once."""
+        stdout = stdout or sys.stdout
+        with open(self.path / JOURNAL_LOCK_FILENAME, "w") as fh:
+            try:
+                fcntl.flock(fh, fcntl.LOCK_EX | fcntl.LOCK_NB)
+            except BlockingIOError:
+                stdout.write("Waiting for another migration to finish.\n")
+                stdout.flush()
+                fcntl.flock(fh, fcntl.LOCK_EX)
+            yield
+
+    def begin(self, previous, current):
+        with self.connect() as db:
+            db.execute(
+                "INSERT OR IGNORE INTO transitions (id, previous, current, status, "
+                "started) VALUES (?, ?, ?, ?, ?)",
+                (self.transition, previous, current, RUNNING, time.time()),
+            )
+
+    def finish(self, status=DONE):
+        with self.connect() as db:
+            db.execute(
+                "UPDATE transitions SET status = ?, finished = ? WHERE id = ?",
+                (status, time.time(), self.transition),
+            )
+
+    def plan(self, alias, direction, keys):
+        """Records the migrations, in order, that are to be applied or unapplied.
+
+        Migrations already planned are left as they were, done or not.
+        """
+        with self.connect() as db:
+            (start,) = db.execute(
+                "SELECT COUNT(*) FROM steps WHERE transition = ?", (self.transition,)
+            ).fetchone()
+            db.executemany(
+                "INSERT OR IGNORE INTO steps (transition, alias, direction, "
+                "app_label, name, position) VALUES (?, ?, ?, ?, ?, ?)",
+                [
+                    (self.transition, alias, direction, app_label, name, start + i)
+                    for i, (app_label, name) in enumerate(keys)
+                ],
+            )
+
+    def migration_progress(self, alias, action, migration=None, fake=False):
+        """Marks migrations done, given executor progress events."""
+        if action not in ("apply_success", "unapply_success"):
+            return
+        direction = action.split("_")[0]
+        step = (self.transition, alias, direction, migration.app_label, migration.name)
+        with self.connect() as db:
+            # Migrations may be run that weren't planned, eg dependencies.
+            db.execute(
+                "INSERT OR IGNORE INTO steps (transition, alias, direction, "
+                "app_label, name, position) VALUES (?, ?, ?, ?, ?, "
+                "(SELECT COUNT(*) FROM steps WHERE transition = ?))",
+                (*step, self.transition),
+            )
+            db.execute(
+                "UPDATE steps SET done = ? WHERE transition = ? AND alias = ? AND "
+                "direction = ? AND app_label = ? AND name = ?",
+                (time.time(), *step),
+            )
+
+    def remaining(self, direction):
+        """Returns the migrations not yet done, by database alias."""
+        with self.connect() as db:
+            rows = db.execute(
+                "SELECT alias, app_label, name FROM steps WHERE transition = ? AND "
+                "direction = ? AND done IS NULL ORDER BY position",
+                (self.transition, direction),
+            ).fetchall()
+        remaining = {}
+        for alias, app_label, name in rows:
+            remaining.setdefault(alias, []).append((app_label, name))
+        return remaining
+
+    def unfinished(self):
+        """Returns the last transition, if it didn't finish."""
+        with self.connect() as db:
+            db.row_factory = sqlite3.Row
+            row = db.execute(
+                "SELECT * FROM transitions ORDER BY started DESC LIMIT 1"
+            ).fetchone()
+        if row is None or row["status"] == DONE:
+            return None
+        return dict(row)
@@ -0,0 +1,349 @@
+import hashlib
+import json
+import os
+import sys
+import threading
+import types
+from importlib import import_module
+from importlib.util import find_spec
+from pathlib import Path
+
+from django.apps import apps
+from django.conf import settings
+from django.db.migrations.exceptions import BadMigrationError
+from django.db.migrations.loader import MigrationLoader
+
+from django_migrant import git
+
+GRAPH_CACHE_VERSION = 1
+
+
+def blob_hash(content: bytes) -> str:
+    """Returns the sha git would give a file with the given content."""
+    return hashlib.sha1(b"blob %d\0" % len(content) + content).hexdigest()
+
+
+def swappable_settings_digest() -> str:
+    """Returns a digest of the settings naming swappable models, eg
+    AUTH_USER_MODEL, which migrations resolve when they're loaded."""
+    return hashlib.sha1(
+        repr(
+            sorted(
+                (name, getattr(settings, name))
+                for name in dir(settings)
+                if name.endswith("_MODEL")
+            )
+        ).encode()
+    ).hexdigest()
+
+
+def exec_migration(module_name, migration_name, filename, source):
+    """Runs migration source as a module that isn't added to sys.modules."""
+    module = types.ModuleType(f"{module_name}.{migration_name}")
+    module.__file__ = str(filename)
+    module.__package__ = module_name
+    exec(compile(source, module.__file__, "exec"), module.__dict__)
+    return module
+
+
+class GraphCache:
+    """Migration graph metadata, keyed by the blob sha of each migration file.
+
+    Only what's needed to build the graph is kept: dependencies, replaces and
+    run_before. Swappable dependencies resolve to whatever the settings said
+    when the file was read, so the cache is discarded if those settings change.
+    """
+
+    def __init__(self, path: Path):
+        self.path = path
+        self.dirty = False
+        self.entries = {}
+        # Shared by the threads migrating each database.
+        self.lock = threading.Lock()
+        self.environment = swappable_settings_digest()
+        try:
+            with open(path) as fh:
+                data = json.load(fh)
+        except (FileNotFoundError, ValueError):
+            return
+        if (
+            data.get("version") == GRAPH_CACHE_VERSION
+            and data.get("environment") == self.environment
+        ):
+            self.entries = data["migrations"]
+
+    def get(self, sha):
+        return self.entries.get(sha)
+
+    def add(self, sha, migration):
+        with self.lock:
+            self.entries[sha] = {
+                "dependencies": [list(d) for d in migration.dependencies],
+                "replaces": [list(r) for r in migration.replaces],
+                "run_before": [list(r) for r in migration.run_before],
+            }
+            self.dirty = True
+
+    def save(self):
+        with self.lock:
+            if not self.dirty:
+                return
+            data = json.dumps(
+                {
+                    "version": GRAPH_CACHE_VERSION,
+                    "environment": self.environment,
+                    "migrations": self.entries,
+                },
+                separators=(",", ":"),
+            )
+            self.dirty = False
+        # Written aside and moved into place, as another process (eg in another
+        # worktree) may be reading.
+        temporary = self.path.with_suffix(f".{os.getpid()}.{threading.get_ident()}.tmp")
+        temporary.write_text(data)
+        os.replace(temporary, self.path)
+
+
+class LazyMigration:
+    """Stands in for a Migration until more than its place in the graph is needed.
+
+    The migration module is only imported when something other than the graph
+    metadata is asked for, eg, when the migration is applied or unapplied.
+    """
+
+    def __init__(self, name, app_label, metadata, load):
+        self.name = name
+        self.app_label = app_label
+        self.dependencies = [tuple(d) for d in metadata["dependencies"]]
+        self.replaces = [tuple(r) for r in metadata["replaces"]]
+        self.run_before = [tuple(r) for r in metadata["run_before"]]
+        self._load = load
+        self._migration = None
+
+    def __getattr__(self, name):
+        if name.startswith("__") or name in ("_load", "_migration"):
+            raise AttributeError(name)
+        if self._migration is None:
+            self._migration = self._load()
+        return getattr(self._migration, name)
+
+    def __eq__(self, other):
+        return (
+            hasattr(other, "app_label")
+            and self.name == other.name
+            and self.app_label == other.app_label
+        )
+
+    def __hash__(self):
+        return hash("%s.%s" % (self.app_label, self.name))
+
+    def __repr__(self):
+        return "<Migration %s.%s>" % (self.app_label, self.name)
+
+    def __str__(self):
+        return "%s.%s" % (self.app_label, self.name)
+
+
+class CachedMigrationLoader(MigrationLoader):
+    """A MigrationLoader that only imports migrations it hasn't seen before.
+
+    Migrations whose files are in the graph cache are represented by a
+    LazyMigration, so building the graph and working out what to migrate doesn't
+    import any of them. Without a cache this behaves like MigrationLoader.
+    """
+
+    def __init__(self, connection, graph_cache=None, **kwargs):
+        self.graph_cache = graph_cache
+        # The blob sha of each migration's file, where it was read by us.
+        self.shas = {}
+        super().__init__(connection, **kwargs)
+
+    def load_disk(self):
+        if self.graph_cache is None:
+            return super().load_disk()
+
+        disk_migrations = {}
+        migrated_apps = set()
+        for app_config in apps.get_app_configs():
+            module_name, explicit = self.migrations_module(app_config.label)
+            if module_name is None:
+                continue
+            try:
+                spec = find_spec(module_name)
+            except ImportError:
+                spec = None
+            if spec is None and explicit:
+                # Leave Django to decide whether this is an error.
+                return super().load_disk()
+            if spec is None or not spec.submodule_search_locations or not spec.origin:
+                # Missing, single file and namespace packages aren't migrated.
+                continue
+            migrated_apps.add(app_config.label)
+            path = Path(spec.submodule_search_locations[0])
+            for filename in path.glob("*.py"):
+                migration_name = filename.stem
+                if migration_name[0] in "_~":
+                    continue
+                content = filename.read_bytes()
+                sha = blob_hash(content)
+                key = app_config.label, migration_name
+                self.shas[key] = sha
+                disk_migrations[key] = self.get_migration(
+                    key,
+                    sha,
+                    load=self.importer(app_config.label, module_name, migration_name),
+                )
+
+        self.disk_migrations = disk_migrations
+        self.migrated_apps = migrated_apps
+        self.unmigrated_apps = {
+            app_config.label
+            for app_config in apps.get_app_configs()
+            if app_config.label not in migrated_apps
+        }
+        self.graph_cache.save()
+
+    def get_migration(self, key, sha, load):
+        """Returns a LazyMigration if the file is cached, else the Migration."""
+        app_label, migration_name = key
+        if self.graph_cache is not None:
+            metadata = self.graph_cache.get(sha)
+            if metadata is not None:
+                return LazyMigration(migration_name, app_label, metadata, load)
+        migration = load()
+        if self.graph_cache is not None:
+            self.graph_cache.add(sha, migration)
+        return migration
+
+    def importer(self, app_label, module_name, migration_name):
+        def load():
+            module = import_module(f"{module_name}.{migration_name}")
+            if not hasattr(module, "Migration"):
+                raise BadMigrationError(
+                    "Migration %s in app %s has no Migration class"
+                    % (migration_name, app_label)
+                )
+            return module.Migration(migration_name, app_label)
+
+        return load
+
+
+def migrations_path(app_label):
+    """Returns the directory of an app's migrations package, if it has one."""
+    module_name, _ = MigrationLoader.migrations_module(app_label)
+    if module_name is None:
+        return None
+    try:
+        spec = find_spec(module_name)
+    except ImportError:
+        return None
+    if spec is not None and spec.submodule_search_locations:
+        return Path(spec.submodule_search_locations[0])
+    return None
+
+
+def migrations_paths():
+    """Yields the migrations module name and directory of each migrated app."""
+    for app_config in apps.get_app_configs():
+        path = migrations_path(app_config.label)
+        if path is not None:
+            module_name, _ = MigrationLoader.migrations_module(app_config.label)
+            yield module_name, path
+
+
+class MigrationWatcher:
+    """Notices migration files changing underneath a long running process."""
+
+    def __init__(self):
+        self.signature = self.get_signature()
+
+    def get_signature(self):
+        signature = set()
+        for _, path in migrations_paths():
+            for filename in path.glob("*.py"):
+                stat = filename.stat()
+                signature.add((str(filename), stat.st_mtime_ns, stat.st_size))
+        return signature
+
+    def check(self) -> bool:
+        """Forgets imported migration modules if any file changed since the last check.
+
+        MigrationLoader imports migrations with import_module, so without this
+        it would keep using the modules imported the first time round.
+        """
+        signature = self.get_signature()
+        if signature == self.signature:
+            return False
+        self.signature = signature
+        for module_name, _ in migrations_paths():
+            for name in [m for m in sys.modules if m.startswith(f"{module_name}.")]:
+                del sys.modules[name]
+        return True
+
+
+class GitMigrationLoader(CachedMigrationLoader):
+    """Loads migrations as they were at a given git revision.
+
+    Migration modules that live inside the repository are read from git's object
+    store rather than the working tree, so a previous commit's migrations can be
+    loaded without checking it out. Apps outside the repository (eg, those
+    installed in site-packages) are loaded from disk as usual.
+    """
+
+    def __init__(self, connection, revision, **kwargs):
+        self.revision = revision
+        super().__init__(connection, **kwargs)
+
+    def load_disk(self):
+        super().load_disk()
+        root = git.toplevel()
+        # Kept open so that lazily loaded migrations can be read later on.
+        store = git.ObjectStore(cwd=root)
+        for app_label in list(self.migrated_apps):
+            module_name, _ = self.migrations_module(app_label)
+            path = self.revision_migrations_path(module_name).resolve()
+            if not path.is_relative_to(root):
+                continue
+            self.load_revision(app_label, module_name, path, root, store)
+        if self.graph_cache is not None:
+            self.graph_cache.save()
+
+    def revision_migrations_path(self, module_name):
+        """Returns where a migrations package is, to read it from git there."""
+        if module_name in sys.modules:
+            return Path(sys.modules[module_name].__path__[0])
+        return Path(find_spec(module_name).submodule_search_locations[0])
+
+    def load_revision(self, app_label, module_name, path, root, store):
+        """Replaces an app's disk migrations with those found at the revision."""
+        for key in [k for k in self.disk_migrations if k[0] == app_label]:
+            del self.disk_migrations[key]
+            self.shas.pop(key, None)
+
+        files = git.ls_tree(self.revision, path.relative_to(root))
+        if "__init__.py" not in files:
+            # The app had no migrations package at this revision.
+            self.migrated_apps.discard(app_label)
+            self.unmigrated_apps.add(app_label)
+            return
+
+        for filename, sha in files.items():
+            migration_name, suffix = filename[:-3], filename[-3:]
+            if suffix != ".py" or migration_name[0] in "_~":
+                continue
+            key = app_label, migration_name
+            self.shas[key] = sha
+
+            def load(migration_name=migration_name, filename=filename, sha=sha):
+                source = store.read(sha)
+                module = exec_migration(
+                    module_name, migration_name, path / filename, source
+                )
+                if not hasattr(module, "Migration"):
+                    raise BadMigrationError(
+                        "Migration %s in app %s has no Migration class"
+                        % (migration_name, app_label)
+                    )
+                return module.Migration(migration_name, app_label)
+
+            self.disk_migrations[key] = self.get_migration(key, sha, load)
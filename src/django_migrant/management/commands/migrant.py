@@ -1,60 +1,330 @@
-import json
 import os
+import shlex
 import subprocess
 import sys
+import traceback
+from contextlib import contextmanager
 from importlib import resources
 from pathlib import Path
 
-from django.core.management import call_command
-from django.core.management.base import BaseCommand, CommandError
-from django.db import DEFAULT_DB_ALIAS, connections
+from django.core.management.base import BaseCommand, CommandError, OutputWrapper
+from django.db import close_old_connections, connections
 from django.db.migrations.loader import MigrationLoader
 
-MIGRANT_FILENAME = Path(".") / ".migrant"
+from django_migrant import daemon, git, planning, projects, tracing, worktrees
+from django_migrant.databases import for_each_alias, migrated_aliases, test_databases
+from django_migrant.executor import migrate_forwards, rollback
+from django_migrant.jobs import JobQueue
+from django_migrant.journal import FAILED, Journal
+from django_migrant.loader import (
+    CachedMigrationLoader,
+    GitMigrationLoader,
+    GraphCache,
+    MigrationWatcher,
+)
+from django_migrant.reverse_sql import ReverseSQLStore
+from django_migrant.snapshots import SnapshotCache, fingerprint
+from django_migrant.states import StateCache
+from django_migrant.tracing import TRACE_FILENAME, Tracer
 
 
-def stage_one():
-    connection = connections[DEFAULT_DB_ALIAS]
-    loader = MigrationLoader(connection)
-    targets = set(loader.applied_migrations) - set(loader.disk_migrations)
+def get_loader(connection, graph_cache=None):
+    if graph_cache is None:
+        return MigrationLoader(connection)
+    return CachedMigrationLoader(connection, graph_cache=graph_cache)
 
-    targets_as_json = json.dumps(list(targets))
-    with open(MIGRANT_FILENAME, "w+") as fh:
-        fh.write(targets_as_json)
 
-    env_with_stage_two = os.environ.copy()
-    env_with_stage_two["DJANGO_MIGRANT_STAGE"] = "TWO"
-    # NB: We use raw subprocess because dulwich (used to interface with git repos)
-    # doesn't support the relative branch "-".
-    subprocess.run(["git", "checkout", "-", "--quiet"], env=env_with_stage_two)
+def checkout_previous(tracer, stage):
+    """Checks out the previous branch, the hook carrying on with the next stage."""
+    env = tracer.environ(DJANGO_MIGRANT_STAGE=stage)
+    # NB: We use raw subprocess because dulwich (used to interface with git
+    # repos) doesn't support the relative branch "-".
+    with tracer.span("checkout"):
+        try:
+            subprocess.run(["git", "checkout", "-", "--quiet"], env=env, check=True)
+        except subprocess.CalledProcessError:
+            raise CommandError(
+                "Migrating failed. Run './manage.py migrant resume' to carry on "
+                "from where it stopped."
+            )
 
 
-def stage_two():
-    connection = connections[DEFAULT_DB_ALIAS]
-    loader = MigrationLoader(connection)
-    with open(MIGRANT_FILENAME) as fh:
-        node_names = [tuple(n) for n in json.loads(fh.read())]
+@contextmanager
+def journalled(journal):
+    """Marks the transition failed if the block raises."""
+    try:
+        yield
+    except BaseException:
+        journal.finish(FAILED)
+        raise
 
-    nodes = [loader.graph.node_map[n] for n in node_names]
 
-    targets = set()
-    for n in nodes:
-        if not n.parents:
-            targets.add((n.key[0], "zero"))
-        else:
-            for parent in n.parents:
-                if parent not in nodes:
-                    targets.add(parent.key)
-    for t in list(targets):
-        call_command("migrate", t[0], t[1])
+def stage_one(
+    previous="HEAD@{1}",
+    checkout=True,
+    snapshots=None,
+    graph_cache=None,
+    state_cache=None,
+    tracer=None,
+    reverse_sql=None,
+    parallel=1,
+    journal=None,
+    plans=None,
+    fast=False,
+    defer=False,
+    squash=False,
+    aliases=None,
+):
+    tracer = tracer or Tracer()
+    journal = journal or Journal(git.migrant_dir(), tracer.transition)
+    # Snapshots need the loader anyway, so there's no point in a ready plan.
+    head = plans.ready() if plans is not None and snapshots is None else None
+
+    def leave(alias, stdout):
+        """Rolls back what it can without the previous branch's code.
+
+        Returns the migrations that still need it, None if the database was
+        restored and so needn't be migrated at all.
+        """
+        connection = connections[alias]
+        with tracer.counting(connection):
+            plan = None
+            if head is not None:
+                with tracer.span("plan_cache", alias=alias) as span:
+                    plan = plans.get(connection, head)
+                    span["hit"] = plan is not None
+            if plan is not None:
+                targets = {tuple(key) for key in plan["unapply"]}
+            else:
+                with tracer.span("load", alias=alias):
+                    loader = get_loader(connection, graph_cache)
+                targets = set(loader.applied_migrations) - set(loader.disk_migrations)
+
+            if snapshots is not None:
+                # Keep a copy of the state we're leaving and, if we've been to
+                # the destination state before, restore it rather than migrating.
+                leaving = fingerprint(connection, loader, loader.applied_migrations)
+                arriving = fingerprint(connection, loader, loader.graph.nodes)
+                if leaving != arriving:
+                    with tracer.span("snapshot_save", alias=alias):
+                        snapshots.save(connection, leaving)
+                    with tracer.span("snapshot_restore", alias=alias) as span:
+                        span["restored"] = snapshots.restore(connection, arriving)
+                    if span["restored"]:
+                        stdout.write(f"Restored database snapshot {arriving[:12]}.\n")
+                        return None
+
+            if reverse_sql is not None:
+                # Undo the migrations we're leaving with the SQL recorded when
+                # they were applied, which doesn't need their code.
+                entries = reverse_sql.find(connection, previous, targets, stdout)
+                if entries is not None:
+                    if entries:
+                        with tracer.span(
+                            "replay", alias=alias, migrations=len(entries)
+                        ):
+                            reverse_sql.replay(connection, entries, stdout)
+                    return set()
+
+            if not checkout and targets:
+                # Roll back using the previous commit's migrations, read
+                # straight from git. The working tree is never touched.
+                with tracer.span("load", alias=alias):
+                    previous_loader = GitMigrationLoader(
+                        connection, previous, graph_cache=graph_cache
+                    )
+                rollback(
+                    connection,
+                    previous_loader,
+                    targets,
+                    stdout=stdout,
+                    tracer=tracer,
+                    state_cache=state_cache,
+                    workers=parallel,
+                    fast=fast,
+                    defer=defer,
+                    squash=squash,
+                    journal=journal,
+                )
+                return set()
+            return targets
+
+    with journal.locked(), journalled(journal), tracer.span(
+        "stage_one", previous=tracer.commit(previous), head=tracer.commit("HEAD")
+    ):
+        journal.begin(git.resolve(previous), git.resolve("HEAD"))
+        results = for_each_alias(leave, aliases or migrated_aliases())
 
-    env_with_stage_three = os.environ.copy()
-    env_with_stage_three["DJANGO_MIGRANT_STAGE"] = "THREE"
-    subprocess.run(["git", "checkout", "-", "--quiet"], env=env_with_stage_three)
+        remaining = {alias: sorted(t) for alias, t in results.items() if t}
+        if not remaining:
+            forwards = [alias for alias, t in results.items() if t is not None]
+            if forwards:
+                stage_three(
+                    tracer,
+                    reverse_sql,
+                    state_cache=state_cache,
+                    aliases=forwards,
+                    parallel=parallel,
+                    fast=fast,
+                    defer=defer,
+                    squash=squash,
+                    journal=journal,
+                )
+            else:
+                journal.finish()
+            return
 
+        # Stage two picks these up from the journal.
+        for alias, targets in remaining.items():
+            journal.plan(alias, "unapply", targets)
+        checkout_previous(tracer, "TWO")
 
-def stage_three():
-    call_command("migrate")
+
+def stage_two(
+    graph_cache=None,
+    state_cache=None,
+    tracer=None,
+    parallel=1,
+    journal=None,
+    fast=False,
+    defer=False,
+    squash=False,
+):
+    tracer = tracer or Tracer()
+    journal = journal or Journal(git.migrant_dir(), tracer.transition)
+
+    def roll_back(alias, stdout):
+        connection = connections[alias]
+        with tracer.counting(connection):
+            with tracer.span("load", alias=alias):
+                loader = get_loader(connection, graph_cache)
+            rollback(
+                connection,
+                loader,
+                remaining[alias],
+                stdout=stdout,
+                tracer=tracer,
+                state_cache=state_cache,
+                workers=parallel,
+                fast=fast,
+                defer=defer,
+                squash=squash,
+                journal=journal,
+            )
+
+    with journalled(journal), tracer.span("stage_two", head=tracer.commit("HEAD")):
+        remaining = journal.remaining("unapply")
+        # Nothing is left to roll back if it failed migrating forwards.
+        if remaining:
+            for_each_alias(roll_back, list(remaining))
+        checkout_previous(tracer, "THREE")
+
+
+def stage_three(
+    tracer=None,
+    reverse_sql=None,
+    state_cache=None,
+    aliases=None,
+    parallel=1,
+    journal=None,
+    fast=False,
+    defer=False,
+    squash=False,
+):
+    tracer = tracer or Tracer()
+    journal = journal or Journal(git.migrant_dir(), tracer.transition)
+
+    def migrate_alias(alias, stdout):
+        connection = connections[alias]
+        with tracer.counting(connection):
+            # Rather than Django's migrate, which checks, plans for and signals
+            # every app whatever has changed.
+            migrate_forwards(
+                connection,
+                get_loader(connection),
+                stdout=stdout,
+                tracer=tracer,
+                reverse_sql=reverse_sql,
+                state_cache=state_cache,
+                workers=parallel,
+                fast=fast,
+                defer=defer,
+                squash=squash,
+                journal=journal,
+            )
+
+    with journalled(journal), tracer.span("stage_three", head=tracer.commit("HEAD")):
+        for_each_alias(migrate_alias, aliases or migrated_aliases())
+        journal.finish()
+
+
+def resume(
+    transition,
+    journal,
+    tracer=None,
+    graph_cache=None,
+    state_cache=None,
+    reverse_sql=None,
+    parallel=1,
+    fast=False,
+    defer=False,
+    squash=False,
+):
+    """Finishes a transition that failed or was interrupted part way.
+
+    Whatever the journal says is still to be rolled back is, using migrations
+    read from the previous commit in git, then the current commit is migrated
+    forwards.
+    """
+    tracer = tracer or Tracer(transition=transition["id"])
+    head = git.resolve("HEAD")
+    if head not in (transition["previous"], transition["current"]):
+        raise CommandError(
+            f"HEAD has moved since migrating from {transition['previous'][:7]} to "
+            f"{transition['current'][:7]}. Check out {transition['current'][:7]} "
+            "and try again."
+        )
+
+    def roll_back(alias, stdout):
+        connection = connections[alias]
+        with tracer.counting(connection):
+            with tracer.span("load", alias=alias):
+                loader = GitMigrationLoader(
+                    connection, transition["previous"], graph_cache=graph_cache
+                )
+            rollback(
+                connection,
+                loader,
+                remaining[alias],
+                stdout=stdout,
+                tracer=tracer,
+                state_cache=state_cache,
+                workers=parallel,
+                fast=fast,
+                defer=defer,
+                squash=squash,
+                journal=journal,
+            )
+
+    with journalled(journal), tracer.span("resume", head=head):
+        remaining = journal.remaining("unapply")
+        # Nothing is left to roll back if it failed migrating forwards.
+        if remaining:
+            for_each_alias(roll_back, list(remaining))
+        if head == transition["previous"]:
+            # Stage two failed, leaving us on the previous branch.
+            checkout_previous(tracer, "THREE")
+            return
+    stage_three(
+        tracer,
+        reverse_sql,
+        state_cache=state_cache,
+        parallel=parallel,
+        journal=journal,
+        fast=fast,
+        defer=defer,
+        squash=squash,
+    )
 
 
 class Command(BaseCommand):
@@ -71,14 +341,237 @@ class Command(BaseCommand):
         install_parser.set_defaults(method=self.install)
         install_parser.add_argument("dest")
         install_parser.add_argument("-i", "--interpreter", default=sys.executable)
+        install_parser.add_argument(
+            "--project",
+            action="append",
+            dest="projects",
+            default=[],
+            metavar="PATH[=SETTINGS]",
+            help="A django project in the repository, by the path of its manage.py "
+            "directory and optionally its settings module. May be given more than "
+            "once, to migrate several projects concurrently from the same hooks.",
+        )
+        install_parser.add_argument(
+            "--discover",
+            action="store_true",
+            help="Install for every project with a manage.py in the repository.",
+        )
+        install_parser.add_argument(
+            "migrate_options",
+            nargs="*",
+            metavar="MIGRATE_OPTION",
+            help="Options the hooks pass on to 'migrant migrate', after '--'. Eg, "
+            "'-- --fast --snapshots'.",
+        )
 
         migrate_parser = subparsers.add_parser(
             "migrate",
             help="Migrates database seemlessly from one git branch to another.",
         )
-
+        # The post-checkout hook passes the previous and current HEAD.
+        migrate_parser.add_argument("previous", nargs="?", default="HEAD@{1}")
+        migrate_parser.add_argument("current", nargs="?", default="HEAD")
+        migrate_parser.add_argument(
+            "--no-checkout",
+            action="store_false",
+            dest="checkout",
+            help="Roll back using migrations read from git rather than checking "
+            "out the previous branch.",
+        )
+        self.add_transition_arguments(migrate_parser)
+        self.add_test_databases_argument(migrate_parser)
         migrate_parser.set_defaults(method=self.migrate)
 
+        serve_parser = subparsers.add_parser(
+            "serve",
+            help="Keeps django loaded, ready to migrate on behalf of the "
+            "post-checkout hook.",
+        )
+        self.add_transition_arguments(serve_parser)
+        self.add_test_databases_argument(serve_parser)
+        serve_parser.set_defaults(method=self.serve)
+
+        work_parser = subparsers.add_parser(
+            "work",
+            help="Migrates the checkouts queued by the post-checkout hook, in the "
+            "background.",
+        )
+        self.add_transition_arguments(work_parser)
+        self.add_test_databases_argument(work_parser)
+        work_parser.set_defaults(method=self.work)
+
+        resume_parser = subparsers.add_parser(
+            "resume",
+            help="Carries on with a migration that failed or was interrupted, from "
+            "where it stopped.",
+        )
+        self.add_transition_arguments(resume_parser)
+        resume_parser.set_defaults(method=self.resume)
+
+        wait_parser = subparsers.add_parser(
+            "wait",
+            help="Waits for the background worker to finish migrating.",
+        )
+        wait_parser.set_defaults(method=self.wait)
+
+        status_parser = subparsers.add_parser(
+            "status",
+            help="Shows the checkouts waiting to be migrated in the background.",
+        )
+        status_parser.set_defaults(method=self.status)
+
+        plan_parser = subparsers.add_parser(
+            "plan",
+            help="Shows what switching to another commit would migrate, and what "
+            "it might cost, without migrating.",
+        )
+        plan_parser.add_argument("ref", help="The commit to switch to.")
+        plan_parser.add_argument(
+            "--from",
+            dest="source",
+            help="The commit being left, if it isn't the one checked out.",
+        )
+        plan_parser.add_argument(
+            "--threshold",
+            type=int,
+            help="Ask before going on if the migrations touch more than this many "
+            "rows, exiting with an error if the answer is no.",
+        )
+        plan_parser.add_argument(
+            "--noinput",
+            "--no-input",
+            action="store_false",
+            dest="interactive",
+            help="Exit with an error rather than asking, when over the threshold.",
+        )
+        plan_parser.set_defaults(method=self.plan)
+
+        worktree_parser = subparsers.add_parser(
+            "worktree",
+            help="Gives a new worktree databases of its own, cloned from the main "
+            "worktree's, and migrates them to the worktree's HEAD.",
+        )
+        self.add_transition_arguments(worktree_parser)
+        worktree_parser.set_defaults(method=self.worktree)
+
+        prune_parser = subparsers.add_parser(
+            "prune",
+            help="Drops the databases of worktrees that have been removed.",
+        )
+        prune_parser.set_defaults(method=self.prune)
+
+        precompute_parser = subparsers.add_parser(
+            "precompute",
+            help="Plans switching to the most recently updated branches ahead of "
+            "time, so that checking them out needn't.",
+        )
+        precompute_parser.add_argument(
+            "refs",
+            nargs="*",
+            help="The commits to plan for. Default, the most recently updated "
+            "branches.",
+        )
+        precompute_parser.add_argument(
+            "-n",
+            "--count",
+            type=int,
+            default=10,
+            help="How many of the most recently updated branches to plan for. "
+            "Default 10.",
+        )
+        precompute_parser.add_argument(
+            "--graph-cache",
+            action="store_true",
+            help="Cache migration graph metadata between runs.",
+        )
+        precompute_parser.set_defaults(method=self.precompute)
+
+        trace_parser = subparsers.add_parser(
+            "trace",
+            help="Summarises the slowest stages and migrations in the trace.",
+        )
+        trace_parser.add_argument(
+            "-n",
+            "--checkouts",
+            type=int,
+            default=20,
+            help="How many of the most recent checkouts to include. Default 20.",
+        )
+        trace_parser.add_argument(
+            "--migrations",
+            type=int,
+            default=10,
+            help="How many of the slowest migrations to list. Default 10.",
+        )
+        trace_parser.set_defaults(method=self.trace)
+
+    def add_transition_arguments(self, parser):
+        """Adds the options shared by every sub-command that migrates."""
+        parser.add_argument(
+            "--snapshots",
+            action="store_true",
+            help="Snapshot the database when leaving a migration state and restore "
+            "it when returning, instead of running migrations.",
+        )
+        parser.add_argument(
+            "--snapshot-budget",
+            type=int,
+            default=1024,
+            help="Disk space, in MB, that snapshots may use. Default 1024.",
+        )
+        parser.add_argument(
+            "--graph-cache",
+            action="store_true",
+            help="Cache the migration graph, and the project states worked out "
+            "from it, so that unchanged migrations needn't be imported.",
+        )
+        parser.add_argument(
+            "--trace",
+            action="store_true",
+            help="Append the time taken by each stage and migration to a trace "
+            "file. See 'migrant trace'.",
+        )
+        parser.add_argument(
+            "--reverse-sql",
+            action="store_true",
+            help="Record the SQL that unapplies each migration when applying it, "
+            "and roll back with it rather than the previous branch's code.",
+        )
+        parser.add_argument(
+            "--parallel",
+            type=int,
+            default=1,
+            metavar="N",
+            help="Run migrations that don't depend on each other at the same time, "
+            "on up to N connections. PostgreSQL only.",
+        )
+        parser.add_argument(
+            "--fast",
+            action="store_true",
+            help="Don't wait for the disk while migrating, and on PostgreSQL run "
+            "each plan in one transaction where possible. For dev databases only.",
+        )
+        parser.add_argument(
+            "--defer-indexes",
+            dest="defer",
+            action="store_true",
+            help="Rebuild indexes and check foreign keys once, at the end of each "
+            "plan, rather than after each migration.",
+        )
+        parser.add_argument(
+            "--squash",
+            action="store_true",
+            help="Optimize the operations of migrations next to each other in an "
+            "app, as squashmigrations would, and run them as one.",
+        )
+
+    def add_test_databases_argument(self, parser):
+        parser.add_argument(
+            "--test-databases",
+            action="store_true",
+            help="Migrate the test databases kept by 'test --keepdb' as well.",
+        )
+
     def handle(self, *args, method, **options):
         method(*args, **options)
 
@@ -94,10 +587,63 @@ class Command(BaseCommand):
         if not dest_git_hooks_path:
             raise CommandError(f"'{path}' does not contain a 'hooks' directory.")
 
-        self.create_hook(dest_git_hooks_path, "post-checkout")
-        self.create_hook(dest_git_hooks_path, "pre-rebase")
+        interpreter = options["interpreter"]
+        migrate_options = options["migrate_options"]
+        suffix = self.install_projects(path, options)
+        self.create_hook(
+            dest_git_hooks_path,
+            "post-checkout",
+            interpreter,
+            f"post-checkout{suffix}",
+            migrate_options,
+        )
+        self.create_hook(dest_git_hooks_path, "pre-rebase", interpreter)
+        self.create_hook(
+            dest_git_hooks_path,
+            "post-rewrite",
+            interpreter,
+            f"post-rewrite{suffix}",
+            migrate_options,
+        )
+
+    def install_projects(self, path: Path, options):
+        """Records the projects to migrate, if there's more than the one at the
+        root of the repository. Returns the suffix of the hook templates to use.
+        """
+        found = [projects.project(spec) for spec in options["projects"]]
+        if options["discover"]:
+            found += projects.discover(path)
+        # Those given explicitly, with their settings, win over those discovered.
+        unique = {}
+        for project in found:
+            unique.setdefault(project["path"], project)
+        found = list(unique.values())
+        if found in ([], [projects.project(".")]):
+            return ""
+        names = {}
+        for project in found:
+            if not (path / project["path"] / "manage.py").is_file():
+                raise CommandError(f"'{project['path']}' has no manage.py.")
+            # Projects keep their state in a directory named after them.
+            other = names.setdefault(project["name"], project["path"])
+            if other != project["path"]:
+                raise CommandError(
+                    f"'{other}' and '{project['path']}' would both be called "
+                    f"'{project['name']}'."
+                )
+        projects.save(path, found)
+        for project in found:
+            self.stdout.write(f"Project '{project['name']}': {project['path']}")
+        return "-projects"
 
-    def create_hook(self, path: Path, name: str):
+    def create_hook(
+        self,
+        path: Path,
+        name: str,
+        interpreter: str = sys.executable,
+        template: str = None,
+        migrate_options=(),
+    ):
         hook_filename = path / name
         if hook_filename.is_file():
             ok_to_append = input(
@@ -109,7 +655,9 @@ class Command(BaseCommand):
         else:
             exists = False
 
-        template_filename = resources.files("django_migrant") / "hook_templates" / name
+        template_filename = (
+            resources.files("django_migrant") / "hook_templates" / (template or name)
+        )
 
         with open(template_filename, "r") as fh:
             content = fh.read()
@@ -125,17 +673,328 @@ class Command(BaseCommand):
         else:
             header = ""
 
-        content = header + content
+        # Both hooks that migrate are given the same options.
+        migrate_options = "".join(f" {shlex.quote(o)}" for o in migrate_options)
+        content = content.replace("{{ options }}", migrate_options)
+        content = header + content.replace("{{ interpreter }}", interpreter)
         with open(hook_filename, "a") as fh:
             fh.write(content)
 
         self.stdout.write(f"{name} hook created: {hook_filename}")
 
+    def get_caches(self, options):
+        """Returns the caches a transition should use, given the options."""
+        snapshots = None
+        if options["snapshots"]:
+            snapshots = SnapshotCache(
+                git.migrant_dir() / "snapshots",
+                budget=options["snapshot_budget"] * 1024 * 1024,
+            )
+        graph_cache = state_cache = None
+        if options["graph_cache"]:
+            graph_cache = GraphCache(git.migrant_dir() / "graph.json")
+            state_cache = StateCache(git.migrant_dir() / "states")
+        reverse_sql = None
+        if options["reverse_sql"]:
+            reverse_sql = ReverseSQLStore(git.migrant_dir() / "reverse-sql")
+        return {
+            "snapshots": snapshots,
+            "graph_cache": graph_cache,
+            "state_cache": state_cache,
+            "reverse_sql": reverse_sql,
+            # Only ever has plans in it if 'migrant precompute' has been run.
+            "plans": planning.PlanCache(git.migrant_dir() / "plans"),
+        }
+
+    def get_tracer(self, options, transition=None):
+        if options["trace"]:
+            return Tracer(git.migrant_dir() / TRACE_FILENAME, transition=transition)
+        return Tracer(transition=transition)
+
     def migrate(self, *args, **options):
+        caches = self.get_caches(options)
+        tracer = self.get_tracer(options)
+
         DJANGO_MIGRANT_STAGE = os.environ.get("DJANGO_MIGRANT_STAGE")
         if not DJANGO_MIGRANT_STAGE:
-            stage_one()
+            # Checking out the previous branch moves HEAD@{1}, so resolve it now.
+            previous = git.resolve(options["previous"])
+            stage_one(
+                options["previous"],
+                checkout=options["checkout"],
+                tracer=tracer,
+                parallel=options["parallel"],
+                fast=options["fast"],
+                defer=options["defer"],
+                squash=options["squash"],
+                **caches,
+            )
+            if options["test_databases"]:
+                self.migrate_test_databases(previous, options)
         elif DJANGO_MIGRANT_STAGE == "TWO":
-            stage_two()
+            stage_two(
+                graph_cache=caches["graph_cache"],
+                state_cache=caches["state_cache"],
+                tracer=tracer,
+                parallel=options["parallel"],
+                fast=options["fast"],
+                defer=options["defer"],
+                squash=options["squash"],
+            )
         elif DJANGO_MIGRANT_STAGE == "THREE":
-            stage_three()
+            stage_three(
+                tracer,
+                reverse_sql=caches["reverse_sql"],
+                state_cache=caches["state_cache"],
+                parallel=options["parallel"],
+                fast=options["fast"],
+                defer=options["defer"],
+                squash=options["squash"],
+            )
+
+    def migrate_test_databases(self, previous, options, stdout=None):
+        """Gives the test databases the same migrations as the databases."""
+        stdout = stdout or self.stdout
+        with test_databases(migrated_aliases()) as aliases:
+            if not aliases:
+                return
+            stdout.write("Migrating test databases.")
+            tracer = self.get_tracer(options)
+            # A journal of their own keeps them out of 'migrant resume', which
+            # would resume with the usual databases.
+            path = git.migrant_dir() / "test-databases"
+            path.mkdir(exist_ok=True)
+            # The previous branch has been and gone, so read it from git.
+            stage_one(
+                previous,
+                checkout=False,
+                tracer=tracer,
+                parallel=options["parallel"],
+                fast=options["fast"],
+                defer=options["defer"],
+                squash=options["squash"],
+                journal=Journal(path, tracer.transition),
+                aliases=aliases,
+                **self.get_caches(options),
+            )
+
+    def resume(self, *args, **options):
+        journal = Journal(git.migrant_dir())
+        with journal.locked(self.stdout):
+            transition = journal.unfinished()
+            if transition is None:
+                self.stdout.write("Nothing to resume.")
+                return
+            self.stdout.write(
+                f"Resuming migration from {transition['previous'][:7]} to "
+                f"{transition['current'][:7]}."
+            )
+            journal.transition = transition["id"]
+            caches = self.get_caches(options)
+            resume(
+                transition,
+                journal,
+                tracer=self.get_tracer(options, transition=transition["id"]),
+                graph_cache=caches["graph_cache"],
+                state_cache=caches["state_cache"],
+                reverse_sql=caches["reverse_sql"],
+                parallel=options["parallel"],
+                fast=options["fast"],
+                defer=options["defer"],
+                squash=options["squash"],
+            )
+
+    def serve(self, *args, **options):
+        watcher = MigrationWatcher()
+
+        def handle(previous, current):
+            # Output goes to the client, which the daemon redirects stdout to.
+            stdout = OutputWrapper(sys.stdout)
+            # Pick up migrations that changed since the last checkout.
+            if watcher.check():
+                stdout.write("Migration files changed, reloading.")
+            close_old_connections()
+            # Checking out from here would re-enter the hook, so always roll
+            # back using migrations read from git.
+            stage_one(
+                previous,
+                checkout=False,
+                tracer=self.get_tracer(options),
+                parallel=options["parallel"],
+                fast=options["fast"],
+                defer=options["defer"],
+                squash=options["squash"],
+                **self.get_caches(options),
+            )
+            if options["test_databases"]:
+                self.migrate_test_databases(previous, options, stdout)
+            return 0
+
+        self.stdout.write(f"Listening on {daemon.socket_path()}")
+        try:
+            daemon.serve(handle)
+        except KeyboardInterrupt:
+            pass
+
+    def work(self, *args, **options):
+        def run(previous, current):
+            self.stdout.write(f"Migrating from {previous[:7]} to {current[:7]}.")
+            try:
+                # The working tree belongs to the user now, so never check out.
+                stage_one(
+                    previous,
+                    checkout=False,
+                    tracer=self.get_tracer(options),
+                    parallel=options["parallel"],
+                    fast=options["fast"],
+                    defer=options["defer"],
+                    squash=options["squash"],
+                    **self.get_caches(options),
+                )
+                if options["test_databases"]:
+                    self.migrate_test_databases(previous, options)
+            except Exception:
+                self.stderr.write(traceback.format_exc())
+                return 1
+            return 0
+
+        if not JobQueue(git.migrant_dir()).work(run):
+            self.stdout.write("A worker is already running.")
+
+    def wait(self, *args, **options):
+        last = JobQueue(git.migrant_dir()).wait()
+        if last and last["status"]:
+            raise CommandError(
+                f"Migrating from {last['previous'][:7]} to {last['current'][:7]} "
+                f"failed, see {git.migrant_dir() / 'worker.log'}."
+            )
+
+    def status(self, *args, **options):
+        status = JobQueue(git.migrant_dir()).status()
+        self.stdout.write(
+            "Worker: " + ("running" if status["worker"] else "not running")
+        )
+        if status["running"]:
+            job = status["running"]
+            self.stdout.write(
+                f"Migrating: {job['previous'][:7]} to {job['current'][:7]} "
+                f"({job['coalesced']} checkouts)"
+            )
+        for job in status["pending"]:
+            self.stdout.write(f"Queued: {job['previous'][:7]} to {job['current'][:7]}")
+        if status["last"]:
+            job = status["last"]
+            result = "failed" if job["status"] else "OK"
+            self.stdout.write(
+                f"Last: {job['previous'][:7]} to {job['current'][:7]} {result}"
+            )
+
+    def worktree(self, *args, **options):
+        previous = worktrees.provision(migrated_aliases(), self.stdout)
+        if previous is None:
+            return
+        # A new worktree has no previous branch to check out.
+        stage_one(
+            previous,
+            checkout=False,
+            tracer=self.get_tracer(options),
+            parallel=options["parallel"],
+            fast=options["fast"],
+            defer=options["defer"],
+            squash=options["squash"],
+            **self.get_caches(options),
+        )
+
+    def prune(self, *args, **options):
+        worktrees.prune(self.stdout)
+
+    def plan(self, *args, **options):
+        summary = tracing.summarise(tracing.read(git.migrant_dir() / TRACE_FILENAME))
+        history = {(m["name"], m["action"]): m["mean"] for m in summary[1]}
+        target = git.resolve(options["ref"])
+
+        total = 0
+        for alias in migrated_aliases():
+            connection = connections[alias]
+            if options["source"]:
+                source = GitMigrationLoader(connection, options["source"])
+            else:
+                source = get_loader(connection)
+            steps = planning.plan_switch(
+                connection, source, GitMigrationLoader(connection, target)
+            )
+            steps = planning.estimate(connection, steps, history)
+
+            self.stdout.write(
+                f"Database '{alias}', switching to {options['ref']} ({target[:7]}):"
+            )
+            if not steps:
+                self.stdout.write("  Nothing to migrate.")
+            for step in steps:
+                rows = "?" if step["rows"] is None else f"~{step['rows']:,}"
+                seconds = (
+                    "" if step["seconds"] is None else f"  took {step['seconds']:.3f}s"
+                )
+                self.stdout.write(
+                    f"  {step['action']:<8} {step['migration']:<40} "
+                    f"{', '.join(step['tables']) or '-'}  {rows} rows"
+                    + (" (runs code)" if step["opaque"] else "")
+                    + seconds
+                )
+                total += step["rows"] or 0
+
+        threshold = options["threshold"]
+        if threshold is None or total <= threshold:
+            return
+        message = f"The migrations touch about {total:,} rows, over {threshold:,}."
+        if not options["interactive"]:
+            raise CommandError(message)
+        if input(f"{message} Carry on [y/N]? ").upper() != "Y":
+            raise CommandError("Not carrying on.")
+
+    def precompute(self, *args, **options):
+        plans = planning.PlanCache(git.migrant_dir() / "plans")
+        graph_cache = None
+        if options["graph_cache"]:
+            graph_cache = GraphCache(git.migrant_dir() / "graph.json")
+        head = git.resolve("HEAD")
+        refs = options["refs"] or git.recent_refs(options["count"])
+        commits = [c for c in dict.fromkeys(map(git.resolve, refs)) if c != head]
+
+        def plan_alias(alias, stdout):
+            connection = connections[alias]
+            for commit in commits:
+                if plans.get(connection, commit) is not None:
+                    continue
+                target = GitMigrationLoader(connection, commit, graph_cache=graph_cache)
+                plan = plans.put(connection, commit, target)
+                stdout.write(
+                    f"Planned {commit[:7]}: {len(plan['unapply'])} to roll back.\n"
+                )
+
+        for_each_alias(plan_alias, migrated_aliases(), self.stdout)
+
+    def trace(self, *args, **options):
+        spans = tracing.read(
+            git.migrant_dir() / TRACE_FILENAME, limit=options["checkouts"]
+        )
+        if not spans:
+            self.stdout.write("Nothing traced yet. Migrate with --trace first.")
+            return
+        stages, migrations = tracing.summarise(spans)
+        checkouts = len({s["transition"] for s in spans})
+
+        self.stdout.write(f"Stages, over the last {checkouts} checkout(s):")
+        for stage in stages:
+            self.stdout.write(
+                f"  {stage['name']:<20} {stage['count']:>4} runs"
+                f"  mean {stage['mean']:8.3f}s  max {stage['max']:8.3f}s"
+            )
+        if migrations:
+            self.stdout.write("Slowest migrations:")
+        for migration in migrations[: options["migrations"]]:
+            self.stdout.write(
+                f"  {migration['name']:<40} {migration['action']:<7}"
+                f"  mean {migration['mean']:8.3f}s  max {migration['max']:8.3f}s"
+                f"  {migration['rows']} rows"
+            )
@@ -0,0 +1,245 @@
+"""Works out what a branch switch would migrate, and roughly what it would cost.
+
+Nothing is migrated. The rollback is planned with the migrations being left and
+the forward migration with those of the commit being switched to, as stage two
+and stage three would plan them. Each step is annotated with the tables its
+operations touch, the database's own estimate of the rows in them and, if the
+switch has been traced before, how long the migration took.
+
+Plans can also be worked out ahead of time, eg in the background after a fetch,
+and kept in a PlanCache for stage one to pick up rather than loading migrations
+while you wait.
+"""
+
+import hashlib
+import json
+from pathlib import Path
+
+from django.apps import apps
+from django.db import DatabaseError
+from django.db.migrations.recorder import MigrationRecorder
+from django.db.migrations.operations import RunPython, RunSQL, SeparateDatabaseAndState
+
+from django_migrant import git
+from django_migrant.effects import STATE_ONLY
+from django_migrant.executor import rollback_plan
+from django_migrant.loader import migrations_paths
+
+
+def db_table(app_label, model_name):
+    model = apps.all_models.get(app_label, {}).get(model_name)
+    if model is not None:
+        return model._meta.db_table
+    # A model that's not installed any more, so assume the default.
+    return f"{app_label}_{model_name}"
+
+
+def operation_tables(app_label, operation):
+    """Returns the tables an operation touches, and whether there may be more.
+
+    RunPython and RunSQL could touch anything, so they're reported as opaque.
+    """
+    if isinstance(operation, SeparateDatabaseAndState):
+        tables, opaque = set(), False
+        for database_operation in operation.database_operations:
+            more, more_opaque = operation_tables(app_label, database_operation)
+            tables |= more
+            opaque = opaque or more_opaque
+        return tables, opaque
+    if isinstance(operation, (RunPython, RunSQL)):
+        return set(), True
+    if isinstance(operation, STATE_ONLY):
+        return set(), False
+    model_name = getattr(operation, "model_name_lower", None) or getattr(
+        operation, "name_lower", None
+    )
+    if model_name is None:
+        return set(), True
+    return {db_table(app_label, model_name)}, False
+
+
+def table_rows(connection, tables):
+    """Returns the backend's estimate of the rows in each table.
+
+    Estimates come from the statistics the database keeps for its planner, so
+    they're cheap but may be out of date. Tables that don't exist have no rows,
+    and tables the backend has no statistics for are left out.
+    """
+    existing = set(connection.introspection.table_names())
+    rows = {table: 0 for table in tables if table not in existing}
+    tables = sorted(table for table in tables if table in existing)
+    if not tables:
+        return rows
+
+    placeholders = ", ".join(["%s"] * len(tables))
+    with connection.cursor() as cursor:
+        if connection.vendor == "postgresql":
+            # Negative when the table has never been vacuumed or analyzed.
+            cursor.execute(
+                "SELECT relname, reltuples FROM pg_class WHERE relkind IN ('r', 'p') "
+                f"AND pg_table_is_visible(oid) AND relname IN ({placeholders})",
+                tables,
+            )
+            rows.update(
+                (table, int(count)) for table, count in cursor.fetchall() if count >= 0
+            )
+        elif connection.vendor == "mysql":
+            cursor.execute(
+                "SELECT TABLE_NAME, TABLE_ROWS FROM information_schema.TABLES "
+                f"WHERE TABLE_SCHEMA = DATABASE() AND TABLE_NAME IN ({placeholders})",
+                tables,
+            )
+            rows.update(
+                (table, int(count))
+                for table, count in cursor.fetchall()
+                if count is not None
+            )
+        elif connection.vendor == "sqlite":
+            # Only there once ANALYZE has been run.
+            try:
+                # The first number of each entry is the rows in the table.
+                cursor.execute(
+                    f"SELECT tbl, stat FROM sqlite_stat1 WHERE tbl IN ({placeholders})",
+                    tables,
+                )
+                stats = {table: stat for table, stat in cursor.fetchall()}
+            except DatabaseError:
+                stats = {}
+            for table in tables:
+                if table in stats:
+                    rows[table] = int(stats[table].split()[0])
+                    continue
+                # Without statistics, the largest rowid is a cheap upper bound.
+                cursor.execute(
+                    f"SELECT MAX(rowid) FROM {connection.ops.quote_name(table)}"
+                )
+                (count,) = cursor.fetchone()
+                rows[table] = count or 0
+    return rows
+
+
+def plan_switch(connection, source, target):
+    """Returns the migrations to unapply and apply to switch between loaders.
+
+    `source` has the migrations currently applied, `target` those of the commit
+    being switched to. Returns a list of (action, migration) in the order they
+    would be run.
+    """
+    applied = set(source.applied_migrations)
+    leaving = applied - set(target.graph.nodes)
+
+    steps = []
+    for migration, _ in rollback_plan(source, leaving):
+        steps.append(("unapply", migration))
+        applied.discard((migration.app_label, migration.name))
+
+    planned = set()
+    for leaf in target.graph.leaf_nodes():
+        for key in target.graph.forwards_plan(leaf):
+            if key not in applied and key not in planned:
+                planned.add(key)
+                steps.append(("apply", target.graph.nodes[key]))
+    return steps
+
+
+def estimate(connection, steps, history=None):
+    """Annotates each step with the tables it touches and what it might cost.
+
+    `history` maps (migration, action) to the mean time taken, as summarised
+    from the trace. Returns a list of dicts.
+    """
+    history = history or {}
+    annotated = []
+    for action, migration in steps:
+        tables, opaque = set(), False
+        for operation in migration.operations:
+            more, more_opaque = operation_tables(migration.app_label, operation)
+            tables |= more
+            opaque = opaque or more_opaque
+        annotated.append(
+            {
+                "action": action,
+                "migration": f"{migration.app_label}.{migration.name}",
+                "tables": sorted(tables),
+                "opaque": opaque,
+            }
+        )
+
+    rows = table_rows(connection, {t for step in annotated for t in step["tables"]})
+    for step in annotated:
+        if all(table in rows for table in step["tables"]):
+            step["rows"] = sum(rows[table] for table in step["tables"])
+        else:
+            step["rows"] = None
+        step["seconds"] = history.get((step["migration"], step["action"]))
+    return annotated
+
+
+def applied_digest(connection) -> str:
+    """Returns a digest identifying a database and the migrations applied to it."""
+    digest = hashlib.sha256(str(connection.settings_dict["NAME"]).encode())
+    for app_label, name in sorted(MigrationRecorder(connection).applied_migrations()):
+        digest.update(f"\n{app_label}.{name}".encode())
+    return digest.hexdigest()
+
+
+class PlanCache:
+    """Branch switches planned ahead of time.
+
+    Each plan is keyed by the commit being switched to and the migrations applied
+    to the database when it was planned, so a plan is only used if the database
+    hasn't been migrated since. Only the most recent plans are kept.
+    """
+
+    def __init__(self, path: Path, keep=100):
+        self.path = path
+        self.keep = keep
+
+    def ready(self):
+        """Returns the commit checked out, if there may be plans for it.
+
+        Plans are made from the committed migrations, so they're no good if any
+        migrations inside the repository have changed since.
+        """
+        if not self.path.is_dir():
+            return None
+        root = git.toplevel()
+        paths = [
+            f"{path.resolve()}/*.py"
+            for _, path in migrations_paths()
+            if path.resolve().is_relative_to(root)
+        ]
+        if not git.is_clean(paths):
+            return None
+        return git.resolve("HEAD")
+
+    def location(self, connection, commit) -> Path:
+        return self.path / f"{commit}-{applied_digest(connection)[:16]}.json"
+
+    def get(self, connection, commit):
+        try:
+            with open(self.location(connection, commit)) as fh:
+                return json.load(fh)
+        except (FileNotFoundError, ValueError):
+            return None
+
+    def put(self, connection, commit, target):
+        """Keeps what stage one would roll back when switching to `target`, the
+        loader for `commit`.
+
+        It's worked out as stage one does, from the migrations on disk rather
+        than the graph. Stages two and three still plan their own migrations, as
+        they have to load them to run them.
+        """
+        plan = {
+            "unapply": sorted(
+                set(target.applied_migrations) - set(target.disk_migrations)
+            ),
+        }
+        self.path.mkdir(parents=True, exist_ok=True)
+        with open(self.location(connection, commit), "w") as fh:
+            json.dump(plan, fh)
+        plans = sorted(self.path.glob("*.json"), key=lambda p: p.stat().st_mtime)
+        for old in plans[: -self.keep]:
+            old.unlink(missing_ok=True)
+        return plan
@@ -0,0 +1,53 @@
+"""Decides whether a checkout needs migrating, without starting django.
+
+Starting django and loading migrations takes seconds, but most checkouts don't
+touch a single migration. The post-checkout hook runs this first:
+
+    python -m django_migrant.preflight "$1" "$2" && ./manage.py migrant migrate
+
+It exits with status 0 when migration files differ between the two commits (or
+when it can't tell), and 1 when there's nothing to do.
+"""
+
+import argparse
+import os
+import subprocess
+import sys
+
+# Any file inside a directory called "migrations", at any depth.
+DEFAULT_PATHSPEC = ":(glob)**/migrations/**"
+
+
+def migrations_changed(previous, current, pathspecs=(DEFAULT_PATHSPEC,)) -> bool:
+    result = subprocess.run(
+        ["git", "diff", "--quiet", previous, current, "--", *pathspecs],
+        capture_output=True,
+    )
+    # git diff exits with 1 when there are differences, and more than that on
+    # error (eg, the null sha of a fresh clone), in which case we play safe.
+    return result.returncode != 0
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(prog="python -m django_migrant.preflight")
+    parser.add_argument("previous")
+    parser.add_argument("current")
+    parser.add_argument(
+        "--pathspec",
+        action="append",
+        dest="pathspecs",
+        help="Where to look for migrations, if not in 'migrations' directories. "
+        "May be given more than once.",
+    )
+    args = parser.parse_args(argv)
+
+    # Checkouts made by migrant itself always need to run.
+    if os.environ.get("DJANGO_MIGRANT_STAGE"):
+        return 0
+
+    pathspecs = args.pathspecs or [DEFAULT_PATHSPEC]
+    return 0 if migrations_changed(args.previous, args.current, pathspecs) else 1
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,176 @@
+"""Migrates several django projects in one repository from the same git hooks.
+
+A repository can hold more than one django project, each with a manage.py,
+settings and databases of its own. `migrant install --project` records them,
+and the hooks then run
+
+    python -m django_migrant.projects migrate "$1" "$2"
+
+which migrates every project whose migrations changed, each in a process of its
+own and all at once. Output is buffered per project and written out, under a
+heading, as each finishes. It exits with the highest status of them all.
+
+Each project keeps its state apart, in .git/migrant/projects/<name>, told which
+by DJANGO_MIGRANT_PROJECT. Projects share a working tree, so none of them can
+check out the previous branch to roll back: they roll back using migrations
+read from git, as with --no-checkout.
+
+This module deliberately doesn't import django.
+"""
+
+import argparse
+import json
+import os
+import subprocess
+import sys
+import traceback
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from pathlib import Path, PurePosixPath
+
+from django_migrant import git
+from django_migrant.daemon import NO_DAEMON
+from django_migrant.git import PROJECT_ENV
+from django_migrant.preflight import migrations_changed
+
+PROJECTS_FILENAME = "projects.json"
+
+
+def registry_path(root: Path) -> Path:
+    """Returns where the projects of the repository at root are recorded."""
+    common_dir = git.run("rev-parse", "--git-common-dir", cwd=root).strip()
+    return (root / common_dir).resolve() / "migrant" / PROJECTS_FILENAME
+
+
+def load(root: Path) -> list:
+    try:
+        with open(registry_path(root)) as fh:
+            return json.load(fh)
+    except FileNotFoundError:
+        return []
+
+
+def save(root: Path, projects: list):
+    path = registry_path(root)
+    path.parent.mkdir(exist_ok=True)
+    with open(path, "w") as fh:
+        json.dump(projects, fh, indent=2)
+
+
+def project(spec: str) -> dict:
+    """Returns a project from "PATH" or "PATH=SETTINGS", PATH relative to the
+    root of the repository."""
+    path, _, settings = spec.partition("=")
+    path = PurePosixPath(path).as_posix()
+    name = "root" if path == "." else path.replace("/", "-")
+    return {"name": name, "path": path, "settings": settings or None}
+
+
+def discover(root: Path) -> list:
+    """Returns a project for each manage.py tracked in the repository at root."""
+    output = git.run(
+        "ls-files", "--full-name", "--", ":(top,glob)**/manage.py", cwd=root
+    )
+    return [project(str(PurePosixPath(path).parent)) for path in output.split()]
+
+
+def pathspec(project: dict) -> str:
+    """Returns the pathspec matching a project's migrations."""
+    prefix = "" if project["path"] == "." else f"{project['path']}/"
+    return f":(top,glob){prefix}**/migrations/**"
+
+
+def run(project: dict, root: Path, command: str, previous, current, options=()):
+    """Runs a project's part of a checkout, returning its exit status and output.
+
+    "worktree" gives a new worktree databases of the project's own. "migrate"
+    hands the checkout to the project's `migrant serve`, if it's running, or
+    migrates it in `./manage.py migrant migrate`.
+    """
+    env = {**os.environ, PROJECT_ENV: project["name"]}
+    if project["settings"]:
+        env["DJANGO_SETTINGS_MODULE"] = project["settings"]
+    output = []
+
+    def call(*args):
+        result = subprocess.run(
+            [sys.executable, *args],
+            cwd=root / project["path"],
+            env=env,
+            stdout=subprocess.PIPE,
+            stderr=subprocess.STDOUT,
+            text=True,
+        )
+        output.append(result.stdout)
+        return result.returncode
+
+    if command == "worktree":
+        status = call("manage.py", "migrant", "worktree", *options)
+    elif not migrations_changed(previous, current, [pathspec(project)]):
+        status = 0
+    else:
+        status = call("-m", "django_migrant.daemon", previous, current)
+        if status == NO_DAEMON:
+            status = call(
+                "manage.py",
+                "migrant",
+                "migrate",
+                "--no-checkout",
+                *options,
+                previous,
+                current,
+            )
+    return status, "".join(output)
+
+
+def run_all(projects, root, command, previous, current, options=(), stdout=None):
+    """Runs each project's part of a checkout concurrently.
+
+    Every project is run to completion, even if another fails. Returns the
+    highest exit status.
+    """
+    stdout = stdout or sys.stdout
+    if not projects:
+        return 0
+    worst = 0
+    with ThreadPoolExecutor(max_workers=len(projects)) as pool:
+        futures = {
+            pool.submit(run, project, root, command, previous, current, options): (
+                project
+            )
+            for project in projects
+        }
+        for future in as_completed(futures):
+            project = futures[future]
+            try:
+                status, output = future.result()
+            except Exception:
+                # Eg, git or the interpreter couldn't be run.
+                status, output = 1, traceback.format_exc()
+            if output:
+                stdout.write(f"Project '{project['name']}':\n")
+                stdout.write(output)
+            if status and command == "migrate":
+                stdout.write(
+                    f"Project '{project['name']}' failed. To finish migrating, run "
+                    f"'{PROJECT_ENV}={project['name']} ./manage.py migrant resume' "
+                    f"in {project['path']}.\n"
+                )
+            stdout.flush()
+            worst = max(worst, status)
+    return worst
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(prog="python -m django_migrant.projects")
+    parser.add_argument("command", choices=["migrate", "worktree"])
+    parser.add_argument("previous")
+    parser.add_argument("current")
+    # Anything else is passed on to each project's migrant command.
+    args, options = parser.parse_known_args(argv)
+
+    root = git.toplevel()
+    return run_all(load(root), root, args.command, args.previous, args.current, options)
+
+
+if __name__ == "__main__":
+    sys.exit(main())
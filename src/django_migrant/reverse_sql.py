@@ -0,0 +1,190 @@
+import json
+import subprocess
+import sys
+from graphlib import TopologicalSorter
+from pathlib import Path
+
+from django.core.management.base import OutputWrapper
+from django.db.migrations.operations import RunPython, SeparateDatabaseAndState
+from django.db.migrations.recorder import MigrationRecorder
+
+from django_migrant import git
+from django_migrant.loader import blob_hash, migrations_path
+
+
+def file_sha(migration):
+    """Returns the blob sha of the file a migration was imported from."""
+    # A LazyMigration has been loaded by the time it's applied. Until then it
+    # has no module of its own to go by.
+    migration = getattr(migration, "_migration", migration)
+    if migration is None:
+        return None
+    module = sys.modules.get(type(migration).__module__)
+    filename = getattr(module, "__file__", None)
+    if filename is None:
+        return None
+    return blob_hash(Path(filename).read_bytes())
+
+
+def unreplayable(operation):
+    """Returns why undoing an operation can't be done with SQL alone, if so."""
+    name = operation.__class__.__name__
+    if isinstance(operation, SeparateDatabaseAndState):
+        for database_operation in operation.database_operations:
+            reason = unreplayable(database_operation)
+            if reason:
+                return reason
+        return None
+    if not operation.reversible:
+        return f"{name} is irreversible"
+    if isinstance(operation, RunPython):
+        if operation.reverse_code is RunPython.noop:
+            return None
+        return name
+    if not operation.reduces_to_sql:
+        return f"{name} can't be written as SQL"
+    # Custom operations may run queries of their own when unapplied, which
+    # wouldn't be captured.
+    if not operation.__class__.__module__.startswith("django."):
+        return f"{name} is a custom operation"
+    return None
+
+
+class ReverseSQLStore:
+    """The SQL that undoes each migration, recorded when it was applied.
+
+    Entries are keyed by database vendor, app, migration name and the blob sha of
+    the migration file, so a migration can be unapplied without its code as long
+    as the file it was applied from is in git. Migrations whose reversal can't be
+    captured as SQL (eg, RunPython) are recorded as such, so that rolling back
+    knows to fall back to running the migration's code.
+    """
+
+    def __init__(self, path: Path):
+        self.path = path
+
+    def location(self, connection, app_label, name, sha) -> Path:
+        return self.path / connection.vendor / app_label / name / f"{sha}.json"
+
+    def get(self, connection, app_label, name, sha):
+        try:
+            with open(self.location(connection, app_label, name, sha)) as fh:
+                return json.load(fh)
+        except (FileNotFoundError, ValueError):
+            return None
+
+    def needs(self, connection, migration) -> bool:
+        """Returns True if nothing is recorded for the migration yet."""
+        sha = file_sha(migration)
+        if sha is None:
+            return False
+        location = self.location(connection, migration.app_label, migration.name, sha)
+        return not location.exists()
+
+    def record(self, connection, state, migration):
+        """Records the SQL that unapplies a migration.
+
+        `state` is the project state before the migration was applied. It's
+        called after applying, so the database is introspected as it will be
+        when the SQL is replayed.
+        """
+        sha = file_sha(migration)
+        if sha is None:
+            return
+        entry = {
+            "app_label": migration.app_label,
+            "name": migration.name,
+            "sha": sha,
+            "atomic": migration.atomic,
+            "dependencies": [list(d) for d in migration.dependencies],
+            "run_before": [list(r) for r in migration.run_before],
+            "replaces": [list(r) for r in migration.replaces],
+            "reason": None,
+            "sql": [],
+        }
+        for operation in migration.operations:
+            entry["reason"] = unreplayable(operation)
+            if entry["reason"]:
+                break
+        else:
+            with connection.schema_editor(
+                collect_sql=True, atomic=migration.atomic
+            ) as schema_editor:
+                migration.unapply(state, schema_editor, collect_sql=True)
+            entry["sql"] = [
+                sql for sql in schema_editor.collected_sql if not sql.startswith("--")
+            ]
+
+        location = self.location(connection, migration.app_label, migration.name, sha)
+        location.parent.mkdir(parents=True, exist_ok=True)
+        with open(location, "w") as fh:
+            json.dump(entry, fh, indent=2)
+
+    def find(self, connection, previous, keys, stdout=None):
+        """Returns the recorded entries for unapplying the given migrations.
+
+        The migration files are looked up as they were at the previous commit,
+        and the entries are returned in the order they should be replayed. If
+        any of them can't be replayed, None is returned.
+        """
+        stdout = OutputWrapper(stdout or sys.stdout)
+        root = git.toplevel()
+        files = {}
+        for app_label in {app_label for app_label, _ in keys}:
+            path = migrations_path(app_label)
+            if path is None or not path.resolve().is_relative_to(root):
+                stdout.write(f"No migrations found in git for {app_label}.")
+                return None
+            try:
+                files[app_label] = git.ls_tree(
+                    previous, path.resolve().relative_to(root)
+                )
+            except subprocess.CalledProcessError:
+                return None
+
+        entries = {}
+        for app_label, name in sorted(keys):
+            sha = files[app_label].get(f"{name}.py")
+            entry = sha and self.get(connection, app_label, name, sha)
+            if not entry:
+                stdout.write(f"No SQL recorded to unapply {app_label}.{name}.")
+                return None
+            if entry["reason"]:
+                stdout.write(
+                    f"Can't unapply {app_label}.{name} with SQL ({entry['reason']})."
+                )
+                return None
+            entries[app_label, name] = entry
+
+        # Unapply dependents before their dependencies.
+        sorter = TopologicalSorter()
+        for key, entry in entries.items():
+            sorter.add(key)
+            for dependency in entry["dependencies"]:
+                if tuple(dependency) in entries:
+                    sorter.add(key, tuple(dependency))
+            for before in entry["run_before"]:
+                if tuple(before) in entries:
+                    sorter.add(tuple(before), key)
+        order = list(sorter.static_order())
+        return [entries[key] for key in reversed(order)]
+
+    def replay(self, connection, entries, stdout=None):
+        """Runs the recorded SQL for each entry, in a transaction where possible."""
+        stdout = OutputWrapper(stdout or sys.stdout)
+        recorder = MigrationRecorder(connection)
+        atomic = all(entry["atomic"] for entry in entries)
+        with connection.schema_editor(atomic=atomic) as schema_editor:
+            for entry in entries:
+                app_label, name = entry["app_label"], entry["name"]
+                stdout.write(f"  Unapplying {app_label}.{name}...", ending="")
+                stdout.flush()
+                for sql in entry["sql"]:
+                    # No params, so that any '%' in the SQL is left alone.
+                    schema_editor.execute(sql, params=None)
+                # As MigrationExecutor does, squashed migrations are recorded
+                # unapplied along with the migrations they replace.
+                for replaced in entry["replaces"]:
+                    recorder.record_unapplied(*replaced)
+                recorder.record_unapplied(app_label, name)
+                stdout.write(" OK")
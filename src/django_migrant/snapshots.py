@@ -0,0 +1,197 @@
+import hashlib
+import json
+import shutil
+import subprocess
+import threading
+import time
+from pathlib import Path
+
+from django.core.management.base import CommandError
+from django.db import connections
+
+INDEX_FILENAME = "index.json"
+
+
+def fingerprint(connection, loader, keys) -> str:
+    """Returns a digest identifying a database and a set of applied migrations.
+
+    Squashed migrations are expanded into the migrations they replace, as that is
+    what Django records when a squashed migration is applied.
+    """
+    applied = set()
+    for key in keys:
+        if key in loader.replacements:
+            applied.update(loader.replacements[key].replaces)
+        else:
+            applied.add(key)
+    digest = hashlib.sha256(str(connection.settings_dict["NAME"]).encode())
+    for app_label, name in sorted(applied):
+        digest.update(f"\n{app_label}.{name}".encode())
+    return digest.hexdigest()
+
+
+def copy(source: Path, dest: Path):
+    """Copies a file, cloning it where the filesystem supports reflinks."""
+    try:
+        subprocess.run(
+            ["cp", "--reflink=auto", str(source), str(dest)],
+            check=True,
+            capture_output=True,
+        )
+    except (OSError, subprocess.CalledProcessError):
+        shutil.copyfile(source, dest)
+
+
+class SqliteBackend:
+    """Snapshots a sqlite database by copying its file."""
+
+    def __init__(self, path: Path):
+        self.path = path
+
+    def location(self, connection, key):
+        return str(self.path / f"{key}.sqlite3")
+
+    def create(self, connection, location):
+        with connection.cursor() as cursor:
+            # In WAL mode recent changes may only be in the log, so write them
+            # back into the file first.
+            cursor.execute("PRAGMA wal_checkpoint(TRUNCATE)")
+        connection.close()
+        copy(Path(connection.settings_dict["NAME"]), Path(location))
+        return Path(location).stat().st_size
+
+    def restore(self, connection, location):
+        connection.close()
+        database = Path(connection.settings_dict["NAME"])
+        # A log left by the database as it was would be replayed onto the
+        # snapshot.
+        for suffix in ("-wal", "-shm"):
+            Path(f"{database}{suffix}").unlink(missing_ok=True)
+        copy(Path(location), database)
+
+    def delete(self, connection, location):
+        Path(location).unlink(missing_ok=True)
+
+
+class PostgresBackend:
+    """Snapshots a PostgreSQL database by using it as a template."""
+
+    def location(self, connection, key):
+        return f"{connection.settings_dict['NAME']}_migrant_{key[:12]}"
+
+    def create(self, connection, location):
+        name = connection.settings_dict["NAME"]
+        self.delete(connection, location)
+        self.clone(connection, name, location)
+        with connection._nodb_cursor() as cursor:
+            cursor.execute("SELECT pg_database_size(%s)", [location])
+            return cursor.fetchone()[0]
+
+    def restore(self, connection, location):
+        name = connection.settings_dict["NAME"]
+        # Cloned aside first, so that the database is only dropped once there's
+        # something to replace it with.
+        temporary = f"{name}_migrant_restoring"
+        self.delete(connection, temporary)
+        try:
+            self.clone(connection, location, temporary)
+            self.delete(connection, name)
+        except Exception:
+            self.delete(connection, temporary)
+            raise
+        self.rename(connection, temporary, name)
+
+    def delete(self, connection, location):
+        connection.close()
+        qn = connection.ops.quote_name
+        with connection._nodb_cursor() as cursor:
+            cursor.execute(f"DROP DATABASE IF EXISTS {qn(location)}")
+
+    def clone(self, connection, source, dest):
+        # Templates can't have open connections, so close ours first.
+        connection.close()
+        qn = connection.ops.quote_name
+        with connection._nodb_cursor() as cursor:
+            cursor.execute(f"CREATE DATABASE {qn(dest)} TEMPLATE {qn(source)}")
+
+    def rename(self, connection, source, dest):
+        connection.close()
+        qn = connection.ops.quote_name
+        with connection._nodb_cursor() as cursor:
+            cursor.execute(f"ALTER DATABASE {qn(source)} RENAME TO {qn(dest)}")
+
+
+class SnapshotCache:
+    """A least recently used cache of database snapshots.
+
+    Snapshots are keyed by the fingerprint of the migrations applied when they
+    were taken. Once the total size of the snapshots exceeds the budget (in
+    bytes) the least recently used ones are deleted.
+    """
+
+    def __init__(self, path: Path, budget: int):
+        self.path = path
+        self.path.mkdir(parents=True, exist_ok=True)
+        self.budget = budget
+        # Several databases may be snapshotted at once, from different threads.
+        self.lock = threading.Lock()
+
+    def backend(self, connection):
+        if connection.vendor == "sqlite" and not connection.is_in_memory_db():
+            return SqliteBackend(self.path)
+        if connection.vendor == "postgresql":
+            return PostgresBackend()
+        raise CommandError(
+            f"Database snapshots are not supported for '{connection.vendor}'."
+        )
+
+    def load_index(self):
+        try:
+            with open(self.path / INDEX_FILENAME) as fh:
+                return json.load(fh)
+        except FileNotFoundError:
+            return {}
+
+    def save_index(self, index):
+        with open(self.path / INDEX_FILENAME, "w") as fh:
+            json.dump(index, fh, indent=2)
+
+    def save(self, connection, key):
+        """Snapshots the database, replacing any earlier snapshot with that key."""
+        backend = self.backend(connection)
+        location = backend.location(connection, key)
+        size = backend.create(connection, location)
+        with self.lock:
+            index = self.load_index()
+            index[key] = {
+                "alias": connection.alias,
+                "location": location,
+                "size": size,
+                "last_used": time.time(),
+            }
+            self.evict(index)
+            self.save_index(index)
+
+    def restore(self, connection, key) -> bool:
+        """Restores the database from a snapshot, returning False on a miss."""
+        with self.lock:
+            index = self.load_index()
+            if key not in index:
+                return False
+            backend = self.backend(connection)
+            backend.restore(connection, index[key]["location"])
+            index[key]["last_used"] = time.time()
+            self.save_index(index)
+        return True
+
+    def evict(self, index):
+        by_age = sorted(index, key=lambda k: index[k]["last_used"])
+        total = sum(entry["size"] for entry in index.values())
+        # Always keep the newest snapshot, even if it alone is over budget.
+        for key in by_age[:-1]:
+            if total <= self.budget:
+                break
+            entry = index.pop(key)
+            connection = connections[entry["alias"]]
+            self.backend(connection).delete(connection, entry["location"])
+            total -= entry["size"]
@@ -0,0 +1,82 @@
+"""Runs each stretch of a plan within one app as a single, optimized migration.
+
+Switching between branches that have drifted apart can mean running a long
+chain of migrations in one app, eg adding a field only to remove it, or
+altering the same column again and again. Migrations that are next to each
+other in a plan, and in the same app, are squashed on the fly: their operations
+are put through Django's MigrationOptimizer, as `squashmigrations` does, and
+the result run as one migration. Each of them is still recorded as applied, or
+unapplied, on its own.
+"""
+
+from django.db.migrations import Migration
+from django.db.migrations.operations import RunPython, RunSQL
+from django.db.migrations.optimizer import MigrationOptimizer
+
+from django_migrant.deferral import database_operations
+
+
+class Segment(Migration):
+    """Migrations of one app, next to each other in a plan, run as one."""
+
+    def __init__(self, migrations, operations):
+        first, last = migrations[0], migrations[-1]
+        super().__init__(f"{first.name}..{last.name}", first.app_label)
+        self.migrations = migrations
+        self.operations = operations
+        # Recorded, and unrecorded, as the squashed migrations Django knows of.
+        self.replaces = [(m.app_label, m.name) for m in migrations]
+        self.squashed = sum(len(m.operations) for m in migrations)
+
+    def __str__(self):
+        return (
+            f"{super().__str__()} ({self.squashed} operations as "
+            f"{len(self.operations)})"
+        )
+
+
+def squashable(migration):
+    """Returns True if a migration can be squashed with those next to it.
+
+    Code could depend on the database as it is part way through a chain, so
+    migrations that run any are left alone. As are those that aren't atomic, and
+    squashed migrations, which are recorded differently.
+    """
+    if migration.replaces or not migration.atomic:
+        return False
+    return not any(
+        isinstance(operation, (RunPython, RunSQL))
+        for operation in database_operations(migration)
+    )
+
+
+def segments(migrations, squashable=squashable):
+    """Squashes the stretches of migrations within one app.
+
+    `migrations` are in the order they'd be applied, even for a backwards plan.
+    Returns the Segment each squashed migration is part of, only squashing
+    stretches the optimizer can make shorter.
+    """
+    stretches, stretch = [], []
+    for migration in migrations:
+        if not squashable(migration):
+            stretches.append(stretch)
+            stretch = []
+            continue
+        if stretch and stretch[-1].app_label != migration.app_label:
+            stretches.append(stretch)
+            stretch = []
+        stretch.append(migration)
+    stretches.append(stretch)
+
+    squashed = {}
+    optimizer = MigrationOptimizer()
+    for stretch in stretches:
+        if len(stretch) < 2:
+            continue
+        operations = [op for migration in stretch for op in migration.operations]
+        optimized = optimizer.optimize(operations, stretch[0].app_label)
+        if len(optimized) < len(operations):
+            segment = Segment(stretch, optimized)
+            squashed.update((migration, segment) for migration in stretch)
+    return squashed
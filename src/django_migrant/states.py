@@ -0,0 +1,110 @@
+"""Project states, pickled and kept between runs.
+
+Before running a plan the executor works out the project state at the point
+the plan starts from, by going through every migration applied before it. That
+imports each of them (or reads them from git), and with hundreds of migrations
+takes a while. The states are kept, keyed by the blob sha of each migration
+file gone through, so that a state is only worked out once while the
+migrations it's made from are unchanged.
+"""
+
+import hashlib
+import os
+import pickle
+import threading
+from pathlib import Path
+
+import django
+from django.db.migrations.state import ProjectState
+
+from django_migrant.loader import swappable_settings_digest
+from django_migrant.reverse_sql import file_sha
+
+STATE_CACHE_VERSION = 1
+
+
+class StateCache:
+    """A least recently used cache of project states.
+
+    Once the total size of the states exceeds the budget (in bytes) the least
+    recently used ones are deleted.
+    """
+
+    def __init__(self, path: Path, budget: int = 64 * 1024 * 1024):
+        self.path = path
+        self.budget = budget
+        # States may be kept for several databases at once, from different threads.
+        self.lock = threading.Lock()
+
+    def key(self, loader, real_apps, migrations):
+        """Returns the key of the state made from the given migrations, in order.
+
+        None if any of them can't be told apart from a different migration with
+        the same name, as where it was read from isn't known.
+        """
+        digest = hashlib.sha256(
+            f"{STATE_CACHE_VERSION}\n{django.get_version()}\n".encode()
+        )
+        digest.update(repr(sorted(real_apps)).encode())
+        # Swappable dependencies and fields, eg to AUTH_USER_MODEL, resolve to
+        # whatever the settings say.
+        digest.update(swappable_settings_digest().encode())
+        shas = getattr(loader, "shas", {})
+        for migration in migrations:
+            key = (migration.app_label, migration.name)
+            # Migrations imported as usual have a file to tell them apart by.
+            sha = shas.get(key) or file_sha(migration)
+            if sha is None:
+                return None
+            digest.update(f"\n{key[0]}.{key[1]}:{sha}".encode())
+        return digest.hexdigest()
+
+    def location(self, key) -> Path:
+        return self.path / f"{key}.pickle"
+
+    def get(self, key):
+        """Returns the state kept with the key, or None."""
+        location = self.location(key)
+        try:
+            with open(location, "rb") as fh:
+                real_apps, models = pickle.load(fh)
+        except (FileNotFoundError, pickle.UnpicklingError, EOFError):
+            return None
+        except (AttributeError, ImportError):
+            # Something it refers to has gone, eg a default function.
+            location.unlink(missing_ok=True)
+            return None
+        os.utime(location)
+        return ProjectState(models=models, real_apps=real_apps)
+
+    def put(self, key, state):
+        """Keeps an unrendered state, if it can be pickled.
+
+        States that refer to things pickle can't find again, eg a lambda as a
+        default, aren't kept.
+        """
+        try:
+            data = pickle.dumps((state.real_apps, state.models))
+        except (pickle.PicklingError, AttributeError, TypeError):
+            return
+        self.path.mkdir(parents=True, exist_ok=True)
+        location = self.location(key)
+        # Written aside and moved into place, as another thread may be reading.
+        temporary = location.with_suffix(f".{threading.get_ident()}.tmp")
+        temporary.write_bytes(data)
+        os.replace(temporary, location)
+        with self.lock:
+            self.evict()
+
+    def evict(self):
+        states = sorted(
+            (path.stat().st_mtime, path.stat().st_size, path)
+            for path in self.path.glob("*.pickle")
+        )
+        total = sum(size for _, size, _ in states)
+        # Always keep the newest state, even if it alone is over budget.
+        for _, size, path in states[:-1]:
+            if total <= self.budget:
+                break
+            path.unlink(missing_ok=True)
+            total -= size
@@ -0,0 +1,163 @@
+"""Timings of each checkout, appended to a trace file in the git directory.
+
+Each line of the trace is a JSON span: what was timed, when it started, how long
+it took and whatever else was known at the time, such as the commits, the
+database alias and the number of rows a migration changed. The stages of one
+checkout run in separate processes, so they're tied together by a transition id
+handed down through the environment.
+"""
+
+import json
+import os
+import threading
+import time
+import uuid
+from collections import defaultdict
+from contextlib import contextmanager, nullcontext
+
+from django_migrant import git
+
+TRACE_FILENAME = "trace.jsonl"
+TRANSITION_ENV = "DJANGO_MIGRANT_TRANSITION"
+
+
+class Tracer:
+    """Writes spans to a trace file, or nowhere when it hasn't got one."""
+
+    def __init__(self, path=None, transition=None):
+        self.path = path
+        self.transition = (
+            transition or os.environ.get(TRANSITION_ENV) or uuid.uuid4().hex
+        )
+        # Per thread, as several migrations may run at once.
+        self.rows = defaultdict(int)
+        self.started = {}
+
+    @property
+    def enabled(self):
+        return self.path is not None
+
+    def emit(self, name, start, duration, **attrs):
+        if self.path is None:
+            return
+        span = {
+            "transition": self.transition,
+            "name": name,
+            "start": round(start, 6),
+            "duration": round(duration, 6),
+            **attrs,
+        }
+        # Lines this short are appended whole, even with several writers.
+        with open(self.path, "a") as fh:
+            fh.write(json.dumps(span) + "\n")
+
+    @contextmanager
+    def span(self, name, **attrs):
+        """Times a block, which may add attributes to the span it's given."""
+        start, began = time.time(), time.perf_counter()
+        try:
+            yield attrs
+        except Exception:
+            attrs["error"] = True
+            raise
+        finally:
+            self.emit(name, start, time.perf_counter() - began, **attrs)
+
+    def counting(self, connection):
+        """Counts the rows changed by statements run on the connection."""
+        if not self.enabled:
+            return nullcontext()
+        return connection.execute_wrapper(self.count_rows)
+
+    def count_rows(self, execute, sql, params, many, context):
+        result = execute(sql, params, many, context)
+        rowcount = getattr(context["cursor"], "rowcount", -1)
+        if rowcount and rowcount > 0:
+            self.rows[threading.get_ident()] += rowcount
+        return result
+
+    def migration_progress(self, alias, action, migration=None, fake=False):
+        """Records a span for each migration, given executor progress events."""
+        thread = threading.get_ident()
+        if action in ("apply_start", "unapply_start"):
+            self.started[thread] = time.time(), time.perf_counter(), self.rows[thread]
+        elif action in ("apply_success", "unapply_success") and thread in self.started:
+            start, began, rows = self.started.pop(thread)
+            self.emit(
+                action.split("_")[0],
+                start,
+                time.perf_counter() - began,
+                migration=str(migration),
+                alias=alias,
+                fake=fake,
+                rows=self.rows[thread] - rows,
+            )
+
+    def commit(self, rev):
+        """Returns the sha of a revision, if tracing and it can be found."""
+        if not self.enabled:
+            return None
+        return git.resolve(rev)
+
+    def environ(self, **extra):
+        """Returns a copy of the environment that hands the transition on."""
+        env = os.environ.copy()
+        env[TRANSITION_ENV] = self.transition
+        env.update(extra)
+        return env
+
+
+def read(path, limit=None):
+    """Returns the spans of the last `limit` transitions in the trace."""
+    spans = []
+    try:
+        with open(path) as fh:
+            for line in fh:
+                try:
+                    spans.append(json.loads(line))
+                except ValueError:
+                    # Most likely a line cut short by a crash.
+                    continue
+    except FileNotFoundError:
+        return []
+    if limit is not None:
+        transitions = list(dict.fromkeys(s["transition"] for s in spans))
+        recent = set(transitions[-limit:])
+        spans = [s for s in spans if s["transition"] in recent]
+    return spans
+
+
+def summarise(spans):
+    """Aggregates durations by stage, and by migration and direction.
+
+    Returns two lists of dicts, each sorted slowest first by the longest time
+    taken.
+    """
+    groups = defaultdict(list)
+    for span in spans:
+        if "migration" in span:
+            key = ("migration", span["migration"], span["name"])
+        else:
+            key = ("stage", span["name"], None)
+        groups[key].append(span)
+
+    stages, migrations = [], []
+    for (kind, name, action), group in groups.items():
+        durations = [s["duration"] for s in group]
+        summary = {
+            "name": name,
+            "count": len(group),
+            "total": sum(durations),
+            "mean": sum(durations) / len(durations),
+            "max": max(durations),
+        }
+        if kind == "stage":
+            stages.append(summary)
+        else:
+            summary["action"] = action
+            summary["rows"] = max(s.get("rows", 0) for s in group)
+            migrations.append(summary)
+
+    stages.sort(key=lambda s: s["max"], reverse=True)
+    migrations.sort(key=lambda s: s["max"], reverse=True)
+    return stages, migrations
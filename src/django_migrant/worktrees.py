@@ -0,0 +1,189 @@
+"""Databases of their own for each `git worktree`.
+
+When a worktree is created the post-checkout hook clones the databases of the
+main worktree for it, and records the new names in the worktree's git
+directory. Settings pick them up with `databases()`, so the main worktree keeps
+its databases and every other worktree gets its own:
+
+    from django_migrant import worktrees
+
+    DATABASES = worktrees.databases({...}, BASE_DIR)
+
+Git has no hook that runs when a worktree is removed, so the databases of
+worktrees that have gone are dropped by 'migrant prune', and whenever another
+worktree is created.
+"""
+
+import json
+import os
+import re
+from pathlib import Path
+
+from django.core.management.base import CommandError
+from django.db import DatabaseError, connections
+
+from django_migrant import git
+from django_migrant.git import PROJECT_ENV
+from django_migrant.snapshots import PostgresBackend, copy
+
+OVERRIDES_FILENAME = "databases.json"
+REGISTRY_FILENAME = "worktrees.json"
+
+
+def git_dir(path: Path):
+    """Returns the git directory of the linked worktree containing path, if any.
+
+    Worktrees other than the main one have a `.git` file rather than a directory,
+    pointing at their git directory. Read without git, as it's used in settings.
+    """
+    for parent in [path, *path.parents]:
+        dot_git = parent / ".git"
+        if dot_git.is_dir():
+            return None
+        if dot_git.is_file():
+            content = dot_git.read_text().strip()
+            if not content.startswith("gitdir:"):
+                return None
+            return (parent / content.removeprefix("gitdir:").strip()).resolve()
+    return None
+
+
+def databases(databases, path=None, project=None):
+    """Returns DATABASES with the worktree's own databases swapped in.
+
+    In a repository with several projects, `project` is the name this one was
+    installed with (see `migrant install --project`).
+    """
+    worktree_git_dir = git_dir(Path(path or Path.cwd()).resolve())
+    if worktree_git_dir is None:
+        return databases
+    migrant_dir = worktree_git_dir / "migrant"
+    project = project or os.environ.get(PROJECT_ENV)
+    if project:
+        migrant_dir = migrant_dir / "projects" / project
+    try:
+        with open(migrant_dir / OVERRIDES_FILENAME) as fh:
+            overrides = json.load(fh)
+    except (FileNotFoundError, ValueError):
+        return databases
+    return {
+        alias: {**settings, **overrides.get(alias, {})}
+        for alias, settings in databases.items()
+    }
+
+
+def clone(connection, worktree, main, name):
+    """Clones a database for a worktree, returning the settings that use it.
+
+    sqlite databases are copied into the worktree's git directory, so they go
+    when it does. A path inside the worktree is copied from the same path in
+    the main worktree, as the worktree's own copy is new. Returns None if the
+    database can't be cloned.
+    """
+    source = connection.settings_dict["NAME"]
+    if connection.vendor == "sqlite" and not connection.is_in_memory_db():
+        source = Path(source).resolve()
+        root = worktree["path"].resolve()
+        if source.is_relative_to(root):
+            source = main["path"].resolve() / source.relative_to(root)
+        dest = git.migrant_dir() / f"{connection.alias}.sqlite3"
+        connection.close()
+        copy(source, dest)
+        return {"NAME": str(dest)}
+    if connection.vendor == "postgresql":
+        # Identifiers are limited to 63 characters.
+        dest = re.sub(r"[^a-z0-9_]", "_", f"{source}_{name}".lower())[:63]
+        backend = PostgresBackend()
+        try:
+            backend.delete(connection, dest)
+            backend.clone(connection, source, dest)
+        except DatabaseError as e:
+            raise CommandError(
+                f"Cloning '{source}' failed, is it in use (eg, by runserver)? {e}"
+            )
+        return {"NAME": dest}
+    return None
+
+
+def load_registry():
+    try:
+        with open(git.common_migrant_dir() / REGISTRY_FILENAME) as fh:
+            return json.load(fh)
+    except (FileNotFoundError, ValueError):
+        return {}
+
+
+def save_registry(registry):
+    with open(git.common_migrant_dir() / REGISTRY_FILENAME, "w") as fh:
+        json.dump(registry, fh, indent=2)
+
+
+def provision(aliases, stdout):
+    """Clones the main worktree's databases for the current worktree.
+
+    The worktree's settings are switched over to the clones. Returns the commit
+    the main worktree, and so the clones, are migrated to, or None if the
+    worktree already has its own databases.
+    """
+    worktree_git_dir = git.git_dir()
+    if worktree_git_dir == git.common_dir():
+        raise CommandError("Not in a worktree created with 'git worktree add'.")
+    overrides_path = git.migrant_dir() / OVERRIDES_FILENAME
+    if overrides_path.exists():
+        stdout.write("This worktree already has databases of its own.\n")
+        return None
+
+    prune(stdout)
+
+    main, *others = git.worktrees()
+    root = git.toplevel().resolve()
+    worktree = next(w for w in others if w["path"].resolve() == root)
+    name = worktree_git_dir.name
+
+    overrides = {}
+    for alias in aliases:
+        connection = connections[alias]
+        override = clone(connection, worktree, main, name)
+        if override is None:
+            stdout.write(
+                f"Can't clone '{connection.vendor}' databases, so '{alias}' is "
+                "shared with the main worktree.\n"
+            )
+            continue
+        stdout.write(f"Cloned database '{alias}' to {override['NAME']}.\n")
+        connection.close()
+        connection.settings_dict.update(override)
+        overrides[alias] = override
+
+    with open(overrides_path, "w") as fh:
+        json.dump(overrides, fh, indent=2)
+    registry = load_registry()
+    registry[str(worktree_git_dir)] = {
+        "path": str(worktree["path"]),
+        "databases": {
+            alias: {"vendor": connections[alias].vendor, **override}
+            for alias, override in overrides.items()
+        },
+    }
+    save_registry(registry)
+    return main["head"]
+
+
+def prune(stdout):
+    """Drops the databases cloned for worktrees that have since been removed."""
+    registry = load_registry()
+    existing = {str(w["path"]) for w in git.worktrees()}
+    pruned = False
+    for worktree_git_dir, entry in list(registry.items()):
+        if Path(worktree_git_dir).is_dir() and entry["path"] in existing:
+            continue
+        for alias, database in entry["databases"].items():
+            stdout.write(f"Dropping database {database['NAME']} of {entry['path']}.\n")
+            if database["vendor"] == "sqlite":
+                Path(database["NAME"]).unlink(missing_ok=True)
+            elif database["vendor"] == "postgresql" and alias in connections:
+                PostgresBackend().delete(connections[alias], database["NAME"])
+        del registry[worktree_git_dir]
+        pruned = True
+    if pruned:
+        save_registry(registry)
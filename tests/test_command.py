@@ -1,4 +1,7 @@
+import contextlib
 import os
+import subprocess
+import sys
 from importlib import resources
 from io import StringIO
 from pathlib import Path
@@ -8,7 +11,8 @@ from unittest import mock
 from django.core.management import call_command
 from django.core.management.base import CommandError
 
-from tests.testcases import DjangoSetupTestCase
+from django_migrant import projects
+from tests.testcases import DjangoSetupTestCase, GitRepoTestCase
 
 
 def get_mock_path(is_dir=False, is_file=False, is_true=False):
@@ -59,28 +63,101 @@ class CommandTests(DjangoSetupTestCase):
         with TemporaryDirectory() as temp_dir_name:
             hooks_path = Path(temp_dir_name) / ".git" / "hooks"
             hooks_path.mkdir(parents=True)
-            out, err = self.call_command("install", temp_dir_name)
+            out, err = self.call_command(
+                "install", temp_dir_name, "--interpreter", "/path/to/python"
+            )
 
             with open(hooks_path / "post-checkout") as fh:
                 contents = fh.read()
                 self.assertTrue(contents.startswith(header[:9]))
                 # A phrase we definitely expect to see in the hook.
                 self.assertTrue("./manage.py migrant migrate" in contents)
+                self.assertTrue('"/path/to/python" -m django_migrant' in contents)
 
             with open(hooks_path / "pre-rebase") as fh:
                 contents = fh.read()
                 self.assertTrue(contents.startswith(header[:9]))
-                self.assertTrue('echo "REBASE" > .migrant' in contents)
+                self.assertTrue("migrant/rebasing" in contents)
+                self.assertTrue("migrant/rebase-start" in contents)
+
+            with open(hooks_path / "post-rewrite") as fh:
+                contents = fh.read()
+                self.assertTrue(contents.startswith(header[:9]))
+                self.assertTrue("migrant/rebase-start" in contents)
+                self.assertTrue("./manage.py migrant migrate --no-checkout" in contents)
 
         output = out.split("\n")
         # Remove the runt line.
         output = [x for x in output if x]
-        self.assertEqual(len(output), 2)
+        self.assertEqual(len(output), 3)
         # The order of output doesn't really matter.
         self.assertTrue(output[0].startswith("post-checkout hook created: "))
         self.assertTrue(output[1].startswith("pre-rebase hook created: "))
+        self.assertTrue(output[2].startswith("post-rewrite hook created: "))
         self.assertEqual(err, "")
 
+    def test_install_projects(self):
+        with TemporaryDirectory() as temp_dir_name:
+            root = Path(temp_dir_name)
+            subprocess.run(["git", "init", "--quiet", temp_dir_name], check=True)
+            for path in ["services/alpha", "services/beta"]:
+                (root / path).mkdir(parents=True)
+                (root / path / "manage.py").touch()
+
+            out, err = self.call_command(
+                "install",
+                temp_dir_name,
+                "--project",
+                "services/alpha=alpha.settings",
+                "--project",
+                "services/beta",
+            )
+
+            self.assertEqual(
+                projects.load(root),
+                [
+                    {
+                        "name": "services-alpha",
+                        "path": "services/alpha",
+                        "settings": "alpha.settings",
+                    },
+                    {
+                        "name": "services-beta",
+                        "path": "services/beta",
+                        "settings": None,
+                    },
+                ],
+            )
+            with open(root / ".git" / "hooks" / "post-checkout") as fh:
+                contents = fh.read()
+                self.assertIn("-m django_migrant.projects migrate", contents)
+                self.assertNotIn("./manage.py", contents)
+            with open(root / ".git" / "hooks" / "post-rewrite") as fh:
+                self.assertIn("-m django_migrant.projects migrate", fh.read())
+
+            with self.assertRaises(CommandError) as context:
+                self.call_command(
+                    "install", temp_dir_name, "--project", "services/gamma"
+                )
+            self.assertIn("'services/gamma' has no manage.py", str(context.exception))
+
+            (root / "services-alpha").mkdir()
+            (root / "services-alpha" / "manage.py").touch()
+            with self.assertRaises(CommandError) as context:
+                self.call_command(
+                    "install",
+                    temp_dir_name,
+                    "--project",
+                    "services/alpha",
+                    "--project",
+                    "services-alpha",
+                )
+            self.assertIn(
+                "'services/alpha' and 'services-alpha' would both be called "
+                "'services-alpha'",
+                str(context.exception),
+            )
+
     @mock.patch(
         "django_migrant.management.commands.migrant.Path", get_mock_path(is_dir=False)
     )
@@ -147,6 +224,61 @@ class CommandTests(DjangoSetupTestCase):
 
         mock_stage_one.assert_called_once()
 
+    @mock.patch("django_migrant.management.commands.migrant.test_databases")
+    @mock.patch("django_migrant.management.commands.migrant.stage_one")
+    def test_migrate_test_databases(self, mock_stage_one, mock_test_databases):
+        mock_test_databases.return_value.__enter__.return_value = ["default"]
+
+        self.call_command("migrate", "abc123", "--test-databases")
+
+        # Once for the databases, once more for their test databases.
+        self.assertEqual(mock_stage_one.call_count, 2)
+        kwargs = mock_stage_one.call_args.kwargs
+        self.assertEqual(mock_stage_one.call_args.args, ("abc123",))
+        self.assertFalse(kwargs["checkout"])
+        self.assertEqual(kwargs["aliases"], ["default"])
+
+    @mock.patch("django_migrant.management.commands.migrant.MigrationWatcher")
+    @mock.patch("django_migrant.management.commands.migrant.stage_one")
+    @mock.patch("django_migrant.management.commands.migrant.daemon")
+    def test_serve_reloading(self, mock_daemon, mock_stage_one, mock_watcher):
+        out, err = self.call_command("serve")
+        handle = mock_daemon.serve.call_args.args[0]
+
+        # The daemon redirects stdout to the client while it handles a request.
+        mock_watcher.return_value.check.return_value = True
+        client = StringIO()
+        with contextlib.redirect_stdout(client):
+            self.assertEqual(handle("abc", "def"), 0)
+
+        self.assertEqual(client.getvalue(), "Migration files changed, reloading.\n")
+        self.assertNotIn("reloading", out)
+        mock_stage_one.assert_called_once()
+
+    @mock.patch(
+        "django_migrant.management.commands.migrant.connections",
+        {"default": mock.sentinel.connection},
+    )
+    @mock.patch("django_migrant.management.commands.migrant.GitMigrationLoader")
+    @mock.patch("django_migrant.management.commands.migrant.migrated_aliases")
+    @mock.patch("django_migrant.management.commands.migrant.planning")
+    @mock.patch("django_migrant.management.commands.migrant.git")
+    def test_precompute(self, mock_git, mock_planning, mock_aliases, mock_loader):
+        mock_git.resolve.side_effect = lambda ref: {"HEAD": "a" * 40}.get(ref, ref)
+        mock_aliases.return_value = ["default"]
+        plans = mock_planning.PlanCache.return_value
+        plans.get.return_value = None
+        plans.put.return_value = {"unapply": [["polls", "0003_local"]]}
+
+        out, err = self.call_command("precompute", "b" * 40, "HEAD")
+
+        # Only what stage one rolls back is planned.
+        plans.put.assert_called_once_with(
+            mock.sentinel.connection, "b" * 40, mock_loader.return_value
+        )
+        mock_planning.plan_switch.assert_not_called()
+        self.assertEqual(out, "Planned bbbbbbb: 1 to roll back.\n")
+
     @mock.patch.dict(os.environ, {"DJANGO_MIGRANT_STAGE": "TWO"})
     @mock.patch("django_migrant.management.commands.migrant.stage_two")
     def test_migrate_stage_two(self, mock_stage_two):
@@ -163,3 +295,78 @@ class CommandTests(DjangoSetupTestCase):
 
         mock_stage_three.assert_called_once()
         mock_stage_three.assert_called_once()
+
+
+MANAGE_PY = """#!/bin/sh
+echo "$@" >> "$(git rev-parse --git-path manage.log)"
+"""
+
+
+class HookTests(GitRepoTestCase):
+    """Runs the installed hooks, with a manage.py that logs how it's called."""
+
+    def setUp(self):
+        super().setUp()
+        self.write("manage.py", MANAGE_PY)
+        (self.root / "manage.py").chmod(0o755)
+        self.write("polls/migrations/0001_initial.py")
+        self.initial = self.commit()
+        call_command(
+            "migrant",
+            "install",
+            "--interpreter",
+            sys.executable,
+            str(self.root),
+            "--",
+            "--fast",
+            stdout=StringIO(),
+        )
+        for hook in (self.root / ".git" / "hooks").iterdir():
+            hook.chmod(0o755)
+        self.git("checkout", "-b", "feature")
+        self.git("checkout", "-b", "upstream")
+        self.write("polls/migrations/0002_second.py")
+        self.second = self.commit()
+        self.git("checkout", "feature")
+
+    def calls(self):
+        log = self.root / ".git" / "manage.log"
+        calls = log.read_text().splitlines() if log.exists() else []
+        log.unlink(missing_ok=True)
+        return calls
+
+    def test_checkout(self):
+        self.assertEqual(
+            self.calls(), [f"migrant migrate --fast {self.second} {self.initial}"]
+        )
+
+    def test_rebase(self):
+        self.calls()
+        self.git("checkout", "--quiet", "-b", "local")
+        self.write("polls/migrations/0003_local.py")
+        local = self.commit()
+        self.git("rebase", "upstream")
+
+        rebased = subprocess.run(
+            ["git", "rev-parse", "HEAD"], check=True, capture_output=True, text=True
+        ).stdout.strip()
+        self.assertEqual(
+            self.calls(), [f"migrant migrate --no-checkout --fast {local} {rebased}"]
+        )
+        rebase_start = self.root / ".git" / "migrant" / "rebase-start"
+        self.assertFalse(rebase_start.exists())
+
+    def test_fast_forward_rebase(self):
+        # Git runs no post-rewrite hook, so the next checkout migrates from
+        # where the rebase started.
+        self.calls()
+        self.git("rebase", "upstream")
+        self.assertEqual(self.calls(), [])
+
+        self.git("checkout", "-b", "other")
+
+        self.assertEqual(
+            self.calls(), [f"migrant migrate --fast {self.initial} {self.second}"]
+        )
+        self.git("checkout", "feature")
+        self.assertEqual(self.calls(), [])
@@ -0,0 +1,57 @@
+import os
+import threading
+import time
+from io import StringIO
+from unittest import mock
+
+from django_migrant import daemon
+from tests.testcases import GitRepoTestCase
+
+
+class TestDaemon(GitRepoTestCase):
+
+    def start_daemon(self, handle):
+        thread = threading.Thread(target=daemon.serve, args=(handle,), daemon=True)
+        thread.start()
+        for _ in range(100):
+            if daemon.socket_path().exists():
+                break
+            time.sleep(0.01)
+
+    def test_no_daemon(self):
+        self.assertIsNone(daemon.request("abc", "def"))
+        self.assertEqual(daemon.main(["abc", "def"]), daemon.NO_DAEMON)
+
+    @mock.patch("django_migrant.daemon.socket_path")
+    def test_socket_path_too_long(self, mock_socket_path):
+        mock_socket_path.return_value = self.root / ("x" * 200) / "daemon.sock"
+        self.assertIsNone(daemon.request("abc", "def"))
+
+    def test_request(self):
+        def handle(previous, current):
+            print(f"Migrating from {previous} to {current}")
+            return 3
+
+        self.start_daemon(handle)
+        stdout = StringIO()
+        status = daemon.request("abc", "def", stdout=stdout)
+
+        self.assertEqual(status, 3)
+        self.assertEqual(stdout.getvalue(), "Migrating from abc to def\n")
+
+    def test_request_error(self):
+        def handle(previous, current):
+            raise ValueError("Oops")
+
+        self.start_daemon(handle)
+        stdout = StringIO()
+        status = daemon.request("abc", "def", stdout=stdout)
+
+        self.assertEqual(status, 1)
+        self.assertEqual(stdout.getvalue(), "ValueError: Oops\n")
+
+    @mock.patch.dict(os.environ, {"DJANGO_MIGRANT_STAGE": "TWO"})
+    @mock.patch("django_migrant.daemon.request")
+    def test_migrant_stage(self, mock_request):
+        self.assertEqual(daemon.main(["abc", "def"]), daemon.NO_DAEMON)
+        mock_request.assert_not_called()
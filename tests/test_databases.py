@@ -0,0 +1,175 @@
+import sqlite3
+from io import StringIO
+from pathlib import Path
+from tempfile import TemporaryDirectory
+from unittest import mock
+
+from django.core.management.base import CommandError
+from django.db.utils import ConnectionHandler
+
+from django_migrant import databases
+from django_migrant.databases import for_each_alias, migrated_aliases
+from tests.testcases import DjangoSetupTestCase
+
+
+class TestMigratedAliases(DjangoSetupTestCase):
+
+    def test_default_only(self):
+        self.assertEqual(migrated_aliases(), ["default"])
+
+    @mock.patch("django_migrant.databases.router")
+    @mock.patch("django_migrant.databases.apps")
+    @mock.patch("django_migrant.databases.connections", ["default", "other", "cache"])
+    def test_routed(self, mock_apps, mock_router):
+        mock_apps.get_models.return_value = [mock.sentinel.model]
+        mock_router.allow_migrate_model.side_effect = lambda alias, model: (
+            alias == "other"
+        )
+
+        # The default database is migrated whatever the routers say.
+        self.assertEqual(migrated_aliases(), ["default", "other"])
+
+
+@mock.patch("django_migrant.databases.connections", mock.MagicMock())
+class TestForEachAlias(DjangoSetupTestCase):
+
+    def test_single_alias(self):
+        stdout = StringIO()
+
+        def func(alias, out):
+            out.write(f"migrating {alias}\n")
+            return alias.upper()
+
+        self.assertEqual(
+            for_each_alias(func, ["default"], stdout), {"default": "DEFAULT"}
+        )
+        # No heading when there's only one database.
+        self.assertEqual(stdout.getvalue(), "migrating default\n")
+
+    def test_output_grouped(self):
+        stdout = StringIO()
+
+        def func(alias, out):
+            out.write(f"migrating {alias}\n")
+            return alias
+
+        results = for_each_alias(func, ["default", "other"], stdout)
+
+        self.assertEqual(results, {"default": "default", "other": "other"})
+        output = stdout.getvalue()
+        for alias in ("default", "other"):
+            self.assertIn(f"Database '{alias}':\nmigrating {alias}\n", output)
+
+    def test_failures_reported_together(self):
+        stdout = StringIO()
+        called = []
+
+        def func(alias, out):
+            called.append(alias)
+            if alias != "default":
+                raise ValueError(f"{alias} is broken")
+
+        with self.assertRaises(CommandError) as cm:
+            for_each_alias(func, ["default", "other", "third"], stdout)
+
+        # Every database is tried, however many fail.
+        self.assertCountEqual(called, ["default", "other", "third"])
+        self.assertIn("'other' (ValueError: other is broken)", str(cm.exception))
+        self.assertIn("'third' (ValueError: third is broken)", str(cm.exception))
+        self.assertNotIn("'default'", str(cm.exception))
+
+
+class TestTestDatabases(DjangoSetupTestCase):
+
+    def connection(self, name, test_name, mirror=None):
+        connection = mock.Mock(vendor="sqlite")
+        connection.settings_dict = {"NAME": name, "TEST": {"MIRROR": mirror}}
+        connection.creation._get_test_db_name.return_value = test_name
+        connection.creation.is_in_memory_db.return_value = False
+        return connection
+
+    def test_switched(self):
+        with TemporaryDirectory() as temp_dir:
+            kept = Path(temp_dir) / "test_db.sqlite3"
+            kept.touch()
+            connections = {
+                "default": self.connection("db.sqlite3", str(kept)),
+                "missing": self.connection("other.sqlite3", "test_other.sqlite3"),
+                "replica": self.connection("replica.sqlite3", str(kept), "default"),
+            }
+            with mock.patch("django_migrant.databases.connections", connections):
+                with databases.test_databases(list(connections)) as aliases:
+                    # Only test databases that exist are switched to.
+                    self.assertEqual(aliases, ["default"])
+                    self.assertEqual(
+                        connections["default"].settings_dict["NAME"], str(kept)
+                    )
+                    self.assertEqual(
+                        connections["missing"].settings_dict["NAME"], "other.sqlite3"
+                    )
+
+            self.assertEqual(connections["default"].settings_dict["NAME"], "db.sqlite3")
+
+
+class TestRelaxedDurability(DjangoSetupTestCase):
+
+    def test_sqlite(self):
+        with TemporaryDirectory() as temp_dir:
+            handler = ConnectionHandler(
+                {
+                    "default": {
+                        "ENGINE": "django.db.backends.sqlite3",
+                        "NAME": str(Path(temp_dir) / "db.sqlite3"),
+                    }
+                }
+            )
+            connection = handler["default"]
+
+            def pragma(name):
+                with connection.cursor() as cursor:
+                    cursor.execute(f"PRAGMA {name}")
+                    return cursor.fetchone()[0]
+
+            with databases.relaxed_durability(connection) as relaxed:
+                self.assertEqual(relaxed, "journal_mode=WAL, synchronous=OFF")
+                self.assertEqual(pragma("journal_mode"), "wal")
+                self.assertEqual(pragma("synchronous"), 0)
+
+            self.assertEqual(pragma("journal_mode"), "delete")
+            self.assertEqual(pragma("synchronous"), 2)
+            connection.close()
+
+    def test_sqlite_journal_mode_not_restored(self):
+        with TemporaryDirectory() as temp_dir:
+            path = Path(temp_dir) / "db.sqlite3"
+            handler = ConnectionHandler(
+                {
+                    "default": {
+                        "ENGINE": "django.db.backends.sqlite3",
+                        "NAME": str(path),
+                        # Don't wait for the other connection to go.
+                        "OPTIONS": {"timeout": 0.1},
+                    }
+                }
+            )
+            connection = handler["default"]
+            stdout = StringIO()
+
+            with databases.relaxed_durability(connection, stdout):
+                # Eg, runserver connects while migrating.
+                other = sqlite3.connect(path)
+                other.execute("PRAGMA journal_mode").fetchall()
+
+            self.assertIn(
+                "Couldn't restore journal_mode=delete on database 'default', it's "
+                "left as journal_mode=wal.",
+                stdout.getvalue(),
+            )
+            other.close()
+            connection.close()
+
+    def test_unsupported(self):
+        connection = mock.Mock(vendor="oracle")
+        with databases.relaxed_durability(connection) as relaxed:
+            self.assertIsNone(relaxed)
+        connection.cursor.assert_not_called()
@@ -0,0 +1,170 @@
+import unittest
+from pathlib import Path
+from tempfile import TemporaryDirectory
+from unittest import mock
+
+from django.db import IntegrityError, migrations, models
+from django.db.backends.base.schema import BaseDatabaseSchemaEditor
+from django.db.migrations.state import ModelState, ProjectState
+from django.db.utils import ConnectionHandler
+
+from django_migrant.deferral import (
+    Deferral,
+    deferrable_models,
+    not_valid_schema_editor,
+)
+from tests.testcases import DjangoSetupTestCase
+
+
+def migration(name, *operations):
+    migration = migrations.Migration(name, "polls")
+    migration.operations = list(operations)
+    return migration
+
+
+def polls_state():
+    state = ProjectState()
+    state.add_model(
+        ModelState(
+            "polls",
+            "Question",
+            [
+                ("id", models.AutoField(primary_key=True)),
+                ("votes", models.IntegerField(db_index=True)),
+            ],
+        )
+    )
+    return state
+
+
+class TestDeferrableModels(unittest.TestCase):
+
+    def alter(self, model_name="question"):
+        return migrations.AlterField(model_name, "votes", models.BigIntegerField())
+
+    def test_changed_more_than_once(self):
+        plan = [
+            (migration("0002", self.alter(), self.alter("answer")), False),
+            (migration("0003", migrations.AlterModelOptions("answer", {})), False),
+            (migration("0004", self.alter()), False),
+        ]
+        self.assertEqual(deferrable_models(plan), {("polls", "question")})
+
+    def test_separate_database_and_state(self):
+        operation = migrations.SeparateDatabaseAndState(
+            database_operations=[self.alter()]
+        )
+        plan = [(migration("0002", self.alter(), operation), False)]
+        self.assertEqual(deferrable_models(plan), {("polls", "question")})
+
+    def test_index_dependent(self):
+        remove_index = migrations.RemoveIndex("question", "votes_idx")
+        plan = [(migration("0002", self.alter(), self.alter(), remove_index), False)]
+        self.assertEqual(deferrable_models(plan), set())
+
+    def test_run_sql(self):
+        run_sql = migrations.RunSQL("UPDATE polls_answer SET votes = 0")
+        plan = [(migration("0002", self.alter(), self.alter(), run_sql), False)]
+        self.assertEqual(deferrable_models(plan), set())
+
+
+class TestDeferral(DjangoSetupTestCase):
+
+    def statement(self, name):
+        return mock.Mock(parts={"name": f'"{name}"'})
+
+    def test_postgresql_indexes(self):
+        connection = mock.MagicMock(vendor="postgresql")
+        connection.SchemaEditorClass = BaseDatabaseSchemaEditor
+        editor = connection.schema_editor.return_value.__enter__.return_value
+        statements = {"votes_idx": self.statement("votes_idx")}
+        editor._model_indexes_sql.side_effect = lambda model: list(statements.values())
+        connection.introspection.get_constraints.return_value = {
+            "votes_idx": {"index": True, "unique": False, "primary_key": False},
+            "custom_idx": {"index": True, "unique": False, "primary_key": False},
+            "pkey": {"index": True, "unique": True, "primary_key": True},
+        }
+        alter = migrations.AlterField("question", "votes", models.BigIntegerField())
+        deferral = Deferral(connection, [(migration("0002", alter, alter), False)])
+
+        deferred = deferral.start(polls_state())
+
+        self.assertEqual(deferred, "1 index(es) on 1 table(s), foreign key validation")
+        # Only the indexes Django made for the model are dropped.
+        editor._delete_index_sql.assert_called_once_with(mock.ANY, "votes_idx")
+
+        connection.introspection.get_constraints.return_value = {}
+        statements["votes_2_idx"] = self.statement("votes_2_idx")
+        editor.execute.reset_mock()
+        deferral.finish(polls_state())
+
+        # The indexes are those of the model after the plan.
+        editor.execute.assert_has_calls(
+            [mock.call(statements["votes_idx"]), mock.call(statements["votes_2_idx"])]
+        )
+        # Finishing a second time does nothing.
+        editor.execute.reset_mock()
+        deferral.finish(polls_state())
+        editor.execute.assert_not_called()
+
+    def test_sqlite_foreign_key_checks(self):
+        with TemporaryDirectory() as temp_dir:
+            handler = ConnectionHandler(
+                {
+                    "default": {
+                        "ENGINE": "django.db.backends.sqlite3",
+                        "NAME": str(Path(temp_dir) / "db.sqlite3"),
+                    }
+                }
+            )
+            connection = handler["default"]
+            with connection.cursor() as cursor:
+                cursor.execute("CREATE TABLE question (id INTEGER PRIMARY KEY)")
+                cursor.execute(
+                    "CREATE TABLE answer "
+                    "(id INTEGER PRIMARY KEY, question_id INTEGER REFERENCES question)"
+                )
+
+            deferral = Deferral(connection, [])
+            self.assertEqual(deferral.start(ProjectState()), "foreign key checks")
+            # Outside a transaction, as atomic() would use the test settings.
+            with connection.schema_editor(atomic=False) as editor:
+                editor.execute("INSERT INTO answer VALUES (1, 1)")
+
+            with self.assertRaises(IntegrityError):
+                deferral.finish(ProjectState())
+            self.assertNotIn("check_constraints", connection.__dict__)
+            connection.close()
+
+
+class TestNotValidSchemaEditor(DjangoSetupTestCase):
+
+    def test_foreign_keys_not_valid(self):
+        state = polls_state()
+        state.add_model(
+            ModelState(
+                "polls",
+                "Answer",
+                [
+                    ("id", models.AutoField(primary_key=True)),
+                    (
+                        "question",
+                        models.ForeignKey("polls.Question", models.CASCADE),
+                    ),
+                ],
+            )
+        )
+        answer = state.apps.get_model("polls", "Answer")
+        connection = mock.MagicMock()
+        connection.ops.quote_name.side_effect = lambda name: f'"{name}"'
+        connection.ops.max_name_length.return_value = 63
+        connection.ops.deferrable_sql.return_value = " DEFERRABLE INITIALLY DEFERRED"
+        added = []
+        editor = not_valid_schema_editor(BaseDatabaseSchemaEditor, added)(connection)
+
+        statement = editor._create_fk_sql(
+            answer, answer._meta.get_field("question"), "_fk"
+        )
+
+        self.assertTrue(str(statement).endswith("DEFERRED NOT VALID"))
+        self.assertEqual(added, [str(statement.parts["name"]).strip('"')])
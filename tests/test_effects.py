@@ -0,0 +1,91 @@
+import unittest
+from unittest import mock
+
+from django.db import migrations, models
+from django.db.backends.base.schema import BaseDatabaseSchemaEditor
+from django.db.migrations.state import ModelState, ProjectState
+
+from django_migrant.effects import schema_effect
+
+
+class TestSchemaEffect(unittest.TestCase):
+
+    def setUp(self):
+        self.connection = mock.Mock(SchemaEditorClass=BaseDatabaseSchemaEditor)
+        self.connection.ops.quote_name.side_effect = lambda name: f'"{name}"'
+        self.state = ProjectState()
+        self.state.add_model(
+            ModelState(
+                "polls",
+                "Question",
+                [
+                    ("id", models.AutoField(primary_key=True)),
+                    ("votes", models.IntegerField(default=0)),
+                ],
+            )
+        )
+
+    def effect(self, *operations, backwards=False):
+        migration = migrations.Migration("0002_change", "polls")
+        migration.operations = list(operations)
+        return schema_effect(self.connection, migration, self.state, backwards)
+
+    def test_state_only(self):
+        self.assertFalse(
+            self.effect(
+                migrations.AlterModelOptions("question", {"ordering": ["votes"]}),
+                migrations.AlterModelManagers("question", []),
+            )
+        )
+
+    def test_alter_field_attributes(self):
+        field = models.IntegerField(default=0, help_text="Votes", verbose_name="V")
+        self.assertFalse(self.effect(migrations.AlterField("question", "votes", field)))
+
+    def test_alter_field_column(self):
+        field = models.IntegerField(default=0, db_column="n")
+        self.assertTrue(self.effect(migrations.AlterField("question", "votes", field)))
+        field = models.BigIntegerField(default=0)
+        self.assertTrue(self.effect(migrations.AlterField("question", "votes", field)))
+
+    def test_alter_field_twice(self):
+        self.assertTrue(
+            self.effect(
+                migrations.AlterField("question", "votes", models.IntegerField()),
+                migrations.AlterField(
+                    "question", "votes", models.IntegerField(default=0)
+                ),
+            )
+        )
+
+    def test_unknown_model(self):
+        field = models.IntegerField(default=0)
+        self.assertTrue(self.effect(migrations.AlterField("answer", "votes", field)))
+
+    def test_run_python(self):
+        def forwards(apps, schema_editor):
+            pass
+
+        operation = migrations.RunPython(forwards, migrations.RunPython.noop)
+        self.assertTrue(self.effect(operation))
+        self.assertFalse(self.effect(operation, backwards=True))
+
+    def test_run_sql(self):
+        operation = migrations.RunSQL("SELECT 1", migrations.RunSQL.noop)
+        self.assertTrue(self.effect(operation))
+        self.assertFalse(self.effect(operation, backwards=True))
+
+    def test_separate_database_and_state(self):
+        operation = migrations.SeparateDatabaseAndState(
+            state_operations=[migrations.DeleteModel("question")]
+        )
+        self.assertFalse(self.effect(operation))
+
+    def test_schema_change(self):
+        field = models.IntegerField(default=0)
+        self.assertTrue(
+            self.effect(
+                migrations.AlterModelOptions("question", {}),
+                migrations.AddField("question", "score", field),
+            )
+        )
@@ -0,0 +1,464 @@
+import threading
+import unittest
+from io import StringIO
+from pathlib import Path
+from tempfile import TemporaryDirectory
+from unittest import mock
+
+from django.db import connections, migrations, models
+from django.db.migrations.graph import MigrationGraph, Node
+from django.db.migrations.loader import MigrationLoader
+
+from django_migrant.executor import (
+    ChainExecutor,
+    MigrantExecutor,
+    StopChain,
+    independent_chains,
+    migrate_forwards,
+    rollback,
+)
+from django_migrant.squashing import Segment
+from tests.testcases import DjangoSetupTestCase
+
+
+def migration(key):
+    migration = mock.Mock(app_label=key[0])
+    # 'name' means something else to Mock's constructor.
+    migration.name = key[1]
+    return migration
+
+
+class TestIndependentChains(unittest.TestCase):
+
+    def test_split(self):
+        polls1 = Node(("polls", "0001_initial"))
+        polls2 = Node(("polls", "0002_extra"))
+        polls2.add_parent(polls1)
+        books1 = Node(("books", "0001_initial"))
+        # Depends on polls, so must run after it.
+        books2 = Node(("books", "0002_author"))
+        books2.add_parent(books1)
+        books2.add_parent(polls2)
+        auth1 = Node(("auth", "0001_initial"))
+        loader = mock.Mock()
+        loader.graph.node_map = {
+            n.key: n for n in (polls1, polls2, books1, books2, auth1)
+        }
+        plan = [
+            (migration(key), False)
+            for key in [
+                ("polls", "0001_initial"),
+                ("auth", "0001_initial"),
+                ("books", "0001_initial"),
+                ("polls", "0002_extra"),
+                ("books", "0002_author"),
+            ]
+        ]
+
+        chains = independent_chains(loader, plan)
+
+        self.assertEqual(chains, [[plan[0], plan[2], plan[3], plan[4]], [plan[1]]])
+
+    def test_applied_dependency(self):
+        # Migrations that only share a dependency outside the plan (ie, one
+        # already applied) are independent.
+        polls1 = Node(("polls", "0001_initial"))
+        polls2 = Node(("polls", "0002_extra"))
+        polls2.add_parent(polls1)
+        books1 = Node(("books", "0001_initial"))
+        books1.add_parent(polls1)
+        loader = mock.Mock()
+        loader.graph.node_map = {n.key: n for n in (polls1, polls2, books1)}
+        plan = [
+            (migration(("polls", "0002_extra")), False),
+            (migration(("books", "0001_initial")), False),
+        ]
+
+        self.assertEqual(independent_chains(loader, plan), [[plan[0]], [plan[1]]])
+
+
+class TestChainExecutor(unittest.TestCase):
+
+    def setUp(self):
+        self.parent = mock.Mock(stdout=StringIO())
+        self.stop = threading.Event()
+        self.done = []
+        self.executor = ChainExecutor(
+            self.parent, mock.Mock(), self.stop, threading.Lock(), self.done
+        )
+
+    def test_reports_whole_lines(self):
+        self.executor.report_progress("apply_start", "polls.0002")
+        self.executor.report_progress("apply_success", "polls.0002")
+
+        self.assertEqual(self.parent.stdout.getvalue(), "  Applying polls.0002... OK\n")
+        self.assertEqual(self.done, ["polls.0002"])
+
+    def test_stops(self):
+        self.stop.set()
+
+        # Nothing more is started once another worker has failed.
+        with self.assertRaises(StopChain):
+            self.executor.report_progress("unapply_start", "polls.0002")
+        self.assertEqual(self.done, [])
+
+
+class TestMigrateForwards(unittest.TestCase):
+
+    def setUp(self):
+        n1 = Node(("polls", "0001_initial"))
+        n2 = Node(("polls", "0002_extra"))
+        n2.add_parent(n1)
+        n3 = Node(("auth", "0001_initial"))
+        self.loader = mock.Mock()
+        self.loader.detect_conflicts.return_value = {}
+        self.loader.graph.nodes = {n.key: n for n in (n1, n2, n3)}
+        self.loader.graph.leaf_nodes.return_value = [n2.key, n3.key]
+        self.loader.applied_migrations = {n1.key: n1, n3.key: n3}
+
+    @mock.patch("django_migrant.executor.BaseCommand")
+    @mock.patch("django_migrant.executor.MigrantExecutor")
+    def test_changed_apps_only(self, mock_executor, mock_command):
+        executor = mock_executor.return_value
+
+        migrate_forwards(mock.Mock(alias="default"), self.loader)
+
+        # auth is fully applied, so isn't planned for.
+        executor.migration_plan.assert_called_once_with([("polls", "0002_extra")])
+        mock_command.return_value.check.assert_called_once_with(databases=["default"])
+        executor.run.assert_called_once()
+
+    @mock.patch("django_migrant.executor.BaseCommand")
+    @mock.patch("django_migrant.executor.MigrantExecutor")
+    def test_nothing_to_apply(self, mock_executor, mock_command):
+        executor = mock_executor.return_value
+        executor.migration_plan.return_value = []
+
+        migrate_forwards(mock.Mock(alias="default"), self.loader)
+
+        # No checks, and no signals.
+        mock_command.assert_not_called()
+        executor.run.assert_not_called()
+
+
+class TestPostMigrate(unittest.TestCase):
+
+    @mock.patch("django_migrant.executor.models.signals.post_migrate")
+    @mock.patch("django_migrant.executor.apps")
+    def test_affected_apps_only(self, mock_apps, mock_post_migrate):
+        polls, auth = mock.Mock(label="polls"), mock.Mock(label="auth")
+        no_models = mock.Mock(label="static", models_module=None)
+        mock_apps.get_app_configs.return_value = [polls, auth, no_models]
+        executor = MigrantExecutor(mock.Mock(alias="default"), mock.Mock())
+
+        executor.emit_post_migrate({"polls", "static"}, mock.sentinel.apps, [])
+
+        mock_post_migrate.send.assert_called_once()
+        self.assertEqual(mock_post_migrate.send.call_args.kwargs["sender"], polls)
+
+
+class TestFaking(unittest.TestCase):
+
+    def setUp(self):
+        self.executor = MigrantExecutor(
+            mock.Mock(alias="default"), mock.Mock(), stdout=StringIO()
+        )
+        self.executor.recorder = mock.Mock()
+        self.executor.record_progress = mock.Mock()
+
+    @mock.patch("django_migrant.executor.schema_effect", return_value=False)
+    @mock.patch("django_migrant.executor.MigrationExecutor.apply_migration")
+    def test_state_only_faked(self, mock_apply, mock_schema_effect):
+        first, second = migration(("polls", "0002")), migration(("polls", "0003"))
+        first.replaces = second.replaces = []
+
+        self.executor.apply_migration(mock.sentinel.state, first)
+        self.executor.apply_migration(mock.sentinel.state, second)
+
+        mock_apply.assert_not_called()
+        first.mutate_state.assert_called_once_with(mock.sentinel.state, preserve=False)
+        # Nothing is recorded until the next migration is run.
+        self.executor.recorder.migration_qs.bulk_create.assert_not_called()
+
+        mock_schema_effect.return_value = True
+        self.executor.apply_migration(mock.sentinel.state, migration(("polls", "4")))
+
+        mock_apply.assert_called_once()
+        self.executor.recorder.migration_qs.bulk_create.assert_called_once()
+        self.assertEqual(self.executor.faked, [])
+        output = self.executor.stdout._out.getvalue()
+        self.assertEqual(output.count("... FAKED\n"), 2)
+
+    def test_record_applied(self):
+        squashed = migration(("polls", "0001_squashed_0002"))
+        squashed.replaces = [("polls", "0001"), ("polls", "0002")]
+        other = migration(("books", "0001"))
+        other.replaces = []
+        self.executor.faked = [(squashed, False), (other, False)]
+
+        self.executor.record_faked()
+
+        self.executor.recorder.Migration.assert_has_calls(
+            [
+                mock.call(app="polls", name="0001"),
+                mock.call(app="polls", name="0002"),
+                mock.call(app="books", name="0001"),
+            ]
+        )
+        self.executor.recorder.migration_qs.bulk_create.assert_called_once()
+
+    def test_record_unapplied(self):
+        first, second = migration(("polls", "0002")), migration(("polls", "0003"))
+        first.replaces = second.replaces = []
+        self.executor.faked = [(second, True), (first, True)]
+
+        self.executor.record_faked()
+
+        migrations = self.executor.recorder.migration_qs
+        query = migrations.filter.call_args.args[0]
+        self.assertEqual(
+            query.children, [("app", "polls"), ("name__in", ["0003", "0002"])]
+        )
+        migrations.filter.return_value.delete.assert_called_once()
+        self.assertEqual(
+            [c.args[0] for c in self.executor.record_progress.call_args_list],
+            ["unapply_start", "unapply_success", "unapply_start", "unapply_success"],
+        )
+
+
+@mock.patch("django_migrant.executor.transaction", mock.MagicMock())
+class TestMigrateAtomically(unittest.TestCase):
+
+    def setUp(self):
+        self.journal = mock.Mock()
+        self.executor = MigrantExecutor(
+            mock.Mock(alias="default"), mock.Mock(), journal=self.journal
+        )
+        self.executor.tracer = mock.Mock()
+
+    def test_journal_told_on_commit(self):
+        def migrate(targets, plan, state):
+            self.executor.record_progress("apply_success", mock.sentinel.migration)
+            # Nothing is journalled until the transaction commits.
+            self.journal.migration_progress.assert_not_called()
+            return state
+
+        with mock.patch.object(self.executor, "migrate", side_effect=migrate):
+            self.executor.migrate_atomically(None, [], mock.sentinel.state)
+
+        self.journal.migration_progress.assert_called_once_with(
+            "default", "apply_success", migration=mock.sentinel.migration
+        )
+        self.assertIsNone(self.executor.uncommitted)
+
+    def test_journal_untouched_on_failure(self):
+        def migrate(targets, plan, state):
+            self.executor.record_progress("apply_success", mock.sentinel.migration)
+            raise ValueError()
+
+        with mock.patch.object(self.executor, "migrate", side_effect=migrate):
+            with self.assertRaises(ValueError):
+                self.executor.migrate_atomically(None, [], mock.sentinel.state)
+
+        # The transaction rolled back, so the journal mustn't say it was done.
+        self.journal.migration_progress.assert_not_called()
+        self.assertIsNone(self.executor.uncommitted)
+
+    def test_single_transaction(self):
+        connection = self.executor.connection
+        connection.vendor = "postgresql"
+        atomic, non_atomic = mock.Mock(atomic=True), mock.Mock(atomic=False)
+
+        self.assertTrue(self.executor.single_transaction([(atomic, False)]))
+        self.assertFalse(
+            self.executor.single_transaction([(atomic, False), (non_atomic, False)])
+        )
+        connection.vendor = "sqlite"
+        self.assertFalse(self.executor.single_transaction([(atomic, False)]))
+
+
+@mock.patch("django_migrant.executor.Deferral")
+class TestDeferring(unittest.TestCase):
+
+    def setUp(self):
+        self.stdout = StringIO()
+        self.executor = MigrantExecutor(
+            mock.Mock(alias="default"), mock.Mock(), stdout=self.stdout, defer=True
+        )
+
+    def test_not_deferring(self, mock_deferral):
+        self.executor.defer = False
+        with self.executor.deferring([], mock.sentinel.state) as deferral:
+            self.assertIsNone(deferral)
+        mock_deferral.assert_not_called()
+
+    def test_finished_on_failure(self, mock_deferral):
+        mock_deferral.return_value.start.return_value = "foreign key checks"
+        with mock.patch.object(self.executor, "applied_state") as applied_state:
+            with self.assertRaises(ValueError):
+                with self.executor.deferring([], mock.sentinel.state):
+                    raise ValueError()
+
+        mock_deferral.return_value.start.assert_called_once_with(mock.sentinel.state)
+        # Done for the migrations recorded as applied before the failure.
+        mock_deferral.return_value.finish.assert_called_once_with(
+            applied_state.return_value
+        )
+        self.assertIn("Deferred foreign key checks.", self.stdout.getvalue())
+
+
+class TestSquashing(unittest.TestCase):
+
+    def setUp(self):
+        self.journal = mock.Mock()
+        self.executor = MigrantExecutor(
+            mock.Mock(alias="default"),
+            mock.Mock(),
+            stdout=StringIO(),
+            journal=self.journal,
+        )
+        self.first, self.second = migration(("polls", "0002")), migration(
+            ("polls", "0003")
+        )
+        self.first.operations = self.second.operations = []
+        self.segment = Segment([self.first, self.second], [])
+        self.executor.segments = {self.first: self.segment, self.second: self.segment}
+
+    @mock.patch("django_migrant.executor.schema_effect", return_value=True)
+    @mock.patch("django_migrant.executor.MigrationExecutor.apply_migration")
+    def test_applied_once(self, mock_apply, mock_schema_effect):
+        self.executor.apply_migration(mock.sentinel.state, self.first)
+        state = self.executor.apply_migration(mock.sentinel.applied, self.second)
+
+        mock_apply.assert_called_once_with(
+            mock.sentinel.state, self.segment, False, False
+        )
+        self.assertEqual(state, mock.sentinel.applied)
+
+    @mock.patch("django_migrant.executor.schema_effect", return_value=True)
+    @mock.patch("django_migrant.executor.MigrationExecutor.unapply_migration")
+    def test_unapplied_once(self, mock_unapply, mock_schema_effect):
+        # Unapplied in reverse, so the segment is run when the first is reached.
+        self.executor.unapply_migration(mock.sentinel.after, self.second)
+        mock_unapply.assert_not_called()
+        self.executor.unapply_migration(mock.sentinel.before, self.first)
+
+        mock_unapply.assert_called_once_with(mock.sentinel.before, self.segment, False)
+
+    def test_journal_told_of_each(self):
+        self.executor.record_progress("apply_success", self.segment)
+
+        self.journal.migration_progress.assert_has_calls(
+            [
+                mock.call("default", "apply_success", migration=self.first),
+                mock.call("default", "apply_success", migration=self.second),
+            ]
+        )
+
+
+class TestStateFrom(unittest.TestCase):
+
+    def setUp(self):
+        self.state_cache = mock.Mock()
+        self.executor = MigrantExecutor(
+            mock.Mock(alias="default"),
+            mock.Mock(unmigrated_apps=set()),
+            state_cache=self.state_cache,
+        )
+        self.migrations = [migration(("polls", "0001")), migration(("polls", "0002"))]
+
+    def test_hit(self):
+        state = self.executor.state_from(self.migrations)
+
+        self.assertEqual(state, self.state_cache.get.return_value)
+        self.state_cache.get.assert_called_once_with(self.state_cache.key.return_value)
+        for m in self.migrations:
+            m.mutate_state.assert_not_called()
+
+    def test_miss(self):
+        self.state_cache.get.return_value = None
+
+        state = self.executor.state_from(self.migrations)
+
+        for m in self.migrations:
+            m.mutate_state.assert_called_once_with(state, preserve=False)
+        self.state_cache.put.assert_called_once_with(
+            self.state_cache.key.return_value, state
+        )
+
+    def test_no_key(self):
+        self.state_cache.key.return_value = None
+
+        self.executor.state_from(self.migrations)
+
+        self.state_cache.get.assert_not_called()
+        self.state_cache.put.assert_not_called()
+
+
+class TestRollback(DjangoSetupTestCase):
+
+    def migration(self, app_label, name, model, dependencies=()):
+        migration = migrations.Migration(name, app_label)
+        migration.dependencies = list(dependencies)
+        migration.operations = [
+            migrations.CreateModel(model, [("id", models.AutoField(primary_key=True))])
+        ]
+        return migration
+
+    def test_other_apps_left_alone(self):
+        # app1.0004_c, being left, depends on app0.0002_model2 but not on
+        # app0.0003_model3, which has to stay applied, data and all.
+        nodes = [
+            self.migration("app0", "0001_model1", "Model1"),
+            self.migration("app0", "0002_model2", "Model2", [("app0", "0001_model1")]),
+            self.migration("app0", "0003_model3", "Model3", [("app0", "0002_model2")]),
+            self.migration("app1", "0001_a", "A"),
+            self.migration(
+                "app1", "0004_c", "C", [("app1", "0001_a"), ("app0", "0002_model2")]
+            ),
+        ]
+        with TemporaryDirectory() as temp_dir:
+            # The recorder looks its connection up by alias.
+            settings = connections.configure_settings(
+                {
+                    "default": {},
+                    "rollback": {
+                        "ENGINE": "django.db.backends.sqlite3",
+                        "NAME": str(Path(temp_dir) / "db.sqlite3"),
+                    },
+                }
+            )
+            self.enterContext(
+                mock.patch.dict(connections.settings, rollback=settings["rollback"])
+            )
+            connection = connections["rollback"]
+            self.addCleanup(connections.__delitem__, "rollback")
+            self.addCleanup(connection.close)
+            loader = MigrationLoader(connection, load=False)
+            loader.graph = MigrationGraph()
+            loader.replacements = {}
+            loader.unmigrated_apps = set()
+            for migration in nodes:
+                key = (migration.app_label, migration.name)
+                loader.graph.add_node(key, migration)
+            for migration in nodes:
+                for parent in migration.dependencies:
+                    loader.graph.add_dependency(
+                        migration, (migration.app_label, migration.name), parent
+                    )
+            loader.applied_migrations = {}
+            executor = MigrantExecutor(connection, loader, stdout=StringIO())
+            forwards = [(migration, False) for migration in nodes]
+            executor.run(None, forwards)
+            with connection.cursor() as cursor:
+                cursor.execute("INSERT INTO app0_model3 VALUES (1)")
+            loader.applied_migrations = executor.recorder.applied_migrations()
+
+            plan = rollback(connection, loader, [("app1", "0004_c")], StringIO())
+
+            self.assertEqual(
+                [(m.app_label, m.name) for m, _ in plan], [("app1", "0004_c")]
+            )
+            with connection.cursor() as cursor:
+                cursor.execute("SELECT COUNT(*) FROM app0_model3")
+                self.assertEqual(cursor.fetchone(), (1,))
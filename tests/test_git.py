@@ -0,0 +1,44 @@
+import os
+from pathlib import Path
+from unittest import mock
+
+from django_migrant import git
+from tests.testcases import GitRepoTestCase
+
+
+class TestObjectStore(GitRepoTestCase):
+
+    def test_read(self):
+        self.write("a.txt", "first\n")
+        self.write("b.txt", "second\n")
+        revision = self.commit()
+
+        files = git.ls_tree(revision, Path("."))
+        with git.ObjectStore() as store:
+            self.assertEqual(store.read(files["a.txt"]), b"first\n")
+            self.assertEqual(store.read(files["b.txt"]), b"second\n")
+
+    def test_ls_tree_from_subdirectory(self):
+        self.write("project/polls/migrations/0001_initial.py")
+        revision = self.commit()
+        os.chdir(self.root / "project")
+
+        files = git.ls_tree(revision, Path("project/polls/migrations"))
+        self.assertEqual(list(files), ["0001_initial.py"])
+
+    def test_read_missing(self):
+        with git.ObjectStore() as store:
+            with self.assertRaises(KeyError):
+                store.read("0" * 40)
+
+
+class TestMigrantDir(GitRepoTestCase):
+
+    def test_project(self):
+        self.assertEqual(git.migrant_dir(), self.root / ".git" / "migrant")
+        with mock.patch.dict(os.environ, {git.PROJECT_ENV: "services-alpha"}):
+            path = git.migrant_dir()
+        self.assertEqual(
+            path, self.root / ".git" / "migrant" / "projects" / "services-alpha"
+        )
+        self.assertTrue(path.is_dir())
@@ -0,0 +1,111 @@
+import subprocess
+import threading
+import time
+import unittest
+from pathlib import Path
+from tempfile import TemporaryDirectory
+
+from django_migrant.jobs import WORKER_PID_FILENAME, JobQueue
+
+
+class TestJobQueue(unittest.TestCase):
+
+    def setUp(self):
+        self.temp_dir = TemporaryDirectory()
+        self.queue = JobQueue(Path(self.temp_dir.name))
+
+    def tearDown(self):
+        self.temp_dir.cleanup()
+
+    def test_enqueue_starts_worker(self):
+        self.assertTrue(self.queue.enqueue("a", "b"))
+
+    def test_enqueue_worker_running(self):
+        calls = []
+
+        def run(previous, current):
+            calls.append((previous, current))
+            if len(calls) == 1:
+                # Whilst working, further checkouts don't need another worker.
+                self.assertFalse(self.queue.enqueue("b", "c"))
+            return 0
+
+        self.queue.enqueue("a", "b")
+        self.queue.work(run)
+        # ...because the running one picks them up.
+        self.assertEqual(calls, [("a", "b"), ("b", "c")])
+
+    def test_work_coalesces(self):
+        self.queue.enqueue("a", "b")
+        self.queue.enqueue("b", "c")
+        self.queue.enqueue("c", "d")
+        calls = []
+
+        def run(previous, current):
+            calls.append((previous, current))
+            return 0
+
+        self.assertTrue(self.queue.work(run))
+        self.assertEqual(calls, [("a", "d")])
+
+        status = self.queue.status()
+        self.assertEqual(status["pending"], [])
+        self.assertEqual(status["last"]["coalesced"], 3)
+        self.assertEqual(status["last"]["status"], 0)
+        self.assertFalse(status["worker"])
+
+    def test_work_failure_requeued(self):
+        self.queue.enqueue("a", "b")
+        self.queue.work(lambda previous, current: 1)
+
+        # The failed checkout is retried along with the next one.
+        self.queue.enqueue("b", "c")
+        calls = []
+
+        def run(previous, current):
+            calls.append((previous, current))
+            return 0
+
+        self.queue.work(run)
+        self.assertEqual(calls, [("a", "c")])
+
+    def test_wait(self):
+        self.assertIsNone(self.queue.wait())
+        self.queue.enqueue("a", "b")
+        self.queue.work(lambda previous, current: 0)
+        self.assertEqual(self.queue.wait()["current"], "b")
+
+    def test_wait_for_worker_to_start(self):
+        self.queue.enqueue("a", "b")
+
+        def work():
+            time.sleep(0.1)
+            self.queue.work(lambda previous, current: 0)
+
+        worker = threading.Thread(target=work)
+        worker.start()
+        # The worker hasn't started yet, but the checkout is still waited for.
+        last = self.queue.wait(interval=0.01)
+        worker.join()
+        self.assertEqual(last["current"], "b")
+
+    def test_wait_failure(self):
+        self.queue.enqueue("a", "b")
+        self.queue.work(lambda previous, current: 1)
+        # The failed checkout is still queued, but nothing will retry it yet.
+        self.assertEqual(self.queue.wait()["status"], 1)
+
+    def test_worker_running(self):
+        def run(previous, current):
+            self.assertTrue(self.queue.status()["worker"])
+            return 0
+
+        self.queue.enqueue("a", "b")
+        self.queue.work(run)
+        self.assertFalse(self.queue.worker_running())
+
+        # A worker that died without cleaning up isn't running.
+        process = subprocess.Popen(["true"])
+        process.wait()
+        (Path(self.temp_dir.name) / WORKER_PID_FILENAME).write_text(str(process.pid))
+        self.assertFalse(self.queue.worker_running())
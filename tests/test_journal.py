@@ -0,0 +1,77 @@
+import unittest
+from pathlib import Path
+from tempfile import TemporaryDirectory
+from unittest import mock
+
+from django_migrant.journal import DONE, FAILED, Journal
+
+
+def migration(app_label, name):
+    migration = mock.Mock(app_label=app_label)
+    migration.name = name
+    return migration
+
+
+class TestJournal(unittest.TestCase):
+
+    def setUp(self):
+        self.temp_dir = TemporaryDirectory()
+        self.addCleanup(self.temp_dir.cleanup)
+        self.journal = Journal(Path(self.temp_dir.name), "abc")
+        self.journal.begin("aaaaaaa", "bbbbbbb")
+
+    def test_remaining(self):
+        keys = [("polls", "0003_c"), ("polls", "0002_b"), ("books", "0002_x")]
+        self.journal.plan("default", "unapply", keys)
+
+        self.journal.migration_progress(
+            "default", "unapply_start", migration("polls", "0003_c")
+        )
+        self.assertEqual(self.journal.remaining("unapply"), {"default": keys})
+
+        self.journal.migration_progress(
+            "default", "unapply_success", migration("polls", "0003_c")
+        )
+        self.assertEqual(self.journal.remaining("unapply"), {"default": keys[1:]})
+        self.assertEqual(self.journal.remaining("apply"), {})
+
+    def test_replanned(self):
+        keys = [("polls", "0003_c"), ("polls", "0002_b")]
+        self.journal.plan("default", "unapply", keys)
+        self.journal.migration_progress(
+            "default", "unapply_success", migration("polls", "0003_c")
+        )
+
+        # Planning again, as the executor does, doesn't undo what's done.
+        self.journal.plan("default", "unapply", keys)
+
+        self.assertEqual(self.journal.remaining("unapply"), {"default": keys[1:]})
+
+    def test_unplanned_progress(self):
+        self.journal.migration_progress(
+            "other", "apply_success", migration("polls", "0002_b")
+        )
+
+        self.assertEqual(self.journal.remaining("apply"), {})
+
+    def test_unfinished(self):
+        transition = self.journal.unfinished()
+        self.assertEqual(transition["id"], "abc")
+        self.assertEqual(transition["previous"], "aaaaaaa")
+        self.assertEqual(transition["current"], "bbbbbbb")
+
+        self.journal.finish(FAILED)
+        self.assertEqual(self.journal.unfinished()["status"], FAILED)
+
+        self.journal.finish(DONE)
+        self.assertIsNone(self.journal.unfinished())
+
+    def test_last_transition_only(self):
+        self.journal.finish(FAILED)
+
+        later = Journal(self.journal.path, "def")
+        later.begin("bbbbbbb", "ccccccc")
+        later.finish()
+
+        # An earlier failure has been superseded.
+        self.assertIsNone(self.journal.unfinished())
@@ -0,0 +1,180 @@
+import os
+import sys
+from pathlib import Path
+from tempfile import TemporaryDirectory
+from unittest import mock
+
+from django.db import connections
+from django.db.migrations import Migration
+
+from django_migrant import git
+from django_migrant.loader import (
+    CachedMigrationLoader,
+    GitMigrationLoader,
+    GraphCache,
+    MigrationWatcher,
+    blob_hash,
+)
+from tests.testcases import DjangoSetupTestCase, GitRepoTestCase
+
+MIGRATION = """
+from django.db import migrations
+
+
+class Migration(migrations.Migration):
+    dependencies = {dependencies}
+"""
+
+
+class TestGitMigrationLoader(GitRepoTestCase):
+
+    def load_revision(self, revision):
+        loader = GitMigrationLoader(connections["default"], revision, load=False)
+        loader.disk_migrations = {("polls", "0001_initial"): None}
+        loader.migrated_apps = {"polls"}
+        loader.unmigrated_apps = set()
+        path = self.root / "polls" / "migrations"
+        with git.ObjectStore() as store:
+            loader.load_revision("polls", "polls.migrations", path, self.root, store)
+        return loader
+
+    def test_load_revision(self):
+        self.write("polls/migrations/__init__.py")
+        self.write(
+            "polls/migrations/0001_initial.py", MIGRATION.format(dependencies=[])
+        )
+        self.write(
+            "polls/migrations/0002_second.py",
+            MIGRATION.format(dependencies=[("polls", "0001_initial")]),
+        )
+        previous = self.commit()
+
+        # The working tree moves on, but the loader reads the old revision.
+        (self.root / "polls" / "migrations" / "0002_second.py").unlink()
+        self.commit()
+
+        loader = self.load_revision(previous)
+        self.assertEqual(
+            set(loader.disk_migrations),
+            {("polls", "0001_initial"), ("polls", "0002_second")},
+        )
+        migration = loader.disk_migrations["polls", "0002_second"]
+        self.assertEqual(migration.dependencies, [("polls", "0001_initial")])
+        # Which file each was read from tells apart migrations of the same name.
+        self.assertEqual(
+            loader.shas["polls", "0002_second"],
+            blob_hash(
+                MIGRATION.format(dependencies=[("polls", "0001_initial")]).encode()
+            ),
+        )
+
+    def test_load_revision_no_migrations_package(self):
+        self.write("polls/models.py")
+        previous = self.commit()
+
+        loader = self.load_revision(previous)
+        self.assertEqual(loader.disk_migrations, {})
+        self.assertEqual(loader.unmigrated_apps, {"polls"})
+
+
+class TestGraphCache(DjangoSetupTestCase):
+
+    def setUp(self):
+        super().setUp()
+        self.temp_dir = TemporaryDirectory()
+        self.path = Path(self.temp_dir.name) / "graph.json"
+
+    def tearDown(self):
+        self.temp_dir.cleanup()
+        super().tearDown()
+
+    def test_round_trip(self):
+        migration = Migration("0002_second", "polls")
+        migration.dependencies = [("polls", "0001_initial")]
+
+        cache = GraphCache(self.path)
+        cache.add("abc", migration)
+        cache.save()
+
+        metadata = GraphCache(self.path).get("abc")
+        self.assertEqual(metadata["dependencies"], [["polls", "0001_initial"]])
+        self.assertEqual(metadata["replaces"], [])
+
+    def test_written_aside(self):
+        cache = GraphCache(self.path)
+        cache.add("abc", Migration("0001_initial", "polls"))
+        with mock.patch(
+            "django_migrant.loader.os.replace", wraps=os.replace
+        ) as replace:
+            cache.save()
+
+        # Readers never see a partly written file.
+        replace.assert_called_once_with(mock.ANY, self.path)
+        self.assertEqual(list(self.path.parent.iterdir()), [self.path])
+        self.assertIsNotNone(GraphCache(self.path).get("abc"))
+
+    def test_discarded_when_swappable_settings_change(self):
+        cache = GraphCache(self.path)
+        cache.add("abc", Migration("0001_initial", "polls"))
+        cache.save()
+
+        with self.settings(AUTH_USER_MODEL="accounts.User"):
+            self.assertIsNone(GraphCache(self.path).get("abc"))
+
+    def test_blob_hash_matches_git(self):
+        # echo "hello" | git hash-object --stdin
+        self.assertEqual(
+            blob_hash(b"hello\n"), "ce013625030ba8dba906f756967f9e9ca394464a"
+        )
+
+
+class TestCachedMigrationLoader(DjangoSetupTestCase):
+
+    def test_cached_migration_is_lazy(self):
+        migration = Migration("0002_second", "polls")
+        migration.dependencies = [("polls", "0001_initial")]
+        graph_cache = mock.Mock()
+        graph_cache.get.return_value = None
+        load = mock.Mock(return_value=migration)
+        loader = CachedMigrationLoader(None, graph_cache=graph_cache, load=False)
+
+        # Not in the cache, so the migration is loaded and remembered.
+        key = ("polls", "0002_second")
+        self.assertIs(loader.get_migration(key, "abc", load), migration)
+        graph_cache.add.assert_called_once_with("abc", migration)
+
+        # In the cache, so it is only loaded once something needs it.
+        load.reset_mock()
+        graph_cache.get.return_value = {
+            "dependencies": [["polls", "0001_initial"]],
+            "replaces": [],
+            "run_before": [],
+        }
+        lazy = loader.get_migration(key, "abc", load)
+        self.assertEqual(lazy.dependencies, [("polls", "0001_initial")])
+        self.assertEqual(lazy, migration)
+        self.assertEqual(str(lazy), "polls.0002_second")
+        load.assert_not_called()
+
+        self.assertEqual(lazy.operations, [])
+        load.assert_called_once()
+
+
+class TestMigrationWatcher(DjangoSetupTestCase):
+
+    def test_check(self):
+        with TemporaryDirectory() as temp_dir_name:
+            path = Path(temp_dir_name)
+            (path / "0001_initial.py").write_text("")
+            paths = [("polls.migrations", path)]
+            with mock.patch(
+                "django_migrant.loader.migrations_paths", return_value=paths
+            ):
+                watcher = MigrationWatcher()
+                self.assertFalse(watcher.check())
+
+                sys.modules["polls.migrations.0001_initial"] = mock.Mock()
+                (path / "0002_second.py").write_text("")
+                self.assertTrue(watcher.check())
+                self.assertNotIn("polls.migrations.0001_initial", sys.modules)
+                self.assertFalse(watcher.check())
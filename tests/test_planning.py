@@ -0,0 +1,178 @@
+import os
+import unittest
+from pathlib import Path
+from tempfile import TemporaryDirectory
+from unittest import mock
+
+from django.db import migrations, models
+from django.db.migrations.graph import MigrationGraph
+
+from django_migrant import planning
+from tests.testcases import DjangoSetupTestCase
+
+
+def migration(app_label, name, *operations):
+    migration = migrations.Migration(name, app_label)
+    migration.operations = list(operations)
+    return migration
+
+
+def loader(applied, *chains):
+    """Returns a loader whose graph has each chain of migrations in order."""
+    graph = MigrationGraph()
+    for chain in chains:
+        previous = None
+        for m in chain:
+            key = (m.app_label, m.name)
+            graph.add_node(key, m)
+            if previous:
+                graph.add_dependency(m, key, previous)
+            previous = key
+    loader = mock.Mock(graph=graph, applied_migrations={k: None for k in applied})
+    return loader
+
+
+class TestOperationTables(DjangoSetupTestCase):
+
+    def test_field(self):
+        operation = migrations.AddField("Question", "votes", models.IntegerField())
+        self.assertEqual(
+            planning.operation_tables("polls", operation),
+            ({"polls_question"}, False),
+        )
+
+    def test_code(self):
+        operation = migrations.RunPython(migrations.RunPython.noop)
+        self.assertEqual(planning.operation_tables("polls", operation), (set(), True))
+
+    def test_state_only(self):
+        operation = migrations.AlterModelOptions("Question", {"ordering": ["id"]})
+        self.assertEqual(planning.operation_tables("polls", operation), (set(), False))
+
+    def test_database_operations(self):
+        operation = migrations.SeparateDatabaseAndState(
+            database_operations=[migrations.DeleteModel("Choice")],
+            state_operations=[migrations.DeleteModel("Question")],
+        )
+        self.assertEqual(
+            planning.operation_tables("polls", operation), ({"polls_choice"}, False)
+        )
+
+
+class TestPlanSwitch(unittest.TestCase):
+
+    def test_unapply_then_apply(self):
+        initial = migration("polls", "0001_initial")
+        ours = migration("polls", "0002_ours")
+        ours_too = migration("polls", "0003_ours")
+        theirs = migration("polls", "0002_theirs")
+        applied = [
+            ("polls", "0001_initial"),
+            ("polls", "0002_ours"),
+            ("polls", "0003_ours"),
+        ]
+        source = loader(applied, [initial, ours, ours_too])
+        target = loader(applied, [initial, theirs])
+
+        steps = planning.plan_switch(mock.Mock(), source, target)
+
+        self.assertEqual(
+            [(action, m.name) for action, m in steps],
+            [
+                ("unapply", "0003_ours"),
+                ("unapply", "0002_ours"),
+                ("apply", "0002_theirs"),
+            ],
+        )
+
+    def test_nothing_to_do(self):
+        initial = migration("polls", "0001_initial")
+        source = target = loader([("polls", "0001_initial")], [initial])
+
+        self.assertEqual(planning.plan_switch(mock.Mock(), source, target), [])
+
+
+class TestEstimate(DjangoSetupTestCase):
+
+    @mock.patch("django_migrant.planning.table_rows")
+    def test_annotated(self, mock_table_rows):
+        mock_table_rows.return_value = {"polls_question": 5000}
+        steps = [
+            (
+                "apply",
+                migration(
+                    "polls",
+                    "0002_votes",
+                    migrations.AddField("Question", "votes", models.IntegerField()),
+                ),
+            ),
+            (
+                "apply",
+                migration(
+                    "polls",
+                    "0003_data",
+                    migrations.RunPython(migrations.RunPython.noop),
+                ),
+            ),
+            (
+                "apply",
+                migration(
+                    "polls",
+                    "0004_choice",
+                    migrations.AddField("Choice", "votes", models.IntegerField()),
+                ),
+            ),
+        ]
+        history = {("polls.0002_votes", "apply"): 1.5}
+
+        estimated = planning.estimate(mock.Mock(), steps, history)
+
+        self.assertEqual(estimated[0]["tables"], ["polls_question"])
+        self.assertEqual(estimated[0]["rows"], 5000)
+        self.assertEqual(estimated[0]["seconds"], 1.5)
+        self.assertTrue(estimated[1]["opaque"])
+        self.assertEqual(estimated[1]["rows"], 0)
+        self.assertIsNone(estimated[1]["seconds"])
+        # No statistics for the table.
+        self.assertIsNone(estimated[2]["rows"])
+
+
+class TestPlanCache(unittest.TestCase):
+
+    def setUp(self):
+        self.temp_dir = TemporaryDirectory()
+        self.addCleanup(self.temp_dir.cleanup)
+        self.cache = planning.PlanCache(Path(self.temp_dir.name) / "plans", keep=2)
+        patcher = mock.patch("django_migrant.planning.applied_digest")
+        self.applied_digest = patcher.start()
+        self.applied_digest.return_value = "a" * 64
+        self.addCleanup(patcher.stop)
+
+    def test_put_get(self):
+        target = mock.Mock(
+            applied_migrations={("polls", "0001"): None, ("polls", "0002"): None},
+            disk_migrations={("polls", "0001"): None},
+        )
+
+        self.cache.put(mock.Mock(), "abc123", target)
+
+        self.assertEqual(
+            self.cache.get(mock.Mock(), "abc123"), {"unapply": [["polls", "0002"]]}
+        )
+        # Once the database has been migrated, the plan doesn't apply.
+        self.applied_digest.return_value = "b" * 64
+        self.assertIsNone(self.cache.get(mock.Mock(), "abc123"))
+
+    def test_oldest_removed(self):
+        target = mock.Mock(applied_migrations={}, disk_migrations={})
+        for i, commit in enumerate(("a", "b", "c")):
+            # Make sure each plan is newer than the last.
+            for path in self.cache.path.glob("*.json"):
+                os.utime(path, (i, path.stat().st_mtime - 10))
+            self.cache.put(mock.Mock(), commit, target)
+
+        self.assertIsNone(self.cache.get(mock.Mock(), "a"))
+        self.assertIsNotNone(self.cache.get(mock.Mock(), "c"))
+
+    def test_not_ready_without_plans(self):
+        self.assertIsNone(self.cache.ready())
@@ -0,0 +1,39 @@
+import os
+from unittest import mock
+
+from django_migrant import preflight
+from tests.testcases import GitRepoTestCase
+
+
+class TestPreflight(GitRepoTestCase):
+
+    def setUp(self):
+        super().setUp()
+        self.write("polls/migrations/0001_initial.py")
+        self.write("polls/models.py")
+        self.previous = self.commit()
+
+    def test_no_migrations_changed(self):
+        self.write("polls/models.py", "# A change.")
+        current = self.commit()
+        self.assertEqual(preflight.main([self.previous, current]), 1)
+
+    def test_migrations_changed(self):
+        self.write("polls/migrations/0002_second.py")
+        current = self.commit()
+        self.assertEqual(preflight.main([self.previous, current]), 0)
+
+    def test_custom_pathspec(self):
+        self.write("polls/schema/0002_second.py")
+        current = self.commit()
+        self.assertEqual(preflight.main([self.previous, current]), 1)
+        args = [self.previous, current, "--pathspec", "polls/schema"]
+        self.assertEqual(preflight.main(args), 0)
+
+    def test_unknown_commit(self):
+        # Eg, the null sha passed to post-checkout after a clone.
+        self.assertEqual(preflight.main(["0" * 40, self.previous]), 0)
+
+    @mock.patch.dict(os.environ, {"DJANGO_MIGRANT_STAGE": "TWO"})
+    def test_migrant_stage(self):
+        self.assertEqual(preflight.main([self.previous, self.previous]), 0)
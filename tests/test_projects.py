@@ -0,0 +1,159 @@
+import os
+import subprocess
+import sys
+from io import StringIO
+from unittest import mock
+
+from django_migrant import git, projects
+from django_migrant.daemon import NO_DAEMON
+from tests.testcases import GitRepoTestCase
+
+
+def completed(returncode, stdout=""):
+    return subprocess.CompletedProcess([], returncode, stdout=stdout)
+
+
+class TestProjects(GitRepoTestCase):
+
+    def setUp(self):
+        super().setUp()
+        self.write("services/alpha/manage.py")
+        self.write("services/alpha/polls/migrations/0001_initial.py")
+        self.write("services/beta/manage.py")
+        self.write("services/beta/shop/migrations/0001_initial.py")
+        self.previous = self.commit()
+        self.alpha = projects.project("services/alpha=alpha.settings")
+        self.beta = projects.project("services/beta")
+
+    def test_project(self):
+        self.assertEqual(
+            self.alpha,
+            {
+                "name": "services-alpha",
+                "path": "services/alpha",
+                "settings": "alpha.settings",
+            },
+        )
+        self.assertEqual(projects.project(".")["name"], "root")
+
+    def test_discover(self):
+        os.chdir(self.root / "services")
+        self.assertEqual(
+            projects.discover(self.root), [self.alpha | {"settings": None}, self.beta]
+        )
+
+    def test_save_and_load(self):
+        self.assertEqual(projects.load(self.root), [])
+        projects.save(self.root, [self.alpha, self.beta])
+        os.chdir(self.root / "services" / "beta")
+        self.assertEqual(projects.load(self.root), [self.alpha, self.beta])
+
+    @mock.patch("django_migrant.projects.subprocess")
+    def test_only_changed_projects_migrate(self, mock_subprocess):
+        mock_run = mock_subprocess.run
+        self.write("services/alpha/polls/migrations/0002_second.py")
+        current = self.commit()
+        mock_run.side_effect = [
+            completed(NO_DAEMON),
+            completed(0, "  Applying polls.0002_second... OK\n"),
+        ]
+        stdout = StringIO()
+
+        status = projects.run_all(
+            [self.alpha, self.beta],
+            self.root,
+            "migrate",
+            self.previous,
+            current,
+            ["--fast"],
+            stdout=stdout,
+        )
+
+        self.assertEqual(status, 0)
+        daemon, migrate = mock_run.call_args_list
+        self.assertEqual(
+            daemon.args[0],
+            [sys.executable, "-m", "django_migrant.daemon", self.previous, current],
+        )
+        self.assertEqual(
+            migrate.args[0],
+            [
+                sys.executable,
+                "manage.py",
+                "migrant",
+                "migrate",
+                "--no-checkout",
+                "--fast",
+                self.previous,
+                current,
+            ],
+        )
+        self.assertEqual(migrate.kwargs["cwd"], self.root / "services" / "alpha")
+        env = migrate.kwargs["env"]
+        self.assertEqual(env[git.PROJECT_ENV], "services-alpha")
+        self.assertEqual(env["DJANGO_SETTINGS_MODULE"], "alpha.settings")
+        self.assertEqual(
+            stdout.getvalue(),
+            "Project 'services-alpha':\n  Applying polls.0002_second... OK\n",
+        )
+
+    @mock.patch("django_migrant.projects.subprocess")
+    def test_failures_reported(self, mock_subprocess):
+        mock_run = mock_subprocess.run
+        self.write("services/alpha/polls/migrations/0002_second.py")
+        self.write("services/beta/shop/migrations/0002_second.py")
+        current = self.commit()
+
+        def run(args, cwd, **kwargs):
+            if "daemon" in args:
+                return completed(NO_DAEMON)
+            if cwd.name == "alpha":
+                return completed(1, "CommandError: Migrating failed\n")
+            return completed(0, "  Applying shop.0002_second... OK\n")
+
+        mock_run.side_effect = run
+        stdout = StringIO()
+
+        status = projects.run_all(
+            [self.alpha, self.beta],
+            self.root,
+            "migrate",
+            self.previous,
+            current,
+            stdout=stdout,
+        )
+
+        # Every project is migrated, even though one failed.
+        self.assertEqual(status, 1)
+        output = stdout.getvalue()
+        self.assertIn("Applying shop.0002_second... OK", output)
+        self.assertIn(
+            "run 'DJANGO_MIGRANT_PROJECT=services-alpha ./manage.py migrant resume' "
+            "in services/alpha",
+            output,
+        )
+
+    @mock.patch("django_migrant.projects.migrations_changed")
+    @mock.patch("django_migrant.projects.subprocess")
+    def test_exception_reported(self, mock_subprocess, mock_migrations_changed):
+        def migrations_changed(previous, current, pathspecs):
+            if "alpha" in pathspecs[0]:
+                raise subprocess.CalledProcessError(128, ["git", "diff"])
+            return True
+
+        mock_migrations_changed.side_effect = migrations_changed
+        mock_subprocess.run.side_effect = [
+            completed(NO_DAEMON),
+            completed(0, "  Applying shop.0002_second... OK\n"),
+        ]
+        stdout = StringIO()
+
+        status = projects.run_all(
+            [self.alpha, self.beta], self.root, "migrate", "a", "b", stdout=stdout
+        )
+
+        self.assertEqual(status, 1)
+        output = stdout.getvalue()
+        self.assertIn("Project 'services-alpha':\nTraceback", output)
+        self.assertIn("CalledProcessError", output)
+        self.assertIn("Applying shop.0002_second... OK", output)
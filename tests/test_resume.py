@@ -0,0 +1,71 @@
+import unittest
+from unittest import mock
+
+from django.core.management.base import CommandError
+
+from django_migrant.management.commands import migrant
+
+TRANSITION = {"id": "abc", "previous": "a" * 40, "current": "b" * 40}
+
+
+@mock.patch("django_migrant.management.commands.migrant.stage_three")
+@mock.patch("django_migrant.management.commands.migrant.rollback")
+@mock.patch("django_migrant.management.commands.migrant.GitMigrationLoader")
+@mock.patch("django_migrant.management.commands.migrant.subprocess")
+@mock.patch("django_migrant.management.commands.migrant.git")
+class TestResume(unittest.TestCase):
+
+    def setUp(self):
+        self.journal = mock.Mock()
+        self.journal.remaining.return_value = {"default": [("polls", "0002_extra")]}
+
+    def test_after_stage_three(
+        self, mock_git, mock_subprocess, mock_loader, mock_rollback, mock_stage_three
+    ):
+        mock_git.resolve.return_value = TRANSITION["current"]
+
+        migrant.resume(TRANSITION, self.journal)
+
+        # What's left is rolled back with the previous commit's migrations.
+        self.assertEqual(mock_loader.call_args.args[1], TRANSITION["previous"])
+        self.assertEqual(mock_rollback.call_args.args[2], [("polls", "0002_extra")])
+        mock_subprocess.run.assert_not_called()
+        mock_stage_three.assert_called_once()
+
+    def test_nothing_to_roll_back(
+        self, mock_git, mock_subprocess, mock_loader, mock_rollback, mock_stage_three
+    ):
+        # Eg, a migration failed in stage three.
+        mock_git.resolve.return_value = TRANSITION["current"]
+        self.journal.remaining.return_value = {}
+
+        migrant.resume(TRANSITION, self.journal)
+
+        mock_rollback.assert_not_called()
+        self.assertNotIn(mock.call(migrant.FAILED), self.journal.finish.call_args_list)
+        mock_stage_three.assert_called_once()
+
+    def test_after_stage_two(
+        self, mock_git, mock_subprocess, mock_loader, mock_rollback, mock_stage_three
+    ):
+        mock_git.resolve.return_value = TRANSITION["previous"]
+
+        migrant.resume(TRANSITION, self.journal)
+
+        # Still on the previous branch, so go back and migrate forwards there.
+        mock_rollback.assert_called_once()
+        env = mock_subprocess.run.call_args.kwargs["env"]
+        self.assertEqual(env["DJANGO_MIGRANT_STAGE"], "THREE")
+        self.assertEqual(env["DJANGO_MIGRANT_TRANSITION"], "abc")
+        mock_stage_three.assert_not_called()
+
+    def test_head_moved(
+        self, mock_git, mock_subprocess, mock_loader, mock_rollback, mock_stage_three
+    ):
+        mock_git.resolve.return_value = "c" * 40
+
+        with self.assertRaises(CommandError):
+            migrant.resume(TRANSITION, self.journal)
+
+        mock_rollback.assert_not_called()
+        mock_stage_three.assert_not_called()
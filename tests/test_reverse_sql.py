@@ -0,0 +1,209 @@
+import json
+from io import StringIO
+from pathlib import Path
+from unittest import mock
+
+from django.db import migrations, models
+from django.db.migrations.operations.base import Operation
+
+from django_migrant.loader import blob_hash
+from django_migrant.reverse_sql import ReverseSQLStore, unreplayable
+from tests.testcases import DjangoSetupTestCase, GitRepoTestCase
+
+
+def forwards(apps, schema_editor):
+    pass
+
+
+class TestUnreplayable(DjangoSetupTestCase):
+
+    def test_schema_operation(self):
+        operation = migrations.AddField("question", "votes", models.IntegerField())
+        self.assertIsNone(unreplayable(operation))
+
+    def test_run_python(self):
+        operation = migrations.RunPython(forwards, forwards)
+        self.assertEqual(unreplayable(operation), "RunPython")
+
+    def test_run_python_noop(self):
+        operation = migrations.RunPython(forwards, migrations.RunPython.noop)
+        self.assertIsNone(unreplayable(operation))
+
+    def test_irreversible(self):
+        operation = migrations.RunSQL("SELECT 1")
+        self.assertEqual(unreplayable(operation), "RunSQL is irreversible")
+
+    def test_separate_database_and_state(self):
+        operation = migrations.SeparateDatabaseAndState(
+            database_operations=[migrations.RunPython(forwards, forwards)]
+        )
+        self.assertEqual(unreplayable(operation), "RunPython")
+
+    def test_custom_operation(self):
+        class Custom(Operation):
+            pass
+
+        self.assertEqual(unreplayable(Custom()), "Custom is a custom operation")
+
+
+class TestReverseSQLStore(GitRepoTestCase):
+
+    def setUp(self):
+        super().setUp()
+        self.store = ReverseSQLStore(self.root / ".git" / "migrant" / "reverse-sql")
+        self.connection = mock.MagicMock(vendor="sqlite")
+        patcher = mock.patch(
+            "django_migrant.reverse_sql.migrations_path",
+            return_value=self.root / "polls" / "migrations",
+        )
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
+    def add(self, name, content, dependencies=(), reason=None):
+        self.write(f"polls/migrations/{name}.py", content)
+        location = self.store.location(
+            self.connection, "polls", name, blob_hash(content.encode())
+        )
+        location.parent.mkdir(parents=True, exist_ok=True)
+        entry = {
+            "app_label": "polls",
+            "name": name,
+            "dependencies": [list(d) for d in dependencies],
+            "run_before": [],
+            "reason": reason,
+        }
+        location.write_text(json.dumps(entry))
+
+    def test_find_in_dependency_order(self):
+        self.add("0001_initial", "# 1")
+        self.add("0002_second", "# 2", [("polls", "0001_initial")])
+        self.add("0003_third", "# 3", [("polls", "0002_second")])
+        previous = self.commit()
+
+        entries = self.store.find(
+            self.connection,
+            previous,
+            {("polls", "0002_second"), ("polls", "0003_third")},
+            stdout=StringIO(),
+        )
+
+        self.assertEqual(
+            [entry["name"] for entry in entries], ["0003_third", "0002_second"]
+        )
+
+    def test_find_missing(self):
+        self.add("0001_initial", "# 1")
+        self.write("polls/migrations/0002_second.py", "# not recorded")
+        previous = self.commit()
+
+        entries = self.store.find(
+            self.connection, previous, {("polls", "0002_second")}, stdout=StringIO()
+        )
+
+        self.assertIsNone(entries)
+
+    def test_find_changed(self):
+        self.add("0001_initial", "# 1")
+        self.commit()
+        # The file's changed since the SQL was recorded.
+        self.write("polls/migrations/0001_initial.py", "# 1, changed")
+        previous = self.commit()
+
+        entries = self.store.find(
+            self.connection, previous, {("polls", "0001_initial")}, stdout=StringIO()
+        )
+
+        self.assertIsNone(entries)
+
+    def test_find_unreplayable(self):
+        self.add("0001_initial", "# 1", reason="RunPython")
+        previous = self.commit()
+        stdout = StringIO()
+
+        entries = self.store.find(
+            self.connection, previous, {("polls", "0001_initial")}, stdout=stdout
+        )
+
+        self.assertIsNone(entries)
+        self.assertIn("RunPython", stdout.getvalue())
+
+    def test_record(self):
+        class Migration(migrations.Migration):
+            operations = [
+                migrations.AddField("question", "votes", models.IntegerField())
+            ]
+
+            def unapply(self, state, schema_editor, collect_sql):
+                schema_editor.collected_sql.extend(
+                    ["--", "-- Remove field", 'ALTER TABLE "polls_question" DROP;']
+                )
+
+        migration = Migration("0002_second", "polls")
+        schema_editor = self.connection.schema_editor.return_value.__enter__()
+        schema_editor.collected_sql = []
+
+        self.assertTrue(self.store.needs(self.connection, migration))
+        self.store.record(self.connection, mock.Mock(), migration)
+        self.assertFalse(self.store.needs(self.connection, migration))
+
+        # Keyed by the file the migration came from, which is this one.
+        sha = blob_hash(Path(__file__).read_bytes())
+        entry = self.store.get(self.connection, "polls", "0002_second", sha)
+        self.assertEqual(entry["sql"], ['ALTER TABLE "polls_question" DROP;'])
+        self.assertIsNone(entry["reason"])
+
+    def test_replay(self):
+        entries = [
+            {
+                "app_label": "polls",
+                "name": "0002_second",
+                "atomic": True,
+                "replaces": [],
+                "sql": ["DROP 2;"],
+            },
+            {
+                "app_label": "polls",
+                "name": "0001_initial",
+                "atomic": True,
+                "replaces": [],
+                "sql": ["DROP 1;"],
+            },
+        ]
+        schema_editor = self.connection.schema_editor.return_value.__enter__()
+
+        with mock.patch("django_migrant.reverse_sql.MigrationRecorder") as recorder:
+            self.store.replay(self.connection, entries, stdout=mock.Mock())
+
+        self.connection.schema_editor.assert_called_once_with(atomic=True)
+        self.assertEqual(
+            schema_editor.execute.call_args_list,
+            [mock.call("DROP 2;", params=None), mock.call("DROP 1;", params=None)],
+        )
+        self.assertEqual(
+            recorder.return_value.record_unapplied.call_args_list,
+            [mock.call("polls", "0002_second"), mock.call("polls", "0001_initial")],
+        )
+
+    def test_replay_squashed(self):
+        entries = [
+            {
+                "app_label": "polls",
+                "name": "0001_squashed_0002_second",
+                "atomic": True,
+                "replaces": [["polls", "0001_initial"], ["polls", "0002_second"]],
+                "sql": ["DROP 2;", "DROP 1;"],
+            },
+        ]
+
+        with mock.patch("django_migrant.reverse_sql.MigrationRecorder") as recorder:
+            self.store.replay(self.connection, entries, stdout=mock.Mock())
+
+        # The replaced migrations and the squashed migration itself.
+        self.assertEqual(
+            recorder.return_value.record_unapplied.call_args_list,
+            [
+                mock.call("polls", "0001_initial"),
+                mock.call("polls", "0002_second"),
+                mock.call("polls", "0001_squashed_0002_second"),
+            ],
+        )
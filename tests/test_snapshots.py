@@ -0,0 +1,172 @@
+import sqlite3
+import unittest
+from contextlib import closing
+from pathlib import Path
+from tempfile import TemporaryDirectory
+from unittest import mock
+
+from django.db import DatabaseError
+from django.db.utils import ConnectionHandler
+
+from django_migrant.snapshots import (
+    PostgresBackend,
+    SnapshotCache,
+    SqliteBackend,
+    fingerprint,
+)
+from tests.testcases import DjangoSetupTestCase
+
+
+class TestFingerprint(DjangoSetupTestCase):
+
+    def test_order_does_not_matter(self):
+        connection = mock.Mock(settings_dict={"NAME": "db.sqlite3"})
+        loader = mock.Mock(replacements={})
+        a = fingerprint(connection, loader, [("polls", "0001"), ("polls", "0002")])
+        b = fingerprint(connection, loader, [("polls", "0002"), ("polls", "0001")])
+        self.assertEqual(a, b)
+
+    def test_squashed_migrations_expanded(self):
+        connection = mock.Mock(settings_dict={"NAME": "db.sqlite3"})
+        squashed = mock.Mock(replaces=[("polls", "0001"), ("polls", "0002")])
+        loader = mock.Mock(replacements={("polls", "0001_squashed_0002"): squashed})
+        a = fingerprint(connection, loader, [("polls", "0001_squashed_0002")])
+        b = fingerprint(connection, loader, [("polls", "0001"), ("polls", "0002")])
+        self.assertEqual(a, b)
+
+    def test_database_name_included(self):
+        loader = mock.Mock(replacements={})
+        a = fingerprint(mock.Mock(settings_dict={"NAME": "a"}), loader, [])
+        b = fingerprint(mock.Mock(settings_dict={"NAME": "b"}), loader, [])
+        self.assertNotEqual(a, b)
+
+
+class TestSnapshotCache(DjangoSetupTestCase):
+
+    def setUp(self):
+        super().setUp()
+        self.temp_dir = TemporaryDirectory()
+        self.path = Path(self.temp_dir.name)
+        self.backend = mock.Mock()
+        self.backend.location.side_effect = lambda connection, key: key
+        self.backend.create.return_value = 10
+        self.connection = mock.Mock(alias="default")
+
+    def tearDown(self):
+        self.temp_dir.cleanup()
+        super().tearDown()
+
+    def get_cache(self, budget):
+        cache = SnapshotCache(self.path, budget=budget)
+        cache.backend = mock.Mock(return_value=self.backend)
+        return cache
+
+    @mock.patch("django_migrant.snapshots.connections")
+    def test_restore_miss(self, mock_connections):
+        cache = self.get_cache(budget=100)
+        self.assertFalse(cache.restore(self.connection, "a"))
+        self.backend.restore.assert_not_called()
+
+    @mock.patch("django_migrant.snapshots.connections")
+    def test_save_and_restore(self, mock_connections):
+        cache = self.get_cache(budget=100)
+        cache.save(self.connection, "a")
+        self.assertTrue(cache.restore(self.connection, "a"))
+        self.backend.restore.assert_called_once_with(self.connection, "a")
+
+    @mock.patch("django_migrant.snapshots.connections")
+    def test_least_recently_used_evicted(self, mock_connections):
+        mock_connections.__getitem__.return_value = self.connection
+        cache = self.get_cache(budget=25)
+        cache.save(self.connection, "a")
+        cache.save(self.connection, "b")
+        # Using "a" makes "b" the least recently used.
+        cache.restore(self.connection, "a")
+        cache.save(self.connection, "c")
+
+        self.backend.delete.assert_called_once_with(self.connection, "b")
+        self.assertEqual(set(cache.load_index()), {"a", "c"})
+
+
+class TestSqliteBackend(DjangoSetupTestCase):
+
+    def test_create_and_restore(self):
+        with TemporaryDirectory() as temp_dir_name:
+            path = Path(temp_dir_name)
+            database = path / "db.sqlite3"
+            connection = ConnectionHandler(
+                {
+                    "default": {
+                        "ENGINE": "django.db.backends.sqlite3",
+                        "NAME": str(database),
+                    }
+                }
+            )["default"]
+            with connection.cursor() as cursor:
+                cursor.execute("PRAGMA journal_mode=WAL")
+                cursor.execute("CREATE TABLE question (id INTEGER PRIMARY KEY)")
+                cursor.execute("INSERT INTO question VALUES (1)")
+            # Another connection, eg runserver, keeps the log from being removed.
+            other = sqlite3.connect(database)
+            other.execute("SELECT * FROM question").fetchall()
+            backend = SqliteBackend(path)
+            location = backend.location(connection, "abc")
+
+            backend.create(connection, location)
+            with connection.cursor() as cursor:
+                cursor.execute("INSERT INTO question VALUES (2)")
+            # A log left behind by the database as it is now, eg after a crash.
+            stale = Path(f"{database}-wal").read_bytes()
+            other.close()
+            connection.close()
+            Path(f"{database}-wal").write_bytes(stale)
+            backend.restore(connection, location)
+
+            with closing(sqlite3.connect(location)) as snapshot:
+                rows = snapshot.execute("SELECT id FROM question").fetchall()
+            # The snapshot has the row that was only in the log.
+            self.assertEqual(rows, [(1,)])
+            with connection.cursor() as cursor:
+                cursor.execute("SELECT id FROM question")
+                self.assertEqual(cursor.fetchall(), [(1,)])
+            connection.close()
+
+
+class TestPostgresBackend(unittest.TestCase):
+
+    def setUp(self):
+        self.connection = mock.MagicMock(settings_dict={"NAME": "db"})
+        self.connection.ops.quote_name.side_effect = lambda name: f'"{name}"'
+        self.cursor = self.connection._nodb_cursor.return_value.__enter__.return_value
+
+    def statements(self):
+        return [call.args[0] for call in self.cursor.execute.call_args_list]
+
+    def test_restore(self):
+        PostgresBackend().restore(self.connection, "db_migrant_abc")
+
+        self.assertEqual(
+            self.statements(),
+            [
+                'DROP DATABASE IF EXISTS "db_migrant_restoring"',
+                'CREATE DATABASE "db_migrant_restoring" TEMPLATE "db_migrant_abc"',
+                'DROP DATABASE IF EXISTS "db"',
+                'ALTER DATABASE "db_migrant_restoring" RENAME TO "db"',
+            ],
+        )
+
+    def test_restore_clone_fails(self):
+        def execute(sql):
+            if sql.startswith("CREATE"):
+                raise DatabaseError("source database is being accessed")
+
+        self.cursor.execute.side_effect = execute
+
+        with self.assertRaises(DatabaseError):
+            PostgresBackend().restore(self.connection, "db_migrant_abc")
+
+        # The database is left alone, and the clone cleaned up.
+        self.assertNotIn('DROP DATABASE IF EXISTS "db"', self.statements())
+        self.assertEqual(
+            self.statements()[-1], 'DROP DATABASE IF EXISTS "db_migrant_restoring"'
+        )
@@ -0,0 +1,84 @@
+import unittest
+
+from django.db import migrations, models
+
+from django_migrant.squashing import Segment, segments, squashable
+
+
+def migration(app_label, name, *operations, **attrs):
+    migration = migrations.Migration(name, app_label)
+    migration.operations = list(operations)
+    for attr, value in attrs.items():
+        setattr(migration, attr, value)
+    return migration
+
+
+def alter(max_length, name="text"):
+    return migrations.AlterField(
+        "question", name, models.CharField(max_length=max_length)
+    )
+
+
+class TestSquashable(unittest.TestCase):
+
+    def test_squashable(self):
+        self.assertTrue(squashable(migration("polls", "0002", alter(200))))
+
+    def test_code(self):
+        run_python = migrations.RunPython(migrations.RunPython.noop)
+        self.assertFalse(squashable(migration("polls", "0002", run_python)))
+        run_sql = migrations.SeparateDatabaseAndState(
+            database_operations=[migrations.RunSQL("SELECT 1")]
+        )
+        self.assertFalse(squashable(migration("polls", "0002", run_sql)))
+
+    def test_not_atomic(self):
+        self.assertFalse(squashable(migration("polls", "0002", atomic=False)))
+
+    def test_squashed(self):
+        replaces = [("polls", "0002"), ("polls", "0003")]
+        self.assertFalse(squashable(migration("polls", "0002_3", replaces=replaces)))
+
+
+class TestSegments(unittest.TestCase):
+
+    def test_stretches(self):
+        add = migrations.AddField("question", "score", models.IntegerField(default=0))
+        remove = migrations.RemoveField("question", "score")
+        polls = [
+            migration("polls", "0002", alter(200)),
+            migration("polls", "0003", add),
+            migration("polls", "0004", alter(300, "score"), remove),
+        ]
+        books = [
+            migration("books", "0002", add),
+            migration("books", "0003", alter(300, "score")),
+        ]
+        run_python = migrations.RunPython(migrations.RunPython.noop)
+        code = migration("polls", "0005", run_python)
+        # Optimizing these doesn't make them any shorter.
+        unchanged = [
+            migration("polls", "0006", alter(200)),
+            migration("polls", "0007", alter(200, "title")),
+        ]
+
+        squashed = segments([*polls, *books, code, *unchanged])
+
+        self.assertEqual(set(squashed), {*polls, *books})
+        segment = squashed[polls[0]]
+        self.assertIsInstance(segment, Segment)
+        self.assertEqual(segment.migrations, polls)
+        self.assertEqual(len(segment.operations), 1)
+        self.assertEqual(
+            segment.replaces,
+            [("polls", "0002"), ("polls", "0003"), ("polls", "0004")],
+        )
+        self.assertEqual(str(segment), "polls.0002..0004 (4 operations as 1)")
+        self.assertEqual(squashed[books[1]].migrations, books)
+
+    def test_custom_squashable(self):
+        polls = [
+            migration("polls", "0002", migrations.AddField("question", "score", None)),
+            migration("polls", "0003", migrations.RemoveField("question", "score")),
+        ]
+        self.assertEqual(segments(polls, lambda migration: False), {})
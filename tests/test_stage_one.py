@@ -1,15 +1,24 @@
+import subprocess
 from unittest import mock
 
+from django.core.management.base import CommandError
+
 from django_migrant.management.commands import migrant
 from tests.testcases import DjangoSetupTestCase
 
 
 class TestStageOne(DjangoSetupTestCase):
 
+    def setUp(self):
+        super().setUp()
+        patcher = mock.patch("django_migrant.management.commands.migrant.Journal")
+        self.journal = patcher.start().return_value
+        self.addCleanup(patcher.stop)
+
     @mock.patch("django_migrant.management.commands.migrant.subprocess", mock.MagicMock())
     @mock.patch("django_migrant.management.commands.migrant.Path", mock.MagicMock())
     @mock.patch("django_migrant.management.commands.migrant.MigrationLoader")
-    def test_file_written(self, mock_loader):
+    def test_rollback_planned(self, mock_loader):
         mock_loader.return_value.applied_migrations = [
             ("polls", "0002_alter_question_question_text"),
             ("polls", "0001_initial"),
@@ -19,22 +28,21 @@ class TestStageOne(DjangoSetupTestCase):
             ("polls", "0001_initial"),
         ]
 
-        with mock.patch("builtins.open", mock.mock_open()) as mock_open:
-            migrant.stage_one()
-        handle = mock_open()
-        handle.write.assert_called_once_with(
-            '[["polls", "0002_alter_question_question_text"]]'
+        migrant.stage_one()
+
+        self.journal.begin.assert_called_once()
+        self.journal.plan.assert_called_once_with(
+            "default", "unapply", [("polls", "0002_alter_question_question_text")]
         )
 
     @mock.patch("django_migrant.management.commands.migrant.Path", mock.MagicMock())
-    @mock.patch(
-        "django_migrant.management.commands.migrant.MigrationLoader", mock.MagicMock()
-    )
+    @mock.patch("django_migrant.management.commands.migrant.MigrationLoader")
     @mock.patch("django_migrant.management.commands.migrant.subprocess")
-    def test_subprocess_called(self, mock_subprocess):
+    def test_subprocess_called(self, mock_subprocess, mock_loader):
+        mock_loader.return_value.applied_migrations = [("polls", "0002_extra")]
+        mock_loader.return_value.disk_migrations = []
 
-        with mock.patch("builtins.open", mock.mock_open()):
-            migrant.stage_one()
+        migrant.stage_one()
 
         # Subprocess was called.
         mock_subprocess.run.assert_called_once()
@@ -50,3 +58,129 @@ class TestStageOne(DjangoSetupTestCase):
         self.assertTrue("env" in second_arg)
         self.assertTrue("DJANGO_MIGRANT_STAGE" in second_arg["env"])
         self.assertEqual(second_arg["env"]["DJANGO_MIGRANT_STAGE"], "TWO")
+
+    @mock.patch("django_migrant.management.commands.migrant.stage_three")
+    @mock.patch("django_migrant.management.commands.migrant.subprocess")
+    @mock.patch("django_migrant.management.commands.migrant.rollback")
+    @mock.patch("django_migrant.management.commands.migrant.GitMigrationLoader")
+    @mock.patch("django_migrant.management.commands.migrant.MigrationLoader")
+    def test_no_checkout(
+        self,
+        mock_loader,
+        mock_git_loader,
+        mock_rollback,
+        mock_subprocess,
+        mock_stage_three,
+    ):
+        mock_loader.return_value.applied_migrations = [("polls", "0002_extra")]
+        mock_loader.return_value.disk_migrations = []
+
+        migrant.stage_one("abc123", checkout=False)
+
+        # Migrations are read from the previous commit, not checked out.
+        mock_git_loader.assert_called_once()
+        self.assertEqual(mock_git_loader.call_args.args[1], "abc123")
+        mock_rollback.assert_called_once()
+        self.assertEqual(mock_rollback.call_args.args[2], {("polls", "0002_extra")})
+        mock_subprocess.run.assert_not_called()
+        mock_stage_three.assert_called_once()
+
+    @mock.patch("django_migrant.management.commands.migrant.subprocess")
+    @mock.patch("django_migrant.management.commands.migrant.MigrationLoader")
+    def test_snapshot_restored(self, mock_loader, mock_subprocess):
+        mock_loader.return_value.applied_migrations = [("polls", "0002_extra")]
+        mock_loader.return_value.disk_migrations = []
+        mock_loader.return_value.graph.nodes = []
+        mock_loader.return_value.replacements = {}
+        snapshots = mock.Mock()
+        snapshots.restore.return_value = True
+
+        with mock.patch("sys.stdout"):
+            migrant.stage_one(snapshots=snapshots)
+
+        # The state being left is saved, and the one arrived at restored.
+        snapshots.save.assert_called_once()
+        snapshots.restore.assert_called_once()
+        self.assertNotEqual(
+            snapshots.save.call_args.args[1], snapshots.restore.call_args.args[1]
+        )
+        mock_subprocess.run.assert_not_called()
+
+    @mock.patch("django_migrant.management.commands.migrant.stage_three")
+    @mock.patch("django_migrant.management.commands.migrant.subprocess")
+    @mock.patch("django_migrant.management.commands.migrant.MigrationLoader")
+    def test_reverse_sql_replayed(self, mock_loader, mock_subprocess, mock_stage_three):
+        mock_loader.return_value.applied_migrations = [("polls", "0002_extra")]
+        mock_loader.return_value.disk_migrations = []
+        reverse_sql = mock.Mock()
+        reverse_sql.find.return_value = [{"app_label": "polls", "name": "0002_extra"}]
+
+        migrant.stage_one("abc123", reverse_sql=reverse_sql)
+
+        # The recorded SQL is replayed instead of checking out.
+        self.assertEqual(
+            reverse_sql.find.call_args.args[1:3], ("abc123", {("polls", "0002_extra")})
+        )
+        reverse_sql.replay.assert_called_once()
+        mock_subprocess.run.assert_not_called()
+        mock_stage_three.assert_called_once()
+
+    @mock.patch("django_migrant.management.commands.migrant.Path", mock.MagicMock())
+    @mock.patch("django_migrant.management.commands.migrant.stage_three")
+    @mock.patch("django_migrant.management.commands.migrant.subprocess")
+    @mock.patch("django_migrant.management.commands.migrant.MigrationLoader")
+    def test_reverse_sql_missing(self, mock_loader, mock_subprocess, mock_stage_three):
+        mock_loader.return_value.applied_migrations = [("polls", "0002_extra")]
+        mock_loader.return_value.disk_migrations = []
+        reverse_sql = mock.Mock()
+        reverse_sql.find.return_value = None
+
+        migrant.stage_one("abc123", reverse_sql=reverse_sql)
+
+        # Falls back to checking out the previous branch.
+        reverse_sql.replay.assert_not_called()
+        mock_subprocess.run.assert_called_once()
+        mock_stage_three.assert_not_called()
+
+    @mock.patch("django_migrant.management.commands.migrant.stage_three")
+    @mock.patch("django_migrant.management.commands.migrant.subprocess")
+    @mock.patch("django_migrant.management.commands.migrant.MigrationLoader")
+    def test_nothing_to_roll_back(self, mock_loader, mock_subprocess, mock_stage_three):
+        mock_loader.return_value.applied_migrations = [("polls", "0001_initial")]
+        mock_loader.return_value.disk_migrations = [("polls", "0001_initial")]
+
+        migrant.stage_one()
+
+        # There's no need for the previous branch, so just migrate forwards.
+        mock_subprocess.run.assert_not_called()
+        mock_stage_three.assert_called_once()
+        self.assertEqual(mock_stage_three.call_args.kwargs["aliases"], ["default"])
+
+    @mock.patch("django_migrant.management.commands.migrant.subprocess", mock.MagicMock())
+    @mock.patch("django_migrant.management.commands.migrant.MigrationLoader")
+    def test_plan_ready(self, mock_loader):
+        plans = mock.Mock()
+        plans.ready.return_value = "abc123"
+        plans.get.return_value = {"unapply": [["polls", "0002_extra"]]}
+
+        migrant.stage_one(plans=plans)
+
+        # The plan made ahead of time is used, rather than loading migrations.
+        mock_loader.assert_not_called()
+        plans.get.assert_called_once_with(mock.ANY, "abc123")
+        self.journal.plan.assert_called_once_with(
+            "default", "unapply", [("polls", "0002_extra")]
+        )
+
+    @mock.patch("django_migrant.management.commands.migrant.subprocess")
+    @mock.patch("django_migrant.management.commands.migrant.MigrationLoader")
+    def test_stage_two_failed(self, mock_loader, mock_subprocess):
+        mock_loader.return_value.applied_migrations = [("polls", "0002_extra")]
+        mock_loader.return_value.disk_migrations = []
+        mock_subprocess.CalledProcessError = subprocess.CalledProcessError
+        mock_subprocess.run.side_effect = subprocess.CalledProcessError(1, "git")
+
+        with self.assertRaisesMessage(CommandError, "migrant resume"):
+            migrant.stage_one()
+
+        self.journal.finish.assert_called_once_with(migrant.FAILED)
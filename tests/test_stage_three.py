@@ -6,11 +6,20 @@ from django_migrant.management.commands import migrant
 
 class TestStageThree(unittest.TestCase):
 
-    @mock.patch("django_migrant.management.commands.migrant.call_command")
-    def test_command_called(self, mock_call_command):
+    def setUp(self):
+        patcher = mock.patch("django_migrant.management.commands.migrant.Journal")
+        self.journal = patcher.start().return_value
+        self.addCleanup(patcher.stop)
+
+    @mock.patch("django_migrant.management.commands.migrant.MigrationLoader")
+    @mock.patch("django_migrant.management.commands.migrant.migrate_forwards")
+    def test_migrate_forwards_called(self, mock_migrate_forwards, mock_loader):
 
         migrant.stage_three()
 
-        mock_call_command.assert_called_once()
-        self.assertTrue(len(mock_call_command.call_args_list), 1)
-        self.assertEqual(mock_call_command.call_args.args, ("migrate",))
+        mock_migrate_forwards.assert_called_once()
+        self.assertEqual(
+            mock_migrate_forwards.call_args.args[1], mock_loader.return_value
+        )
+        # The transition is over.
+        self.journal.finish.assert_called_once_with()
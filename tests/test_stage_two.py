@@ -1,101 +1,115 @@
-import json
 import unittest
 from unittest import mock
 
-from django.db.migrations.graph import Node
+from django.db.migrations.graph import MigrationGraph
 
 from django_migrant.management.commands import migrant
 
 
+def graph(*chains):
+    """Returns a graph of the given chains of keys, each key's value the key."""
+    graph = MigrationGraph()
+    for chain in chains:
+        for parent, key in zip((None, *chain), chain):
+            graph.add_node(key, key)
+            if parent:
+                graph.add_dependency(key, key, parent)
+    return graph
+
+
 class TestStageTwo(unittest.TestCase):
 
+    def setUp(self):
+        patcher = mock.patch("django_migrant.management.commands.migrant.Journal")
+        self.journal = patcher.start().return_value
+        self.addCleanup(patcher.stop)
+
     @mock.patch("django_migrant.management.commands.migrant.subprocess", mock.MagicMock())
     @mock.patch("django_migrant.management.commands.migrant.Path", mock.MagicMock())
-    @mock.patch("django_migrant.management.commands.migrant.call_command")
+    @mock.patch("django_migrant.executor.MigrantExecutor")
     @mock.patch("django_migrant.management.commands.migrant.MigrationLoader")
-    def test_migrate_to_zero(self, mock_loader, mock_call_command):
-        # The give node 0001_initial has no parent, so we migrate to the
-        # "zero" migration of that app.
-        n1 = Node(("polls", "0001_initial"))
-        mock_loader.return_value.graph.node_map = {n1.key: n1}
-        file_contents = json.dumps(
-            [
-                ["polls", "0001_initial"],
-            ]
-        )
-        with mock.patch(
-            "builtins.open", mock.mock_open(read_data=file_contents)
-        ) as mock_open:
-            migrant.stage_two()
-        handle = mock_open()
-        handle.read.assert_called_once()
+    def test_migrate_to_zero(self, mock_loader, mock_executor):
+        # The given node 0001_initial has no parent, so it's all that's unapplied.
+        n1 = ("polls", "0001_initial")
+        mock_loader.return_value.graph = graph([n1])
+        mock_loader.return_value.applied_migrations = {n1: n1}
+        self.journal.remaining.return_value = {"default": [n1]}
+        migrant.stage_two()
+        self.journal.remaining.assert_called_once_with("unapply")
 
-        mock_call_command.assert_called_once()
-        self.assertTrue(len(mock_call_command.call_args_list), 1)
-        self.assertEqual(mock_call_command.call_args.args, ("migrate", "polls", "zero"))
+        executor = mock_executor.return_value
+        executor.run.assert_called_once_with([n1], [(n1, True)])
 
     @mock.patch("django_migrant.management.commands.migrant.subprocess", mock.MagicMock())
     @mock.patch("django_migrant.management.commands.migrant.Path", mock.MagicMock())
-    @mock.patch("django_migrant.management.commands.migrant.call_command")
+    @mock.patch("django_migrant.executor.MigrantExecutor")
     @mock.patch("django_migrant.management.commands.migrant.MigrationLoader")
-    def test_migrate_to_parent(self, mock_loader, mock_call_command):
-        # To reverse 0002 we migrate to 0001.
-
-        n1 = Node(("polls", "0001_initial"))
-        n2 = Node(("polls", "0002_alter_question_question_text"))
-        n2.add_parent(n1)
-        mock_loader.return_value.graph.node_map = {n1.key: n1, n2.key: n2}
-        file_contents = json.dumps([["polls", "0002_alter_question_question_text"]])
-        with mock.patch(
-            "builtins.open", mock.mock_open(read_data=file_contents)
-        ) as mock_open:
-            migrant.stage_two()
-        handle = mock_open()
-        handle.read.assert_called_once()
-
-        mock_call_command.assert_called_once()
-        self.assertTrue(len(mock_call_command.call_args_list), 1)
-        self.assertEqual(
-            mock_call_command.call_args.args, ("migrate", "polls", "0001_initial")
-        )
+    def test_migrate_to_parent(self, mock_loader, mock_executor):
+        # To reverse 0002 we unapply it, and only it.
+        n1 = ("polls", "0001_initial")
+        n2 = ("polls", "0002_alter_question_question_text")
+        mock_loader.return_value.graph = graph([n1, n2])
+        mock_loader.return_value.applied_migrations = {n1: n1, n2: n2}
+        self.journal.remaining.return_value = {"default": [n2]}
+        migrant.stage_two()
+
+        executor = mock_executor.return_value
+        executor.run.assert_called_once_with([n2], [(n2, True)])
 
     @mock.patch("django_migrant.management.commands.migrant.subprocess", mock.MagicMock())
     @mock.patch("django_migrant.management.commands.migrant.Path", mock.MagicMock())
-    @mock.patch("django_migrant.management.commands.migrant.call_command")
+    @mock.patch("django_migrant.executor.MigrantExecutor")
     @mock.patch("django_migrant.management.commands.migrant.MigrationLoader")
-    def test_migrate_to_single_ancestor(self, mock_loader, mock_call_command):
+    def test_migrate_to_single_ancestor(self, mock_loader, mock_executor):
         # The provided file gives a list of migrations in the same app. Make sure
-        # we only migrate to one of them.
-
-        n1 = Node(("polls", "0001_initial"))
-        n2 = Node(("polls", "0002_alter_question_question_text"))
-        n2.add_parent(n1)
-        n3 = Node(("polls", "0003_alter_title"))
-        n3.add_parent(n2)
-        n4 = Node(("polls", "0004_alter_description"))
-        n4.add_parent(n3)
-        mock_loader.return_value.graph.node_map = {
-            n1.key: n1,
-            n2.key: n2,
-            n3.key: n3,
-            n4.key: n4,
-        }
-        file_contents = json.dumps(
-            [
-                ["polls", "0002_alter_question_question_text"],
-                ["polls", "0003_alter_title"],
-                ["polls", "0004_alter_description"],
-            ]
-        )
-        with mock.patch(
-            "builtins.open", mock.mock_open(read_data=file_contents)
-        ) as mock_open:
-            migrant.stage_two()
-        handle = mock_open()
-        handle.read.assert_called_once()
-
-        mock_call_command.assert_called_once()
-        self.assertTrue(len(mock_call_command.call_args_list), 1)
-        self.assertEqual(
-            mock_call_command.call_args.args, ("migrate", "polls", "0001_initial")
+        # each is unapplied once, children first.
+        n1 = ("polls", "0001_initial")
+        n2 = ("polls", "0002_alter_question_question_text")
+        n3 = ("polls", "0003_alter_title")
+        n4 = ("polls", "0004_alter_description")
+        mock_loader.return_value.graph = graph([n1, n2, n3, n4])
+        mock_loader.return_value.applied_migrations = {n1: n1, n2: n2, n3: n3, n4: n4}
+        self.journal.remaining.return_value = {"default": [n2, n3, n4]}
+        migrant.stage_two()
+
+        executor = mock_executor.return_value
+        executor.run.assert_called_once_with(
+            [n2, n3, n4], [(n4, True), (n3, True), (n2, True)]
         )
+
+    @mock.patch("django_migrant.management.commands.migrant.subprocess", mock.MagicMock())
+    @mock.patch("django_migrant.management.commands.migrant.Path", mock.MagicMock())
+    @mock.patch("django_migrant.executor.MigrantExecutor")
+    @mock.patch("django_migrant.management.commands.migrant.MigrationLoader")
+    def test_migrate_as_single_plan(self, mock_loader, mock_executor):
+        # Rolling back several apps is done as one plan, in a stable order.
+        n1 = ("polls", "0001_initial")
+        n2 = ("polls", "0002_alter_question_question_text")
+        n3 = ("auth", "0001_initial")
+        mock_loader.return_value.graph = graph([n1, n2], [n3])
+        mock_loader.return_value.applied_migrations = {n1: n1, n2: n2, n3: n3}
+        self.journal.remaining.return_value = {"default": [n2, n3]}
+        migrant.stage_two()
+
+        executor = mock_executor.return_value
+        executor.run.assert_called_once_with([n3, n2], [(n3, True), (n2, True)])
+
+    @mock.patch("django_migrant.management.commands.migrant.subprocess", mock.MagicMock())
+    @mock.patch("django_migrant.management.commands.migrant.Path", mock.MagicMock())
+    @mock.patch("django_migrant.executor.MigrantExecutor")
+    @mock.patch("django_migrant.management.commands.migrant.MigrationLoader")
+    def test_other_apps_left_alone(self, mock_loader, mock_executor):
+        # polls.0002 depends on auth.0001, but auth.0002 doesn't depend on it,
+        # so it stays applied.
+        n1 = ("auth", "0001_initial")
+        n2 = ("auth", "0002_alter_user")
+        n3 = ("polls", "0001_initial")
+        n4 = ("polls", "0002_question_author")
+        mock_loader.return_value.graph = graph([n1, n2], [n3, n4])
+        mock_loader.return_value.graph.add_dependency(n4, n4, n1)
+        mock_loader.return_value.applied_migrations = {n1: n1, n2: n2, n3: n3, n4: n4}
+        self.journal.remaining.return_value = {"default": [n4]}
+        migrant.stage_two()
+
+        executor = mock_executor.return_value
+        executor.run.assert_called_once_with([n4], [(n4, True)])
@@ -0,0 +1,117 @@
+import os
+from pathlib import Path
+from tempfile import TemporaryDirectory
+from unittest import mock
+
+from django.db import migrations, models
+from django.db.migrations.state import ModelState, ProjectState
+from django.test import override_settings
+
+from django_migrant.loader import LazyMigration
+from django_migrant.states import StateCache
+from tests.testcases import DjangoSetupTestCase
+
+
+def migration(app_label, name):
+    migration = migrations.Migration(name, app_label)
+    migration.operations = [
+        migrations.CreateModel(
+            f"Model{name}", [("id", models.AutoField(primary_key=True))]
+        )
+    ]
+    return migration
+
+
+class TestStateCache(DjangoSetupTestCase):
+
+    def setUp(self):
+        super().setUp()
+        self.temp_dir = TemporaryDirectory()
+        self.cache = StateCache(Path(self.temp_dir.name) / "states")
+        self.loader = mock.Mock(shas={("polls", "0001"): "a", ("polls", "0002"): "b"})
+        self.migrations = [migration("polls", "0001"), migration("polls", "0002")]
+
+    def tearDown(self):
+        self.temp_dir.cleanup()
+        super().tearDown()
+
+    def state(self, *names):
+        state = ProjectState(real_apps={"django_migrant"})
+        for name in names:
+            state.add_model(
+                ModelState("polls", name, [("id", models.AutoField(primary_key=True))])
+            )
+        return state
+
+    def test_key(self):
+        key = self.cache.key(self.loader, set(), self.migrations)
+        self.assertEqual(key, self.cache.key(self.loader, set(), self.migrations))
+        # The order, the files and the unmigrated apps all matter.
+        self.assertNotEqual(
+            key, self.cache.key(self.loader, set(), self.migrations[::-1])
+        )
+        self.assertNotEqual(key, self.cache.key(self.loader, {"auth"}, self.migrations))
+        self.loader.shas[("polls", "0002")] = "c"
+        self.assertNotEqual(key, self.cache.key(self.loader, set(), self.migrations))
+
+    def test_key_swappable_settings(self):
+        # Migrations depending on a swappable model resolve it from the settings.
+        key = self.cache.key(self.loader, set(), self.migrations)
+        with override_settings(AUTH_USER_MODEL="accounts.User"):
+            self.assertNotEqual(
+                key, self.cache.key(self.loader, set(), self.migrations)
+            )
+
+    def test_key_unknown_file(self):
+        # Read from somewhere other than a file, eg git, without a sha.
+        other = migration("polls", "0003")
+        with mock.patch("django_migrant.states.file_sha", return_value=None):
+            self.assertIsNone(
+                self.cache.key(self.loader, set(), [*self.migrations, other])
+            )
+
+    def test_key_unloaded_proxy(self):
+        # A migration that hasn't been loaded can't be told apart by its file.
+        proxy = LazyMigration(
+            "0003",
+            "polls",
+            {"dependencies": [], "replaces": [], "run_before": []},
+            load=mock.Mock(),
+        )
+        self.assertIsNone(self.cache.key(self.loader, set(), [*self.migrations, proxy]))
+        proxy._load.assert_not_called()
+
+    def test_put_get(self):
+        self.assertIsNone(self.cache.get("key"))
+        state = self.state("Question")
+        self.cache.put("key", state)
+
+        cached = self.cache.get("key")
+        self.assertEqual(cached.models, state.models)
+        self.assertEqual(cached.real_apps, {"django_migrant"})
+        # It renders as any other state would.
+        self.assertEqual(
+            cached.apps.get_model("polls", "Question").__name__, "Question"
+        )
+
+    def test_unpicklable(self):
+        state = ProjectState()
+        state.add_model(
+            ModelState(
+                "polls",
+                "Question",
+                [("votes", models.IntegerField(default=lambda: 0))],
+            )
+        )
+        self.cache.put("key", state)
+        self.assertIsNone(self.cache.get("key"))
+
+    def test_evict(self):
+        self.cache.put("old", self.state("Question"))
+        self.cache.budget = self.cache.location("old").stat().st_size
+        os.utime(self.cache.location("old"), (1, 1))
+        self.cache.put("new", self.state("Question", "Answer"))
+
+        # The newest is kept, even though it alone is over budget.
+        self.assertIsNone(self.cache.get("old"))
+        self.assertIsNotNone(self.cache.get("new"))
@@ -0,0 +1,113 @@
+import json
+import unittest
+from pathlib import Path
+from tempfile import TemporaryDirectory
+from unittest import mock
+
+from django_migrant.tracing import Tracer, read, summarise
+
+
+class TestTracer(unittest.TestCase):
+
+    def setUp(self):
+        self.temp_dir = TemporaryDirectory()
+        self.path = Path(self.temp_dir.name) / "trace.jsonl"
+
+    def tearDown(self):
+        self.temp_dir.cleanup()
+
+    def spans(self):
+        with open(self.path) as fh:
+            return [json.loads(line) for line in fh]
+
+    def test_disabled(self):
+        tracer = Tracer()
+        with tracer.span("stage_one"):
+            pass
+        self.assertFalse(tracer.enabled)
+        self.assertFalse(self.path.exists())
+
+    def test_span(self):
+        tracer = Tracer(self.path, transition="abc")
+        with tracer.span("stage_one", alias="default") as span:
+            span["restored"] = True
+
+        (span,) = self.spans()
+        self.assertEqual(span["transition"], "abc")
+        self.assertEqual(span["name"], "stage_one")
+        self.assertEqual(span["alias"], "default")
+        self.assertTrue(span["restored"])
+        self.assertGreaterEqual(span["duration"], 0)
+
+    def test_span_error(self):
+        tracer = Tracer(self.path)
+        with self.assertRaises(ValueError):
+            with tracer.span("stage_one"):
+                raise ValueError()
+        self.assertTrue(self.spans()[0]["error"])
+
+    @mock.patch.dict("os.environ", {"DJANGO_MIGRANT_TRANSITION": "abc"})
+    def test_transition_from_environment(self):
+        self.assertEqual(Tracer(self.path).transition, "abc")
+
+    def test_environ(self):
+        tracer = Tracer(self.path, transition="abc")
+        env = tracer.environ(DJANGO_MIGRANT_STAGE="TWO")
+        self.assertEqual(env["DJANGO_MIGRANT_TRANSITION"], "abc")
+        self.assertEqual(env["DJANGO_MIGRANT_STAGE"], "TWO")
+
+    def test_migration_progress(self):
+        tracer = Tracer(self.path)
+        cursor = mock.Mock(rowcount=3)
+        execute = mock.Mock()
+
+        tracer.migration_progress("default", "unapply_start", "polls.0002")
+        context = {"cursor": cursor, "connection": mock.Mock(alias="default")}
+        tracer.count_rows(execute, "DELETE", None, False, context)
+        tracer.migration_progress("default", "unapply_success", "polls.0002")
+
+        (span,) = self.spans()
+        self.assertEqual(span["name"], "unapply")
+        self.assertEqual(span["migration"], "polls.0002")
+        self.assertEqual(span["alias"], "default")
+        self.assertEqual(span["rows"], 3)
+        execute.assert_called_once()
+
+
+class TestSummary(unittest.TestCase):
+
+    def test_read_limit(self):
+        with TemporaryDirectory() as temp_dir:
+            path = Path(temp_dir) / "trace.jsonl"
+            for transition in "abc":
+                Tracer(path, transition=transition).emit("stage_one", 0, 1)
+            with open(path, "a") as fh:
+                fh.write('{"truncated')
+
+            spans = read(path, limit=2)
+
+        self.assertEqual([s["transition"] for s in spans], ["b", "c"])
+
+    def test_read_missing(self):
+        self.assertEqual(read(Path("/does/not/exist")), [])
+
+    def test_summarise(self):
+        spans = [
+            {"name": "stage_one", "duration": 1.0},
+            {"name": "stage_one", "duration": 3.0},
+            {"name": "load", "duration": 0.5},
+            {"name": "unapply", "duration": 2.0, "migration": "polls.0002", "rows": 5},
+            {"name": "apply", "duration": 0.1, "migration": "polls.0002", "rows": 0},
+        ]
+
+        stages, migrations = summarise(spans)
+
+        self.assertEqual([s["name"] for s in stages], ["stage_one", "load"])
+        self.assertEqual(stages[0]["count"], 2)
+        self.assertEqual(stages[0]["mean"], 2.0)
+        self.assertEqual(stages[0]["max"], 3.0)
+        self.assertEqual(
+            [(m["name"], m["action"]) for m in migrations],
+            [("polls.0002", "unapply"), ("polls.0002", "apply")],
+        )
+        self.assertEqual(migrations[0]["rows"], 5)
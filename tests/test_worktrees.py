@@ -0,0 +1,126 @@
+import json
+import os
+from io import StringIO
+from unittest import mock
+
+from django.core.management.base import CommandError
+
+from django_migrant import git, worktrees
+from tests.testcases import GitRepoTestCase
+
+
+class WorktreeTestCase(GitRepoTestCase):
+
+    def setUp(self):
+        super().setUp()
+        self.write("db.sqlite3", "main database")
+        self.head = self.commit()
+        self.worktree = self.root.parent / f"{self.root.name}-wt"
+        self.git("worktree", "add", "--quiet", str(self.worktree), "-b", "wt")
+
+    def tearDown(self):
+        if self.worktree.exists():
+            self.git("worktree", "remove", "--force", str(self.worktree))
+        super().tearDown()
+
+    def connection(self, alias="default", name="db.sqlite3"):
+        connection = mock.Mock(vendor="sqlite", alias=alias)
+        connection.settings_dict = {"NAME": name}
+        connection.is_in_memory_db.return_value = False
+        return connection
+
+
+class TestDatabases(WorktreeTestCase):
+
+    def test_main_worktree_unchanged(self):
+        databases = {"default": {"NAME": "db.sqlite3"}}
+        self.assertEqual(worktrees.databases(databases, self.root), databases)
+
+    def test_no_overrides(self):
+        databases = {"default": {"NAME": "db.sqlite3"}}
+        self.assertEqual(worktrees.databases(databases, self.worktree), databases)
+
+    def test_overrides(self):
+        migrant_dir = self.root / ".git" / "worktrees" / self.worktree.name / "migrant"
+        migrant_dir.mkdir()
+        with open(migrant_dir / worktrees.OVERRIDES_FILENAME, "w") as fh:
+            json.dump({"default": {"NAME": "clone.sqlite3"}}, fh)
+
+        databases = {
+            "default": {"ENGINE": "sqlite3", "NAME": "db.sqlite3"},
+            "other": {"ENGINE": "sqlite3", "NAME": "other.sqlite3"},
+        }
+        self.assertEqual(
+            worktrees.databases(databases, self.worktree / "proj"),
+            {
+                "default": {"ENGINE": "sqlite3", "NAME": "clone.sqlite3"},
+                "other": {"ENGINE": "sqlite3", "NAME": "other.sqlite3"},
+            },
+        )
+
+    def test_project_overrides(self):
+        migrant_dir = self.root / ".git" / "worktrees" / self.worktree.name / "migrant"
+        project_dir = migrant_dir / "projects" / "services-alpha"
+        project_dir.mkdir(parents=True)
+        with open(project_dir / worktrees.OVERRIDES_FILENAME, "w") as fh:
+            json.dump({"default": {"NAME": "clone.sqlite3"}}, fh)
+
+        databases = {"default": {"NAME": "db.sqlite3"}}
+        self.assertEqual(worktrees.databases(databases, self.worktree), databases)
+        self.assertEqual(
+            worktrees.databases(databases, self.worktree, project="services-alpha"),
+            {"default": {"NAME": "clone.sqlite3"}},
+        )
+
+
+class TestProvision(WorktreeTestCase):
+
+    def test_not_a_worktree(self):
+        with self.assertRaises(CommandError):
+            worktrees.provision(["default"], StringIO())
+
+    def test_clones_sqlite(self):
+        os.chdir(self.worktree)
+        connection = self.connection()
+        with mock.patch.dict(worktrees.connections, {"default": connection}):
+            previous = worktrees.provision(["default"], StringIO())
+
+        self.assertEqual(previous, self.head)
+        clone = git.migrant_dir() / "default.sqlite3"
+        # Cloned from the main worktree's database, not the worktree's own.
+        self.assertEqual(clone.read_text(), "main database")
+        self.assertEqual(connection.settings_dict["NAME"], str(clone))
+        overrides = worktrees.databases({"default": {}}, self.worktree)
+        self.assertEqual(overrides, {"default": {"NAME": str(clone)}})
+
+        # A second time, there's nothing to do.
+        with mock.patch.dict(worktrees.connections, {"default": connection}):
+            self.assertIsNone(worktrees.provision(["default"], StringIO()))
+
+    def test_unsupported_vendor_shared(self):
+        os.chdir(self.worktree)
+        connection = mock.Mock(vendor="mysql", settings_dict={"NAME": "db"})
+        out = StringIO()
+        with mock.patch.dict(worktrees.connections, {"default": connection}):
+            worktrees.provision(["default"], out)
+
+        self.assertIn("'default' is shared", out.getvalue())
+        overrides = worktrees.databases({"default": {}}, self.worktree)
+        self.assertEqual(overrides, {"default": {}})
+
+    def test_prunes_removed_worktrees(self):
+        os.chdir(self.worktree)
+        with mock.patch.dict(worktrees.connections, {"default": self.connection()}):
+            worktrees.provision(["default"], StringIO())
+        clone = git.migrant_dir() / "default.sqlite3"
+
+        os.chdir(self.root)
+        out = StringIO()
+        worktrees.prune(out)
+        self.assertEqual(out.getvalue(), "")
+        self.assertTrue(clone.exists())
+
+        self.git("worktree", "remove", "--force", str(self.worktree))
+        worktrees.prune(out)
+        self.assertIn("Dropping database", out.getvalue())
+        self.assertEqual(worktrees.load_registry(), {})
@@ -1,3 +1,8 @@
+import os
+import subprocess
+from pathlib import Path
+from tempfile import TemporaryDirectory
+
 import django
 from django.test import SimpleTestCase
 
@@ -13,3 +18,39 @@ class DjangoSetupTestCase(SimpleTestCase):
         django.setup()
 
         return super().setUp()
+
+
+class GitRepoTestCase(DjangoSetupTestCase):
+    """Runs each test inside a throwaway git repo."""
+
+    def setUp(self):
+        super().setUp()
+        self.temp_dir = TemporaryDirectory()
+        self.root = Path(self.temp_dir.name).resolve()
+        self.cwd = os.getcwd()
+        os.chdir(self.root)
+        self.git("init", "--quiet")
+
+    def tearDown(self):
+        os.chdir(self.cwd)
+        self.temp_dir.cleanup()
+        super().tearDown()
+
+    def git(self, *args):
+        subprocess.run(
+            ["git", "-c", "user.name=a", "-c", "user.email=a@b", *args],
+            check=True,
+            capture_output=True,
+        )
+
+    def write(self, path, content=""):
+        path = self.root / path
+        path.parent.mkdir(parents=True, exist_ok=True)
+        path.write_text(content)
+
+    def commit(self):
+        self.git("add", "-A")
+        self.git("commit", "--quiet", "-m", "commit")
+        return subprocess.run(
+            ["git", "rev-parse", "HEAD"], check=True, capture_output=True, text=True
+        ).stdout.strip()